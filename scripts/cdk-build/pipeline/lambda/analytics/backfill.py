@@ -15,7 +15,7 @@ files compatible with the production pipeline.
 Differences from production Lambda:
 - Reads from local directory (/tmp/podcast-cf-logs/) or old S3 bucket
 - URI pattern: /media/{N}.mp3 (no /awsfr/ prefix)
-- Outputs to s3://podcast-stormacq-net/analytics-state/daily/
+- Outputs to s3://podcast-stormacq-net/analytics-state/ (daily/ or monthly/ files)
 
 Usage:
     python3 backfill.py --local /tmp/podcast-cf-logs/
@@ -24,7 +24,6 @@ Usage:
     python3 backfill.py --dry-run --local /tmp/podcast-cf-logs/  # preview without uploading
 """
 import argparse
-import json
 import os
 import sys
 import gzip
@@ -33,6 +32,7 @@ import re
 import glob
 import collections
 import logging
+import operator
 from datetime import datetime, timezone
 from urllib.parse import unquote
 
@@ -43,15 +43,18 @@ logger = logging.getLogger(__name__)
 
 # Import filtering logic from the production handler
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from handler import is_bot, truncate_ipv6, BOT_PATTERNS
-
-# Old URI pattern: /media/{N}.mp3 (without /awsfr/ prefix)
-OLD_MP3_URI_PATTERN = re.compile(r'^/media/(\d+)\.mp3$')
+from handler import (Show, compile_uri_pattern, is_bot, truncate_ipv6, listener_key, deduplicate,
+                     filter_sessions, write_daily_aggregate, load_hash_secret, keyed_hash)
+from hll import HyperLogLog
+from storage import S3Storage
 
 # Output configuration
 OUTPUT_BUCKET = 'podcast-stormacq-net'
-OUTPUT_PREFIX = 'analytics-state/daily/'
-FILE_THRESHOLD = 960000  # 960KB minimum
+ANALYTICS_STATE_KEY = 'analytics-state/analytics-summary.json'
+
+# Old URIs: /media/{N}.mp3 (without /awsfr/ prefix), all of the awsfr show
+OLD_SHOW_ROUTES = [Show('awsfr', '/media/', 'analytics-state/', 'awsfr/site/data/analytics.json', '')]
+OLD_MP3_URI_PATTERN = compile_uri_pattern(OLD_SHOW_ROUTES)
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Backfill historical CloudFront logs')
@@ -151,8 +154,8 @@ def parse_line(line):
     uri = fields[7]
     status_str = fields[8]
     ua_raw = fields[10]
-    sc_range_start = fields[30] if len(fields) > 30 else '-'
-    sc_range_end = fields[31] if len(fields) > 31 else '-'
+    sc_range_start = fields[31] if len(fields) > 31 else '-'
+    sc_range_end = fields[32] if len(fields) > 32 else '-'
 
     # Only GET
     if method != 'GET':
@@ -171,7 +174,7 @@ def parse_line(line):
     if not match:
         return None
 
-    episode = match.group(1)
+    episode = match.group(2)
     ua = unquote(ua_raw) if ua_raw != '-' else ''
 
     try:
@@ -179,14 +182,18 @@ def parse_line(line):
     except ValueError:
         sc_bytes = 0
 
+    # Byte range of a 206 response
+    range_start = range_end = None
+    try:
+        if sc_range_start != '-':
+            range_start = int(sc_range_start)
+        if sc_range_end != '-':
+            range_end = int(sc_range_end)
+    except ValueError:
+        range_start = range_end = None
+
     # 2-byte range probe detection
-    is_range_probe = False
-    if sc_range_start != '-' and sc_range_end != '-':
-        try:
-            if int(sc_range_start) == 0 and int(sc_range_end) == 1:
-                is_range_probe = True
-        except ValueError:
-            pass
+    is_range_probe = range_start == 0 and range_end == 1
 
     return {
         'date': date_str,
@@ -196,6 +203,8 @@ def parse_line(line):
         'episode': episode,
         'sc_bytes': sc_bytes,
         'status': status,
+        'range_start': range_start,
+        'range_end': range_end,
         'is_range_probe': is_range_probe,
     }
 
@@ -214,23 +223,16 @@ def apply_filters(records):
             continue
         if r['is_range_probe']:
             continue
-        if r['sc_bytes'] < FILE_THRESHOLD:
-            continue
         if ip_day_counts[(r['date'], r['ip'])] > 1000:
             continue
         filtered.append(r)
 
-    # Deduplicate
-    seen = set()
-    deduplicated = []
-    for r in sorted(filtered, key=lambda x: (x['date'], x['time'])):
-        ip = truncate_ipv6(r['ip'])
-        key = (r['date'], ip, r['ua'], r['episode'])
-        if key not in seen:
-            seen.add(key)
-            deduplicated.append(r)
+    # Below-threshold sessions (range requests add up per IP/64 + UA + episode)
+    filtered = filter_sessions(filtered, fields=operator.itemgetter(
+        'date', 'ip', 'ua', 'episode', 'status', 'sc_bytes', 'range_start', 'range_end'))
 
-    return deduplicated
+    # Deduplicate
+    return deduplicate(filtered, fields=operator.itemgetter('date', 'time', 'ip', 'ua', 'episode'))
 
 
 def aggregate_by_day(records):
@@ -239,6 +241,8 @@ def aggregate_by_day(records):
         'downloads': 0,
         'listeners': set(),
         'episodes': collections.Counter(),
+        'sketch': HyperLogLog(),
+        'episode_sketches': collections.defaultdict(HyperLogLog),
     })
 
     for r in records:
@@ -247,6 +251,9 @@ def aggregate_by_day(records):
         daily[date]['downloads'] += 1
         daily[date]['listeners'].add((ip, r['ua']))
         daily[date]['episodes'][r['episode']] += 1
+        listener_hash = keyed_hash(listener_key(ip, r['ua']))
+        daily[date]['sketch'].add_hash(listener_hash)
+        daily[date]['episode_sketches'][r['episode']].add_hash(listener_hash)
 
     # Convert to JSON-serializable
     result = {}
@@ -257,29 +264,33 @@ def aggregate_by_day(records):
             'listeners': len(data['listeners']),
             'episodes': dict(data['episodes']),
             'countries': {},  # No GeoIP for historical (would need .mmdb)
+            'listenerSketch': data['sketch'].to_string(),
+            'episodeListenerSketches': {
+                ep: data['episode_sketches'][ep].to_string() for ep in data['episodes']
+            },
         }
     return result
 
 
 def upload_daily_files(daily_metrics, session, dry_run=False):
-    """Upload daily aggregate files to S3."""
-    s3 = session.client('s3', region_name='eu-central-1')
-    
-    for date, data in sorted(daily_metrics.items()):
-        year = date[:4]
-        key = f"{OUTPUT_PREFIX}{year}/{date}.json"
-        body = json.dumps(data, ensure_ascii=False)
-        
-        if dry_run:
-            logger.info(f"  [DRY-RUN] Would upload {key}: {data['downloads']} downloads, {data['listeners']} listeners")
-        else:
-            s3.put_object(
-                Bucket=OUTPUT_BUCKET,
-                Key=key,
-                Body=body,
-                ContentType='application/json'
-            )
-            logger.info(f"  Uploaded {key}: {data['downloads']} downloads, {data['listeners']} listeners")
+    """Upload daily aggregates through the pipeline's daily/monthly layout.
+
+    Days of months already compacted by the pipeline are merged into their
+    monthly file; the others become daily files that the next pipeline run
+    compacts.
+    """
+    if dry_run:
+        for date, data in sorted(daily_metrics.items()):
+            logger.info(f"  [DRY-RUN] Would upload {date}: {data['downloads']} downloads, {data['listeners']} listeners")
+        return
+
+    storage = S3Storage(session.client('s3', region_name='eu-central-1'))
+    write_daily_aggregate(dict(sorted(daily_metrics.items())), storage=storage, bucket=OUTPUT_BUCKET)
+
+    # Daily files changed outside the pipeline: drop its rolling state so
+    # the next Lambda run rebuilds it from the daily files
+    storage.delete(OUTPUT_BUCKET, [ANALYTICS_STATE_KEY])
+    logger.info(f"  Invalidated {ANALYTICS_STATE_KEY}")
 
 
 def main():
@@ -304,6 +315,8 @@ def main():
 
     # Process in monthly batches for memory efficiency
     output_session = boto3.Session(profile_name=args.profile)
+    # Listener sketches must be keyed like the Lambda's
+    load_hash_secret(output_session.client('ssm', region_name='eu-central-1'))
     all_records = []
     total_raw = 0
     total_filtered = 0
@@ -332,6 +345,7 @@ def main():
     total_filtered = len(deduplicated)
     logger.info(f"After filtering + dedup: {total_filtered} unique downloads")
     logger.info(f"Filtered out: {total_raw - total_filtered} ({(total_raw - total_filtered) / max(total_raw, 1) * 100:.1f}%)")
+    logger.info(f"Bot verdict cache: {is_bot.cache_info()}")
 
     # Aggregate by day
     daily_metrics = aggregate_by_day(deduplicated)
@@ -341,16 +355,18 @@ def main():
     upload_daily_files(daily_metrics, output_session, dry_run=args.dry_run)
 
     # Summary
-    monthly_totals = collections.defaultdict(lambda: {'downloads': 0, 'listeners': 0})
+    monthly_totals = collections.defaultdict(lambda: {'downloads': 0, 'listeners': 0, 'sketch': HyperLogLog()})
     for date, data in daily_metrics.items():
         month = date[:7]
         monthly_totals[month]['downloads'] += data['downloads']
         monthly_totals[month]['listeners'] += data['listeners']
+        monthly_totals[month]['sketch'].merge(HyperLogLog.from_string(data['listenerSketch']))
 
     logger.info("\n=== Monthly Summary ===")
     for month in sorted(monthly_totals.keys()):
         t = monthly_totals[month]
-        logger.info(f"  {month}: {t['downloads']:,} downloads, {t['listeners']:,} daily-unique-listeners (sum, not deduped across days)")
+        logger.info(f"  {month}: {t['downloads']:,} downloads, {t['sketch'].count():,} unique listeners "
+                    f"({t['listeners']:,} summed daily uniques)")
 
     logger.info("\nBackfill complete!")
 
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Bot Detection Micro-Benchmark
+
+Compares the per-call cost of the original substring scan over
+BOT_PATTERNS with the compiled BOT_MATCHER, both uncached and through the
+LRU verdict cache used by handler.is_bot. User agents are taken from the
+sample CloudFront log fixture and replayed with a realistic repeat rate.
+
+Usage:
+    python3 benchmarks/bot_detection.py
+    python3 benchmarks/bot_detection.py --calls 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from urllib.parse import unquote
+
+ANALYTICS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ANALYTICS_DIR)
+from handler import BOT_MATCHER, BOT_PATTERNS, is_bot
+
+FIXTURE = os.path.join(ANALYTICS_DIR, 'tests', 'fixtures', 'sample-cloudfront-log.txt')
+
+
+def is_bot_substring_scan(ua):
+    """The original is_bot: lowercase, then one substring scan per pattern."""
+    if not ua or len(ua) < 5:
+        return True
+    ua_lower = ua.lower()
+    if ua_lower.startswith('atc/'):
+        return True
+    if '(null)/(null) watchos' in ua_lower:
+        return True
+    return any(p in ua_lower for p in BOT_PATTERNS)
+
+
+def is_bot_compiled_uncached(ua):
+    """is_bot without the verdict cache."""
+    if not ua or len(ua) < 5:
+        return True
+    return BOT_MATCHER.search(ua.lower()) is not None
+
+
+def load_user_agents():
+    user_agents = []
+    with open(FIXTURE, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) > 10 and fields[10] != '-':
+                user_agents.append(unquote(fields[10]))
+    return user_agents
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bot detection')
+    parser.add_argument('--calls', type=int, default=200000, help='Calls per implementation')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    user_agents = load_user_agents()
+    rng = random.Random(args.seed)
+    workload = [rng.choice(user_agents) for _ in range(args.calls)]
+    print(f"{len(set(user_agents))} distinct user agents, {args.calls:,} calls each")
+
+    for ua in set(workload):
+        assert is_bot_substring_scan(ua) == is_bot(ua), ua
+
+    implementations = [
+        ('substring scan (before)', is_bot_substring_scan),
+        ('compiled regex, uncached', is_bot_compiled_uncached),
+        ('compiled regex + LRU (is_bot)', is_bot),
+    ]
+    for name, fn in implementations:
+        seconds = timeit.timeit(lambda: [fn(ua) for ua in workload], number=1)
+        print(f"  {name:32s} {seconds / args.calls * 1e9:8.0f} ns/call")
+    print(f"  {is_bot.cache_info()}")
+
+
+if __name__ == '__main__':
+    main()
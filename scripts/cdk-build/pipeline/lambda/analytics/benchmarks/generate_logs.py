@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Synthetic CloudFront Log Generator
+
+Writes seeded, gzipped CloudFront standard logs (W3C, all 33 fields) in the
+local storage layout used by run_local.py:
+
+    ROOT/logs/cloudfront-logs/E2SYNTHETIC.YYYY-MM-DD-HH.xxxxxxxx.gz
+
+Traffic mix per line: RSS feed polls, artwork, and MP3 requests from a
+listener population (podcast apps, browsers, watchOS, ~30% IPv6) with
+full downloads, partial ranges, 2-byte range probes, HEAD/304/404
+requests, plus bots and a few excessive IPs (> 1000 requests per day).
+The same seed and options always produce the same files.
+
+Usage:
+    python3 benchmarks/generate_logs.py --root /tmp/analytics-bench --lines 100000
+    python3 benchmarks/generate_logs.py --root /tmp/analytics-bench --lines 50000000 --days 30
+"""
+import argparse
+import base64
+import gzip
+import io
+import os
+import random
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+LOG_FIELDS = (
+    'date time x-edge-location sc-bytes c-ip cs-method cs(Host) cs-uri-stem sc-status '
+    'cs(Referer) cs(User-Agent) cs-uri-query cs(Cookie) x-edge-result-type x-edge-request-id '
+    'x-host-header cs-protocol cs-bytes time-taken x-forwarded-for ssl-protocol ssl-cipher '
+    'x-edge-response-result-type cs-protocol-version fle-status fle-encrypted-fields c-port '
+    'time-to-first-byte x-edge-detailed-result-type sc-content-type sc-content-len '
+    'sc-range-start sc-range-end'
+)
+HEADER = f"#Version: 1.0\n#Fields: {LOG_FIELDS}\n"
+
+DISTRIBUTION_ID = 'E2SYNTHETIC'
+CLOUDFRONT_HOST = 'd3opuvqnq5rtvu.cloudfront.net'
+SITE_HOST = 'podcast.stormacq.net'
+EDGE_LOCATIONS = ['CDG55-P2', 'CDG50-C1', 'FRA56-P5', 'AMS1-C1', 'BRU50-C1', 'ZRH55-P1', 'YUL62-C2']
+
+# (user agent, weight) of listeners' apps
+PODCAST_APPS = [
+    ('AppleCoreMedia/1.0.0.21G115 (iPhone; U; CPU OS 17_5_1 like Mac OS X; fr_fr)', 30),
+    ('Podcasts/1.1.0 CFNetwork/1496.0.7 Darwin/23.5.0', 10),
+    ('Spotify/8.9.58 iOS/17.5.1 (iPhone15,2)', 15),
+    ('Spotify/8.9.58 Android/34 (SM-S918B)', 8),
+    ('Overcast/3.0 (+http://overcast.fm/; iOS podcast app)', 6),
+    ('PodcastAddict/v5 (+https://podcastaddict.com/; Android podcast app)', 6),
+    ('Pocket Casts/7.66 (iOS; iPhone14,5)', 4),
+    ('Deezer/9.0.0 (Android; 14; Mobile; fr)', 4),
+    ('Castro 2024.5/1422 Like iTunes', 2),
+    ('stagefright/1.2 (Linux;Android 14)', 3),
+    ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15', 5),
+    ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36', 5),
+    ('atc/1.0 watchOS/10.5 model/Watch6,1 hwmodel/N197bAP build/21T576 (6; dt:294)', 2),
+]
+BOT_AGENTS = [
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)',
+    'facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)',
+    'python-requests/2.32.3',
+    'curl/8.7.1',
+    'Go-http-client/2.0',
+    'Podchaser-Parser',
+    '',
+]
+FEED_READERS = [
+    'iTunes/12.12 (Macintosh; OS X 14.5) AppleWebKit/618.2.12',
+    'Overcast/1.0 Podcast Sync (3 subscribers; feed-id=123456; +http://overcast.fm/)',
+    'PocketCasts/1.0 (Pocket Casts Feed Parser; +http://pocketcasts.com/)',
+    'Spotify/1.0',
+    'Feedly/1.0 (+http://www.feedly.com/fetcher.html; 52 subscribers)',
+]
+
+EPISODE_SIZE = 20840166
+FIRST_EPISODE, LAST_EPISODE = 200, 381
+
+
+class ListenerPool:
+    """Listeners (IP, user agent) with their request habits."""
+
+    def __init__(self, rng, size):
+        apps, weights = zip(*PODCAST_APPS)
+        chosen = rng.choices(apps, weights=weights, k=size)
+        self.listeners = [(_random_ip(rng), quote(ua, safe='/;:+()=,')) for ua in chosen]
+        self.rng = rng
+
+    def pick(self):
+        # Skewed towards the start of the pool: regular listeners come back
+        # often, a long tail shows up once
+        return self.listeners[int(len(self.listeners) * self.rng.random() ** 2)]
+
+
+def _random_ip(rng):
+    if rng.random() < 0.3:
+        # IPv6 clients, several of them sharing a /64
+        prefix = '2a01:cb%02x:%x:%x' % (rng.randrange(256), rng.randrange(0x10000), rng.randrange(64))
+        return '%s:%x:%x:%x:%x' % (prefix, *(rng.randrange(0x10000) for _ in range(4)))
+    return '%d.%d.%d.%d' % (rng.choice([78, 82, 86, 88, 90, 92, 109, 176, 185, 193]),
+                            rng.randrange(256), rng.randrange(256), rng.randrange(1, 255))
+
+
+def _episode(rng):
+    # Recent episodes dominate
+    return LAST_EPISODE - min(int(rng.expovariate(1 / 12)), LAST_EPISODE - FIRST_EPISODE)
+
+
+class LineFactory:
+    """Builds 33-field log lines."""
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def line(self, date, time, ip, method, uri, status, ua, sc_bytes,
+             content_type='audio/mpeg', content_len=EPISODE_SIZE, range_start='-', range_end='-'):
+        rng = self.rng
+        hit = rng.choice(('Hit', 'Hit', 'Hit', 'Miss', 'RefreshHit'))
+        request_id = base64.urlsafe_b64encode(rng.randbytes(42)).decode('ascii')
+        return '\t'.join((
+            date, time, rng.choice(EDGE_LOCATIONS), str(sc_bytes), ip, method, CLOUDFRONT_HOST,
+            uri, str(status), '-', ua or '-', '-', '-', hit, request_id, SITE_HOST, 'https',
+            str(rng.randrange(60, 400)), '%.3f' % rng.uniform(0.001, 2.5), '-', 'TLSv1.3',
+            'TLS_AES_128_GCM_SHA256', hit, rng.choice(('HTTP/2.0', 'HTTP/1.1')), '-', '-',
+            str(rng.randrange(1024, 65535)), '%.3f' % rng.uniform(0.001, 0.3), hit,
+            content_type, str(content_len), range_start, range_end,
+        ))
+
+
+class TrafficGenerator:
+    """Draws one request at a time from the configured traffic mix."""
+
+    def __init__(self, rng, lines_per_day):
+        self.rng = rng
+        self.factory = LineFactory(rng)
+        self.pool = ListenerPool(rng, max(100, lines_per_day // 8))
+        # Enough excessive IPs for ~3% of the traffic, each well over 1000/day
+        self.excessive_ips = [_random_ip(rng) for _ in range(max(1, lines_per_day * 3 // 100 // 1500))]
+        self.excessive_share = 0.03 if lines_per_day >= 1500 else 0.0
+
+    def request(self, date, time):
+        rng = self.rng
+        make = self.factory.line
+        r = rng.random()
+        if r < self.excessive_share:
+            ip = rng.choice(self.excessive_ips)
+            return make(date, time, ip, 'GET', f'/awsfr/media/{_episode(rng)}.mp3', 200,
+                        quote('Mozilla/5.0 (X11; Linux x86_64) Chrome/120.0'), EPISODE_SIZE)
+        if r < 0.40:
+            return make(date, time, _random_ip(rng), 'GET', '/awsfr/feed.xml',
+                        rng.choice((200, 200, 304)), quote(rng.choice(FEED_READERS), safe='/;:+()=,'),
+                        rng.randrange(80000, 120000), 'application/rss+xml', 98000)
+        if r < 0.45:
+            return make(date, time, _random_ip(rng), 'GET', '/awsfr/img/cover-3000.jpg', 200,
+                        quote(rng.choice(PODCAST_APPS)[0], safe='/;:+()=,'), 412000, 'image/jpeg', 412000)
+        if r < 0.52:
+            ua = quote(rng.choice(BOT_AGENTS), safe='/;:+()=,')
+            return make(date, time, _random_ip(rng), 'GET', f'/awsfr/media/{_episode(rng)}.mp3', 200, ua,
+                        EPISODE_SIZE)
+
+        ip, ua = self.pool.pick()
+        uri = f'/awsfr/media/{_episode(rng)}.mp3'
+        kind = rng.random()
+        if kind < 0.12:
+            return make(date, time, ip, 'GET', uri, 206, ua, 2 + rng.randrange(400, 700), range_start='0', range_end='1')
+        if kind < 0.17:
+            return make(date, time, ip, 'HEAD', uri, 200, ua, 0)
+        if kind < 0.20:
+            return make(date, time, ip, 'GET', uri, rng.choice((304, 404, 403)), ua, rng.randrange(200, 600))
+        if kind < 0.55:
+            start = rng.choice((0, 0, 0, 1048576, 5242880, 10485760))
+            length = min(EPISODE_SIZE - start, rng.choice((65536, 524288, 2097152, 8388608, EPISODE_SIZE)))
+            return make(date, time, ip, 'GET', uri, 206, ua, length,
+                        range_start=str(start), range_end=str(start + length - 1))
+        sc_bytes = EPISODE_SIZE if rng.random() < 0.8 else rng.randrange(100000, EPISODE_SIZE)
+        return make(date, time, ip, 'GET', uri, 200, ua, sc_bytes)
+
+
+def generate(root, lines, days=1, start=None, seed=42, files_per_hour=1):
+    """Write `lines` log lines spread over `days` days of hourly files; returns their paths."""
+    rng = random.Random(seed)
+    start = datetime.strptime(start, '%Y-%m-%d') if start else datetime(2026, 7, 1)
+    out_dir = os.path.join(root, 'logs', 'cloudfront-logs')
+    os.makedirs(out_dir, exist_ok=True)
+
+    traffic = TrafficGenerator(rng, max(1, lines // days))
+    hours = days * 24
+    files = []
+    # Daytime hours carry more traffic than nights
+    hour_weights = [0.4 + 1.2 * (7 <= (h % 24) <= 22) for h in range(hours)]
+    total_weight = sum(hour_weights)
+    remaining = lines
+    for h in range(hours):
+        hour_lines = remaining if h == hours - 1 else round(lines * hour_weights[h] / total_weight)
+        hour_lines = min(hour_lines, remaining)
+        remaining -= hour_lines
+        moment = start + timedelta(hours=h)
+        date = moment.strftime('%Y-%m-%d')
+        for part in range(files_per_hour):
+            n = hour_lines // files_per_hour + (part < hour_lines % files_per_hour)
+            seconds = sorted(rng.randrange(3600) for _ in range(n))
+            name = f"{DISTRIBUTION_ID}.{moment:%Y-%m-%d-%H}.{rng.getrandbits(32):08x}.gz"
+            path = os.path.join(out_dir, name)
+            # mtime=0 and no file name in the gzip header keep output byte-identical
+            with open(path, 'wb') as raw, \
+                    gzip.GzipFile(filename='', fileobj=raw, mode='wb', compresslevel=6, mtime=0) as gz, \
+                    io.TextIOWrapper(gz, encoding='utf-8') as f:
+                f.write(HEADER)
+                for s in seconds:
+                    f.write(traffic.request(date, f"{moment.hour:02d}:{s // 60:02d}:{s % 60:02d}"))
+                    f.write('\n')
+            files.append(path)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic CloudFront logs')
+    parser.add_argument('--root', required=True, help='Local storage root (logs go to ROOT/logs/cloudfront-logs/)')
+    parser.add_argument('--lines', type=int, default=100000, help='Total log lines (default: 100000)')
+    parser.add_argument('--days', type=int, default=1, help='Days of hourly files (default: 1)')
+    parser.add_argument('--start', default='2026-07-01', help='First day, YYYY-MM-DD (default: 2026-07-01)')
+    parser.add_argument('--files-per-hour', type=int, default=1, help='Log files per hour (default: 1)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    files = generate(args.root, args.lines, args.days, args.start, args.seed, args.files_per_hour)
+    size = sum(os.path.getsize(f) for f in files)
+    print(f"Wrote {args.lines:,} lines in {len(files)} files ({size / 1e6:.1f} MB gzipped) "
+          f"under {os.path.join(args.root, 'logs')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Analytics Pipeline Benchmark Suite
+
+Times each stage of the pipeline over a local log set (see
+generate_logs.py), from reading and parsing through compute_analytics_json,
+then a full handler.main() run. Stages run in pipeline order in one
+process, through the local storage backend, so no network is involved.
+
+For every stage it reports wall time, lines/s (CloudFront log lines the
+stage stands for), MB/s of uncompressed log data and the process's peak
+RSS so far. Peak RSS is a high-water mark: a stage that allocates less
+than an earlier one reports the same value. Use --json to save the
+results as a baseline for comparing optimisations.
+
+Usage:
+    python3 benchmarks/run_benchmarks.py --lines 1000000
+    python3 benchmarks/run_benchmarks.py --root /tmp/analytics-bench --json baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+ANALYTICS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ANALYTICS_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from metrics import peak_memory_mb
+
+LOG_BUCKET = 'logs'
+WEBSITE_BUCKET = 'website'
+
+
+class Stages:
+    """Collects timings; each stage stands for a number of log lines and bytes."""
+
+    def __init__(self):
+        self.lines = 0
+        self.raw_bytes = 0
+        self.results = []
+
+    def run(self, name, fn, measure=None):
+        """Time fn(). measure(value) -> (lines, raw_bytes) sets the input size of later stages."""
+        started = time.perf_counter()
+        value = fn()
+        seconds = time.perf_counter() - started
+        if measure is not None:
+            self.lines, self.raw_bytes = measure(value)
+        lines, raw_bytes = self.lines, self.raw_bytes
+        self.results.append({
+            'stage': name,
+            'seconds': round(seconds, 3),
+            'lines_per_second': round(lines / seconds) if seconds and lines else None,
+            'mb_per_second': round(raw_bytes / 1e6 / seconds, 1) if seconds and raw_bytes else None,
+            'peak_rss_mb': peak_memory_mb(),
+        })
+        return value
+
+    def print(self):
+        print(f"{'stage':34s} {'seconds':>9s} {'lines/s':>12s} {'MB/s':>8s} {'peak RSS MB':>12s}")
+        for r in self.results:
+            lines_s = f"{r['lines_per_second']:,}" if r['lines_per_second'] else '-'
+            mb_s = f"{r['mb_per_second']:.1f}" if r['mb_per_second'] else '-'
+            print(f"{r['stage']:34s} {r['seconds']:9.3f} {lines_s:>12s} {mb_s:>8s} {r['peak_rss_mb']:12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the analytics pipeline stages')
+    parser.add_argument('--root', help='Local storage root with ROOT/logs/cloudfront-logs/*.gz '
+                                       '(default: generate into a temporary folder)')
+    parser.add_argument('--lines', type=int, default=200000, help='Lines to generate without --root')
+    parser.add_argument('--days', type=int, default=2, help='Days to generate without --root')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    temp_root = None
+    root = args.root
+    if root is None:
+        from generate_logs import generate
+        root = temp_root = tempfile.mkdtemp(prefix='analytics-bench-')
+        started = time.perf_counter()
+        generate(root, args.lines, args.days, seed=args.seed)
+        print(f"Generated {args.lines:,} lines in {time.perf_counter() - started:.1f}s under {root}")
+    # Stages write their outputs to a scratch website bucket
+    shutil.rmtree(os.path.join(root, WEBSITE_BUCKET), ignore_errors=True)
+
+    # handler reads its configuration at import time
+    os.environ.update({
+        'STORAGE_BACKEND': 'local', 'LOCAL_STORAGE_ROOT': root,
+        'LOG_BUCKET': LOG_BUCKET, 'WEBSITE_BUCKET': WEBSITE_BUCKET,
+        'OP3_ENABLED': 'false', 'SNS_TOPIC_ARN': '',
+    })
+    os.environ.setdefault('HASH_SECRET', 'benchmark')
+    import logging
+    import handler
+    logging.getLogger().setLevel(logging.WARNING)
+
+    try:
+        log_files = sorted(handler._get_storage().list(LOG_BUCKET, handler.LOG_PREFIX),
+                           key=lambda obj: obj['LastModified'])
+        compressed = sum(obj['Size'] for obj in log_files)
+
+        def read_lines():
+            lines = raw_bytes = 0
+            keys = [obj['Key'] for obj in log_files]
+            for _, data, error in handler.fetch_objects(LOG_BUCKET, keys):
+                if error is not None:
+                    raise error
+                for line in handler.iter_log_lines(handler.io.BytesIO(data)):
+                    if not line.startswith(b'#'):
+                        lines += 1
+                    raw_bytes += len(line)
+            return lines, raw_bytes
+
+        stages = Stages()
+        lines, raw_bytes = stages.run('read + gunzip', read_lines, measure=lambda sizes: sizes)
+
+        records = stages.run('parse_and_filter_logs', lambda: handler.parse_and_filter_logs(log_files))
+        aggregator = stages.run('DailyAggregator.add_all', lambda: handler.DailyAggregator().add_all(records))
+        merged = stages.run('merge_daily_downloads', lambda: handler.merge_daily_downloads(aggregator))
+        changes = stages.run('write_daily_aggregate',
+                             lambda: handler.write_daily_aggregate(merged[0], previous=merged[1]))
+        handler.write_day_states(merged[2])
+        analytics = stages.run('compute_analytics_json', handler.compute_analytics_json)
+
+        shutil.rmtree(os.path.join(root, WEBSITE_BUCKET), ignore_errors=True)
+        handler._geoip_cache.clear()
+        result = stages.run('handler.main (end to end)', lambda: handler.main({}, None))
+
+        print(f"\n{len(log_files)} files, {compressed / 1e6:.1f} MB gzipped, {raw_bytes / 1e6:.1f} MB raw, "
+              f"{lines:,} lines -> {len(records):,} MP3 requests -> {aggregator.unique:,} downloads "
+              f"over {len(changes)} days ({sum(day['downloads'] for _, day in changes):,} written); "
+              f"analytics.json {len(json.dumps(analytics)) / 1e3:.0f} kB")
+        print(f"main(): {result['body']}\n")
+        stages.print()
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({
+                    'python': platform.python_version(),
+                    'machine': platform.machine(),
+                    'files': len(log_files),
+                    'lines': lines,
+                    'compressed_bytes': compressed,
+                    'raw_bytes': raw_bytes,
+                    'stages': stages.results,
+                }, f, indent=2)
+            print(f"\nResults written to {args.json}")
+    finally:
+        if temp_root:
+            shutil.rmtree(temp_root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
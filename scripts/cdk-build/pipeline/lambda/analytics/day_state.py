@@ -0,0 +1,334 @@
+"""
+Per-Day Deduplication State
+
+CloudFront delivers one UTC day of logs across many hourly files, so several
+pipeline runs contribute to the same day. DayState is the compact record of
+what earlier runs already counted for a day, letting each run merge its new
+downloads into the day aggregate with correct cross-run deduplication:
+
+- one row per deduplication key (IP/64 + UA + episode) and raw IP that
+  sent eligible requests: 64-bit hashes of the key, of the listener
+  (IP/64 + UA) and of the raw IP, the time and arrival order of its
+  earliest request, dictionary-encoded episode and country, and whether
+  the key's download is attributed to it
+- request counts per raw-IP hash, for the excessive-IP rule, which applies
+  to the whole day rather than to one run
+- the byte ranges served so far by rows still below the download
+  threshold on their own, so range requests spread over several runs and
+  several addresses of one /64 add up
+- hashes of the log files (object key + ETag) already merged into the day,
+  so a file delivered twice, or seen by both the daily run and the
+  per-file S3 trigger, is counted once
+- the generation of the day aggregate it matches: the aggregate is written
+  first, so an aggregate ahead of its state was written by a run that
+  stopped before saving the state, and is recounted from the rows
+
+A key counts as one download once its rows together reach the threshold,
+attributed to its earliest row, exactly as a single run over all the day's
+logs would decide. Keeping the rows per raw IP lets an IP that becomes
+excessive later be taken out of the sessions it shared with its /64
+neighbours, which are then settled again without it.
+
+Only hashes are stored, never IPs or user agents. Hashes derived from an
+IP are keyed with a secret (handler.keyed_hash), so they cannot be
+reversed by hashing every IPv4 address. Columns are packed arrays,
+serialized as base64 inside a small JSON document.
+"""
+import array
+import base64
+import collections
+import sys
+
+from hll import HyperLogLog
+
+DAY_STATE_VERSION = 5
+
+
+def _pack(values):
+    if sys.byteorder != 'little':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+def _unpack(typecode, data):
+    values = array.array(typecode)
+    values.frombytes(base64.b64decode(data))
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def pack_hashes(hashes):
+    """Serialize a set of 64-bit hashes (such as DayState.sources), sorted."""
+    return _pack(array.array('Q', sorted(hashes)))
+
+
+def unpack_hashes(data):
+    return set(_unpack('Q', data))
+
+
+class DayState:
+    """Eligible requests already merged for one day, per deduplication key and raw IP."""
+
+    _COLUMNS = ('keys', 'listeners', 'ips', 'times', 'orders', 'counted', 'episode_ids', 'country_ids')
+
+    def __init__(self, date):
+        self.date = date
+        self.keys = array.array('Q')
+        self.listeners = array.array('Q')
+        self.ips = array.array('Q')
+        self.times = array.array('I')
+        self.orders = array.array('Q')
+        self.counted = array.array('B')
+        self.episode_ids = array.array('H')
+        self.country_ids = array.array('H')
+        self.episode_names = []
+        self.country_names = []
+        self.ip_counts = {}
+        # (key hash, IP hash) -> ranges of a row below the threshold on its own
+        self.partial = {}
+        self.sources = set()
+        self.next_order = 0
+        # Bumped by each merge that rewrites the day aggregate, which
+        # records the value it was written with
+        self.generation = 0
+        # False once the rows no longer cover every download of the day
+        # aggregate (a compacted day keeps only its sources)
+        self.complete = True
+        self._rows = {}
+        self._row_of = {}
+        self._winners = {}
+        self._listener_counts = collections.Counter()
+
+    def __len__(self):
+        """Number of downloads counted for the day."""
+        return len(self._winners)
+
+    # --- Requests per IP ---
+
+    def ip_count(self, ip_hash):
+        return self.ip_counts.get(ip_hash, 0)
+
+    def add_requests(self, ip_hash, count):
+        """Add requests seen for an IP; returns the day's new total."""
+        total = self.ip_counts.get(ip_hash, 0) + count
+        self.ip_counts[ip_hash] = total
+        return total
+
+    # --- Log files merged ---
+
+    def has_source(self, source_hash):
+        return source_hash in self.sources
+
+    def add_source(self, source_hash):
+        self.sources.add(source_hash)
+
+    # --- Sessions ---
+
+    def add_session(self, key_hash, listener_hash, ip_hash, episode, country, time, order, ranges,
+                    merge_ranges):
+        """Merge one raw IP's requests for a deduplication key into its row.
+
+        time (seconds since midnight) and order are those of the earliest
+        request; ranges are the byte ranges served, None once they reach
+        the threshold, and merge_ranges unites two such values
+        (handler.merge_byte_ranges). Call settle() once every session of
+        the key is added.
+        """
+        row = self._row_of.get((key_hash, ip_hash))
+        if row is None:
+            row = len(self.keys)
+            self.keys.append(key_hash)
+            self.listeners.append(listener_hash)
+            self.ips.append(ip_hash)
+            self.times.append(time)
+            self.orders.append(order)
+            self.counted.append(0)
+            self.episode_ids.append(self._encode(self.episode_names, episode))
+            self.country_ids.append(self._encode(self.country_names, country))
+            self._rows.setdefault(key_hash, []).append(row)
+            self._row_of[key_hash, ip_hash] = row
+            if ranges is not None:
+                self.partial[key_hash, ip_hash] = ranges
+            return
+        if (time, order) < (self.times[row], self.orders[row]):
+            self.times[row] = time
+            self.orders[row] = order
+        if (key_hash, ip_hash) in self.partial:
+            merged = merge_ranges(self.partial[key_hash, ip_hash], ranges)
+            if merged is None:
+                del self.partial[key_hash, ip_hash]
+            else:
+                self.partial[key_hash, ip_hash] = merged
+
+    def settle(self, key_hash, merge_ranges):
+        """Decide whether a key counts as a download, and which row it goes to.
+
+        A key counts once the ranges of its rows together reach the
+        threshold, and its download is attributed to the earliest row.
+        Returns (previous, current): the rows it was and is attributed to,
+        None when not counted.
+        """
+        rows = self._rows.get(key_hash, ())
+        ranges = ()
+        for row in rows:
+            ranges = merge_ranges(ranges, self.partial.get((key_hash, self.ips[row])))
+        current = None
+        if rows and ranges is None:
+            current = min(rows, key=lambda row: (self.times[row], self.orders[row]))
+        previous = self._winners.get(key_hash)
+        if current != previous:
+            if previous is not None:
+                self.counted[previous] = 0
+                del self._winners[key_hash]
+            if current is not None:
+                self.counted[current] = 1
+                self._winners[key_hash] = current
+            if previous is None:
+                self._listener_counts[self.listeners[current]] += 1
+            elif current is None:
+                self._uncount_listener(self.listeners[previous])
+        return previous, current
+
+    def has_download(self, key_hash):
+        return key_hash in self._winners
+
+    def listener_downloads(self, listener_hash):
+        """Number of counted downloads of a listener."""
+        return self._listener_counts.get(listener_hash, 0)
+
+    def country(self, row):
+        return self.country_names[self.country_ids[row]]
+
+    def retract_ip(self, ip_hash, merge_ranges):
+        """Drop the rows of an IP that became excessive and settle their keys again.
+
+        Returns the keys it had rows for.
+        """
+        affected = {key for key, ip in zip(self.keys, self.ips) if ip == ip_hash}
+        if affected:
+            keep = [i for i, ip in enumerate(self.ips) if ip != ip_hash]
+            for column in self._COLUMNS:
+                values = getattr(self, column)
+                setattr(self, column, array.array(values.typecode, (values[i] for i in keep)))
+            for key_hash in affected:
+                self.partial.pop((key_hash, ip_hash), None)
+            self._reindex()
+            for key_hash in affected:
+                self.settle(key_hash, merge_ranges)
+        return affected
+
+    def aggregate(self):
+        """Recompute the day aggregate (same shape as handler.aggregate_daily) from the rows."""
+        episodes = collections.Counter()
+        countries = collections.Counter()
+        sketch = HyperLogLog()
+        episode_sketches = collections.defaultdict(HyperLogLog)
+        for row in sorted(self._winners.values()):
+            listener = self.listeners[row]
+            episode = self.episode_names[self.episode_ids[row]]
+            episodes[episode] += 1
+            countries[self.country(row)] += 1
+            sketch.add_hash(listener)
+            episode_sketches[episode].add_hash(listener)
+        return {
+            'date': self.date,
+            'downloads': len(self._winners),
+            'listeners': len(self._listener_counts),
+            'episodes': dict(episodes),
+            'countries': dict(countries),
+            'listenerSketch': sketch.to_string(),
+            'episodeListenerSketches': {ep: episode_sketches[ep].to_string() for ep in episodes},
+        }
+
+    # --- Serialization ---
+
+    def to_json(self):
+        ip_hashes = array.array('Q', self.ip_counts.keys())
+        bounds = array.array('Q', (b for ranges in self.partial.values() for r in ranges for b in r))
+        return {
+            'version': DAY_STATE_VERSION,
+            'date': self.date,
+            'keys': _pack(self.keys),
+            'listeners': _pack(self.listeners),
+            'ips': _pack(self.ips),
+            'times': _pack(self.times),
+            'orders': _pack(self.orders),
+            'counted': _pack(self.counted),
+            'nextOrder': self.next_order,
+            'generation': self.generation,
+            'complete': self.complete,
+            'episodeIds': _pack(self.episode_ids),
+            'countryIds': _pack(self.country_ids),
+            'episodes': self.episode_names,
+            'countries': self.country_names,
+            'ipHashes': _pack(ip_hashes),
+            'ipCounts': _pack(array.array('I', self.ip_counts.values())),
+            'partialKeys': _pack(array.array('Q', (key for key, _ in self.partial))),
+            'partialIps': _pack(array.array('Q', (ip for _, ip in self.partial))),
+            'partialLengths': _pack(array.array('H', (len(ranges) for ranges in self.partial.values()))),
+            'partialBounds': _pack(bounds),
+            'sources': pack_hashes(self.sources),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        version = data.get('version')
+        if version not in (1, 2, 3, 4, DAY_STATE_VERSION):
+            raise ValueError(f"Unsupported day state version {version}")
+        state = cls(data['date'])
+        if 'sources' in data:
+            state.sources = unpack_hashes(data['sources'])
+        if version < DAY_STATE_VERSION:
+            # Earlier versions hashed IPs without the secret key: those
+            # hashes never match new ones, and are dropped rather than kept
+            # reversible. Only the merged log files remain, as for a
+            # compacted day.
+            state.generation = data.get('generation', 0)
+            state.complete = False
+            return state
+        state.keys = _unpack('Q', data['keys'])
+        state.listeners = _unpack('Q', data['listeners'])
+        state.ips = _unpack('Q', data['ips'])
+        state.episode_ids = _unpack('H', data['episodeIds'])
+        state.country_ids = _unpack('H', data['countryIds'])
+        state.episode_names = list(data['episodes'])
+        state.country_names = list(data['countries'])
+        state.ip_counts = dict(zip(_unpack('Q', data['ipHashes']), _unpack('I', data['ipCounts'])))
+        state.times = _unpack('I', data['times'])
+        state.orders = _unpack('Q', data['orders'])
+        state.counted = _unpack('B', data['counted'])
+        state.next_order = data['nextOrder']
+        state.generation = data['generation']
+        state.complete = data['complete']
+        bounds = iter(_unpack('Q', data['partialBounds']))
+        partial = zip(_unpack('Q', data['partialKeys']), _unpack('Q', data['partialIps']),
+                      _unpack('H', data['partialLengths']))
+        for key_hash, ip_hash, length in partial:
+            state.partial[key_hash, ip_hash] = tuple((next(bounds), next(bounds)) for _ in range(length))
+        state._reindex()
+        return state
+
+    def _reindex(self):
+        self._rows, self._row_of, self._winners = {}, {}, {}
+        self._listener_counts = collections.Counter()
+        for row, (key_hash, ip_hash) in enumerate(zip(self.keys, self.ips)):
+            self._rows.setdefault(key_hash, []).append(row)
+            self._row_of[key_hash, ip_hash] = row
+            if self.counted[row]:
+                self._winners[key_hash] = row
+                self._listener_counts[self.listeners[row]] += 1
+
+    def _uncount_listener(self, listener_hash):
+        self._listener_counts[listener_hash] -= 1
+        if not self._listener_counts[listener_hash]:
+            del self._listener_counts[listener_hash]
+
+    @staticmethod
+    def _encode(names, value):
+        try:
+            return names.index(value)
+        except ValueError:
+            names.append(value)
+            return len(names) - 1
@@ -2,21 +2,31 @@
 Podcast Analytics Pipeline - CloudFront Log Processor
 
 Processes CloudFront standard access logs to produce IAB v2.2-compliant
-podcast download metrics. Runs daily via EventBridge.
+podcast download metrics. Runs daily via EventBridge; an S3 trigger also
+merges each log file as it is delivered, and a schedule republishes the
+result every few minutes.
 """
 import json
 import os
 import gzip
 import io
 import re
+import sys
+import time
 import collections
+import contextlib
+import functools
+import hashlib
+import operator
 import logging
-import urllib.request
-import urllib.error
-import boto3
-from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
-from urllib.parse import unquote
+from urllib.parse import unquote, unquote_plus
+from hll import HyperLogLog, hash_key
+from day_state import DayState, pack_hashes, unpack_hashes
+from metrics import PipelineMetrics
+from query import DailyIndex
+from storage import LocalStorage, ObjectNotFound, S3Storage
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -29,24 +39,74 @@ OUTPUT_KEY = os.environ.get('OUTPUT_KEY', 'awsfr/site/data/analytics.json')
 STATE_PREFIX = os.environ.get('STATE_PREFIX', 'analytics-state/')
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN', '')
 OP3_TOKEN_PARAM = os.environ.get('OP3_TOKEN_PARAM', '/podcast/op3-api-token')
+HASH_SECRET_PARAM = os.environ.get('HASH_SECRET_PARAM', '/podcast/analytics-hash-secret')
 OP3_SHOW_UUID = os.environ.get('OP3_SHOW_UUID', '82002a7f8d7e4ac29715b95b110c9339')
-
-# Lazy-initialized clients (avoids credential resolution at import time)
+LOG_READ_CHUNK_SIZE = int(os.environ.get('LOG_READ_CHUNK_SIZE', str(256 * 1024)))
+FETCH_CONCURRENCY = int(os.environ.get('FETCH_CONCURRENCY', '8'))
+FETCH_QUEUE_SIZE = int(os.environ.get('FETCH_QUEUE_SIZE', str(2 * FETCH_CONCURRENCY)))
+# Compressed log bytes fetched ahead of the parser (see fetch_objects)
+FETCH_QUEUE_BYTES = int(os.environ.get('FETCH_QUEUE_BYTES', str(32 * 1024 * 1024)))
+DAILY_READ_CONCURRENCY = int(os.environ.get('DAILY_READ_CONCURRENCY', '16'))
+S3_MAX_ATTEMPTS = int(os.environ.get('S3_MAX_ATTEMPTS', '10'))
+# Storage: 's3', or 'local' for buckets mirrored as folders under
+# LOCAL_STORAGE_ROOT (see storage.py and run_local.py)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 's3')
+LOCAL_STORAGE_ROOT = os.environ.get('LOCAL_STORAGE_ROOT', '')
+OP3_ENABLED = os.environ.get('OP3_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'PodcastAnalytics')
+# Log listing: hours re-listed before the watermark's log hour, to pick up
+# late CloudFront deliveries, and an optional strftime() sub-prefix for
+# date-partitioned log delivery (e.g. '%Y/%m/%d/')
+LOG_LOOKBACK_HOURS = int(os.environ.get('LOG_LOOKBACK_HOURS', '24'))
+LOG_DAY_PREFIX = os.environ.get('LOG_DAY_PREFIX', '')
+# Checkpointing: log files per batch, and the time kept in reserve after the
+# last batch for compaction, rendering, the OP3 call (30s timeout) and upload
+LOG_BATCH_SIZE = int(os.environ.get('LOG_BATCH_SIZE', '200'))
+TIME_RESERVE_MS = int(os.environ.get('TIME_RESERVE_MS', '45000'))
+# Shows sharing the distribution, as a JSON list of routes (see Shows below);
+# unset for the single show under /awsfr/media/
+SHOW_ROUTES = os.environ.get('SHOW_ROUTES', '')
+# Log-level state, shared by all shows
+WATERMARK_KEY = f"{STATE_PREFIX}watermark.json"
+
+# Lazy-initialized clients (avoids credential resolution at import time).
+# boto3, maxminddb, brotli and urllib.request are also imported on first
+# use: invocations that find nothing to do should not pay for importing
+# them (see tests/test_cold_start.py).
 _s3 = None
 _sns = None
 _ssm = None
+_storage = None
 
 
 def _get_s3():
     global _s3
     if _s3 is None:
-        _s3 = boto3.client('s3')
+        # Pool sized for the concurrent readers; adaptive retries back off
+        # client-side when S3 answers with SlowDown/503 throttling errors.
+        import boto3
+        from botocore.config import Config
+        _s3 = boto3.client('s3', config=Config(
+            max_pool_connections=max(10, FETCH_CONCURRENCY, DAILY_READ_CONCURRENCY),
+            retries={'mode': 'adaptive', 'max_attempts': S3_MAX_ATTEMPTS},
+        ))
     return _s3
 
 
+def _get_storage():
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == 'local':
+            _storage = LocalStorage(LOCAL_STORAGE_ROOT or '.')
+        else:
+            _storage = S3Storage(_get_s3())
+    return _storage
+
+
 def _get_sns():
     global _sns
     if _sns is None:
+        import boto3
         _sns = boto3.client('sns')
     return _sns
 
@@ -54,18 +114,82 @@ def _get_sns():
 def _get_ssm():
     global _ssm
     if _ssm is None:
+        import boto3
         _ssm = boto3.client('ssm')
     return _ssm
 
-# Try to load GeoIP database
+
+# Secret key of every hash derived from an IP, read on first use
+_hash_secret = None
+
+
+def load_hash_secret(ssm=None):
+    """Load the hash key: HASH_SECRET if set, else the HASH_SECRET_PARAM SecureString."""
+    global _hash_secret
+    secret = os.environ.get('HASH_SECRET')
+    if not secret:
+        response = (ssm or _get_ssm()).get_parameter(Name=HASH_SECRET_PARAM, WithDecryption=True)
+        secret = response['Parameter']['Value']
+    _hash_secret = hashlib.blake2b(secret.encode('utf-8'), digest_size=32).digest()
+    return _hash_secret
+
+
+def keyed_hash(value):
+    """64-bit hash of a value holding an IP (raw IP, listener or download key).
+
+    Keyed with the secret, so the 2**32 IPv4 addresses cannot be hashed to
+    reverse the hashes stored in the day states.
+    """
+    return hash_key(value, _hash_secret or load_hash_secret())
+
+
+# GeoIP database, opened on the first lookup
+GEOIP_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'GeoLite2-Country.mmdb')
 _geoip_reader = None
-try:
-    import maxminddb
-    _geoip_db_path = os.path.join(os.path.dirname(__file__), 'GeoLite2-Country.mmdb')
-    if os.path.exists(_geoip_db_path):
-        _geoip_reader = maxminddb.open_database(_geoip_db_path)
-except Exception:
-    _geoip_reader = None
+_geoip_opened = False
+
+
+def _get_geoip_reader():
+    """Open the GeoLite2 database memory-mapped, once. None if it is unavailable.
+
+    MODE_MMAP leaves the file in the page cache instead of reading it into
+    memory, and pages are only touched by the lookups that need them.
+    """
+    global _geoip_reader, _geoip_opened
+    if not _geoip_opened:
+        _geoip_opened = True
+        try:
+            import maxminddb
+            if os.path.exists(GEOIP_DB_PATH):
+                _geoip_reader = maxminddb.open_database(GEOIP_DB_PATH, maxminddb.MODE_MMAP)
+        except Exception as e:
+            logger.warning("GeoIP database unavailable: %s", str(e))
+            _geoip_reader = None
+    return _geoip_reader
+
+
+# Brotli-encoded analytics variants are optional
+_brotli = None
+_brotli_loaded = False
+
+
+def _get_brotli():
+    """The brotli module, or None if it is not installed."""
+    global _brotli, _brotli_loaded
+    if not _brotli_loaded:
+        _brotli_loaded = True
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = None
+    return _brotli
+
+# Memoised GeoIP verdicts, keyed by IP or by /24 and /64 network (see lookup_country)
+GEOIP_CACHE_SIZE = int(os.environ.get('GEOIP_CACHE_SIZE', '65536'))
+_geoip_cache = collections.OrderedDict()
+_geoip_cache_hits = 0
+_geoip_cache_misses = 0
 
 # --- Bot patterns for IAB v2.2 filtering ---
 
@@ -97,22 +221,160 @@ BOT_PATTERNS = [
     'amazoncf', 'cloudfront', 'amazonaws',
 ]
 
-# URI pattern: /awsfr/media/{N}.mp3
-MP3_URI_PATTERN = re.compile(r'^/awsfr/media/(\d+)\.mp3$')
+# IAB v2.2 thresholds
+MIN_DOWNLOAD_BYTES = 960000        # below-threshold downloads (< 960KB)
+MAX_REQUESTS_PER_IP_DAY = 1000     # excessive IPs (> 1000 requests per day)
+
+# --- Shows ---
+#
+# Several shows can share the distribution, and so the log files. A route
+# maps the URI prefix of a show's episodes ({prefix}{N}.mp3) to the show's
+# id, state prefix and output key, from SHOW_ROUTES:
+#
+#   [{"show": "awsfr", "uriPrefix": "/awsfr/media/", "statePrefix": "analytics-state/",
+#     "outputKey": "awsfr/site/data/analytics.json", "op3ShowUuid": "..."}, ...]
+#
+# Every route needs show, uriPrefix, statePrefix and outputKey (a missing
+# statePrefix would start the show over from an empty state), and the OP3
+# comparison is skipped without op3ShowUuid. All prefixes are matched by one compiled
+# pattern, so each log line is read once however many shows there are.
+# Code below that works on one show reads STATE_PREFIX, OUTPUT_KEY and
+# OP3_SHOW_UUID, which show_context() points at that show.
+
+Show = collections.namedtuple('Show', ['id', 'uri_prefix', 'state_prefix', 'output_key', 'op3_show_uuid'])
+SHOW_ROUTE_FIELDS = ('show', 'uriPrefix', 'statePrefix', 'outputKey')
+
+
+def load_show_routes(config):
+    """Parse a SHOW_ROUTES value; empty gives the single show of STATE_PREFIX and OUTPUT_KEY."""
+    if not config:
+        return [Show('awsfr', '/awsfr/media/', STATE_PREFIX, OUTPUT_KEY, OP3_SHOW_UUID)]
+    routes = json.loads(config)
+    if not routes:
+        raise ValueError("SHOW_ROUTES has no routes")
+    for i, route in enumerate(routes):
+        missing = [field for field in SHOW_ROUTE_FIELDS if not route.get(field)]
+        if missing:
+            raise ValueError(f"SHOW_ROUTES route {route.get('show', i)!r} is missing {', '.join(missing)}")
+    shows = [
+        Show(
+            id=sys.intern(route['show']),
+            uri_prefix=route['uriPrefix'],
+            state_prefix=route['statePrefix'],
+            output_key=route['outputKey'],
+            op3_show_uuid=route.get('op3ShowUuid', ''),
+        )
+        for route in routes
+    ]
+    for field in ('id', 'uri_prefix', 'state_prefix', 'output_key'):
+        values = [getattr(show, field) for show in shows]
+        if len(set(values)) != len(values):
+            raise ValueError(f"SHOW_ROUTES has duplicate {field} values")
+    return shows
+
+
+def compile_uri_pattern(shows):
+    """Episode URIs of all shows: group 1 is the show's prefix, group 2 the episode number."""
+    # Longest first, so a prefix nested in another one cannot shadow it
+    prefixes = sorted({show.uri_prefix for show in shows}, key=len, reverse=True)
+    alternatives = '|'.join(re.escape(prefix) for prefix in prefixes)
+    return re.compile(rf'^({alternatives})(\d+)\.mp3$')
+
+
+def compile_uri_marker(shows):
+    """Byte pattern found in every episode request line of any show (see is_candidate_line)."""
+    return re.compile(b'|'.join(re.escape(show.uri_prefix.encode('utf-8')) for show in shows))
 
 
+@contextlib.contextmanager
+def show_context(show):
+    """Point STATE_PREFIX, OUTPUT_KEY and OP3_SHOW_UUID at one show."""
+    global STATE_PREFIX, OUTPUT_KEY, OP3_SHOW_UUID
+    saved = STATE_PREFIX, OUTPUT_KEY, OP3_SHOW_UUID
+    STATE_PREFIX, OUTPUT_KEY, OP3_SHOW_UUID = show.state_prefix, show.output_key, show.op3_show_uuid
+    try:
+        yield show
+    finally:
+        STATE_PREFIX, OUTPUT_KEY, OP3_SHOW_UUID = saved
+
+
+SHOWS = load_show_routes(SHOW_ROUTES)
+SHOW_BY_URI_PREFIX = {show.uri_prefix: show.id for show in SHOWS}
+MP3_URI_PATTERN = compile_uri_pattern(SHOWS)
+
+# Byte-level markers every MP3 download line must contain (see is_candidate_line)
+MP3_URI_MARKER = compile_uri_marker(SHOWS)
+GET_METHOD_MARKER = b'\tGET\t'
+STATUS_200_MARKER = b'\t200\t'
+STATUS_206_MARKER = b'\t206\t'
+
+
+class DownloadRecord:
+    """A parsed MP3 request from a CloudFront log line.
+
+    Slotted and built from interned strings: dates, times, user agents and
+    episodes repeat millions of times across a month of logs, so each record
+    only holds references to one shared copy of each. The country is not
+    stored: it is resolved with lookup_country() only for records that
+    survive filtering and deduplication.
+    """
+    __slots__ = ('date', 'time', 'ip', 'ua', 'episode', 'sc_bytes', 'status',
+                 'range_start', 'range_end', 'is_range_probe', 'show')
+
+    def __init__(self, date, time, ip, ua, episode, sc_bytes, status,
+                 is_range_probe, range_start=None, range_end=None, show=None):
+        self.date = date
+        self.time = time
+        self.ip = ip
+        self.ua = ua
+        self.episode = episode
+        self.sc_bytes = sc_bytes
+        self.status = status
+        self.range_start = range_start
+        self.range_end = range_end
+        self.is_range_probe = is_range_probe
+        self.show = show
+
+    def __eq__(self, other):
+        if not isinstance(other, DownloadRecord):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    def __repr__(self):
+        fields = ', '.join(f"{f}={getattr(self, f)!r}" for f in self.__slots__)
+        return f"DownloadRecord({fields})"
+
+
+@functools.lru_cache(maxsize=4096)
+def decode_user_agent(ua_raw):
+    """URL-decode a raw cs(User-Agent) field into a shared, interned string."""
+    return sys.intern(unquote(ua_raw)) if ua_raw != '-' else ''
+
+
+def _compile_bot_matcher(patterns):
+    """Compile the bot substrings and Apple Watch rules into one regex."""
+    alternatives = [
+        r'^atc/',                            # Apple Watch UAs
+        re.escape('(null)/(null) watchos'),  # Apple Watch UAs
+    ]
+    alternatives.extend(re.escape(p) for p in patterns)
+    return re.compile('|'.join(alternatives))
+
+
+BOT_MATCHER = _compile_bot_matcher(BOT_PATTERNS)
+BOT_VERDICT_CACHE_SIZE = int(os.environ.get('BOT_VERDICT_CACHE_SIZE', '8192'))
+
+
+@functools.lru_cache(maxsize=BOT_VERDICT_CACHE_SIZE)
 def is_bot(ua):
-    """Check if a user-agent string is a bot."""
+    """Check if a user-agent string is a bot.
+
+    A few hundred distinct user agents account for millions of requests, so
+    verdicts are memoised per raw user agent (see is_bot.cache_info()).
+    """
     if not ua or len(ua) < 5:
         return True
-    ua_lower = ua.lower()
-    # Apple Watch UAs
-    if ua_lower.startswith('atc/'):
-        return True
-    if '(null)/(null) watchos' in ua_lower:
-        return True
-    # Pattern matching
-    return any(p in ua_lower for p in BOT_PATTERNS)
+    return BOT_MATCHER.search(ua.lower()) is not None
 
 
 def truncate_ipv6(ip):
@@ -123,21 +385,76 @@ def truncate_ipv6(ip):
     return ':'.join(parts[:4])
 
 
-def lookup_country(ip):
-    """Look up country code from IP using GeoIP database."""
-    if _geoip_reader is None:
-        return 'XX'
+def _geoip_prefix_key(ip):
+    """Return the /24 (IPv4) or /64 (IPv6) network of an IP as a cache key."""
+    if ':' in ip:
+        parts = ip.split(':')
+        # A '::' within the first four groups hides the real /64 boundary
+        if len(parts) < 5 or '' in parts[:4]:
+            return None
+        return ':'.join(parts[:4]) + '::/64'
+    head, sep, _ = ip.rpartition('.')
+    return head + '.0/24' if sep else None
+
+
+def _lookup_country_uncached(ip):
+    """Query the GeoIP database. Returns (country, network prefix length)."""
     try:
-        result = _geoip_reader.get(ip)
+        result, prefix_len = _get_geoip_reader().get_with_prefix_len(ip)
         if result and 'country' in result and 'iso_code' in result['country']:
-            return result['country']['iso_code']
+            return result['country']['iso_code'], prefix_len
+        return 'XX', prefix_len
     except Exception:
-        pass
-    return 'XX'
+        return 'XX', None
+
+
+def lookup_country(ip):
+    """Look up country code from IP using GeoIP database.
+
+    Results are memoised in a bounded LRU that survives warm invocations.
+    When the database network containing the IP is at least as wide as its
+    /24 (IPv4) or /64 (IPv6), the verdict is cached for the whole prefix,
+    so neighbouring listeners hit the cache without changing any result.
+    """
+    global _geoip_cache_hits, _geoip_cache_misses
+    if _get_geoip_reader() is None:
+        return 'XX'
+
+    prefix_key = _geoip_prefix_key(ip)
+    for key in (prefix_key, ip):
+        country = _geoip_cache.get(key) if key else None
+        if country is not None:
+            _geoip_cache.move_to_end(key)
+            _geoip_cache_hits += 1
+            return country
+
+    _geoip_cache_misses += 1
+    country, prefix_len = _lookup_country_uncached(ip)
+    max_prefix_len = 64 if ':' in ip else 24
+    if prefix_key and prefix_len is not None and prefix_len <= max_prefix_len:
+        _geoip_cache[prefix_key] = country
+    else:
+        _geoip_cache[ip] = country
+    if len(_geoip_cache) > GEOIP_CACHE_SIZE:
+        _geoip_cache.popitem(last=False)
+    return country
+
+
+def geoip_cache_stats():
+    """Return GeoIP cache hit/miss counters and current size."""
+    return {
+        'hits': _geoip_cache_hits,
+        'misses': _geoip_cache_misses,
+        'size': len(_geoip_cache),
+    }
 
 
 def fetch_op3_comparison():
     """Fetch OP3 metrics for parallel comparison. Returns dict or None."""
+    if not OP3_ENABLED or not OP3_SHOW_UUID:
+        logger.info("OP3 comparison disabled")
+        return None
+    import urllib.request
     try:
         token_response = _get_ssm().get_parameter(
             Name=OP3_TOKEN_PARAM, WithDecryption=True
@@ -163,93 +480,341 @@ def fetch_op3_comparison():
         return None
 
 
-def main(event, context):
-    """Lambda entry point."""
-    logger.info("Analytics pipeline started at %s", datetime.now(timezone.utc).isoformat())
+def _new_metrics(mode):
+    metrics = PipelineMetrics(METRICS_NAMESPACE, {
+        'FunctionName': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local'),
+    })
+    metrics.set_property('Mode', mode)
+    return metrics
 
+
+@contextlib.contextmanager
+def _reported_run(metrics):
+    """Time an invocation, report a failure over SNS and emit the metrics."""
+    metrics.set('Failed', 0)
+    started = time.perf_counter()
     try:
-        # Step 1: Read watermark (last processed timestamp)
-        watermark = read_watermark()
-        logger.info("Watermark: %s", watermark)
+        yield metrics
+    except Exception as e:
+        logger.error("Pipeline failed: %s", str(e), exc_info=True)
+        metrics.set('Failed', 1)
+        notify_failure(str(e))
+        raise
+    finally:
+        metrics.add('TotalDuration', round((time.perf_counter() - started) * 1000, 1), 'Milliseconds')
+        metrics.emit()
 
-        # Step 2: List new log files since watermark
-        new_logs = list_new_logs(watermark)
-        logger.info("Found %d new log files to process", len(new_logs))
 
-        if not new_logs:
+def main(event, context):
+    """Lambda entry point.
+
+    S3 ObjectCreated notifications go to on_log_created() and
+    {"republish": true} to republish(); any other event runs the batch.
+    """
+    if isinstance(event, dict):
+        if 'Records' in event:
+            return on_log_created(event, context)
+        if event.get('republish'):
+            return republish(event, context)
+
+    logger.info("Analytics pipeline started at %s", datetime.now(timezone.utc).isoformat())
+    metrics = _new_metrics('batch')
+    with _reported_run(metrics):
+        with metrics.stage('ListLogs'):
+            # Step 1: Read watermark (last processed timestamp)
+            watermark = read_watermark()
+            logger.info("Watermark: %s", watermark)
+
+            # Step 2: List new log files since watermark
+            new_logs = list_new_logs(watermark)
+            logger.info("Found %d new log files to process", len(new_logs))
+        metrics.set('LogFiles', len(new_logs))
+
+        # A full rebuild or a verification works from the day files already
+        # merged, so it runs (and republishes) even without new logs
+        full_rebuild = bool(event.get('fullRebuild')) if isinstance(event, dict) else False
+        verify = isinstance(event, dict) and bool(event.get('verifyState'))
+        if not new_logs and not (full_rebuild or verify):
             logger.info("No new logs to process. Exiting.")
             return {"statusCode": 200, "body": "No new logs"}
 
-        # Step 3: Parse and filter logs
-        records = parse_and_filter_logs(new_logs)
-        logger.info("Parsed %d valid MP3 download records", len(records))
-
-        # Step 4: Apply IAB v2.2 filtering
-        filtered = apply_iab_filtering(records)
-        logger.info("After IAB filtering: %d records", len(filtered))
+        # Steps 3-8, batch by batch: parse, apply IAB v2.2 filtering,
+        # deduplicate and aggregate each show's records in a single pass,
+        # merge them into the show's day files, update its rolling state,
+        # then advance the watermark. Each batch is committed before the
+        # next one starts, so a run that stops for lack of time resumes
+        # from there.
+        totals = collections.Counter()
+        states = {}
+        changed_months = collections.defaultdict(set)
+        processed = 0
+        slowest_batch_ms = 0
+        for batch in log_batches(new_logs):
+            if processed and not has_time_for_batch(context, slowest_batch_ms):
+                logger.warning("Stopping before the time limit: %d of %d log files processed",
+                               processed, len(new_logs))
+                break
+            batch_started = time.monotonic()
+            with metrics.stage('Aggregate'):
+                # Files the S3 trigger already merged only move the watermark
+                fresh = unmerged_logs(batch)
+                metrics.add('LogFilesSkipped', len(batch) - len(fresh))
+                aggregators = aggregate_by_show(iter_log_records(fresh, metrics))
+            merged = merge_into_shows(aggregators, fresh, metrics, full_rebuild=full_rebuild and not processed)
+            for show_id, (changes, state) in merged.items():
+                changed_months[show_id].update(current['date'][:7] for _, current in changes)
+                if state is not None:
+                    states[show_id] = state
+            with metrics.stage('UpdateState'):
+                update_watermark(batch)
+
+            processed += len(batch)
+            for aggregator in aggregators.values():
+                totals.update(parsed=aggregator.parsed, filtered=aggregator.filtered, unique=aggregator.unique)
+                for reason, count in aggregator.dropped.items():
+                    metrics.add(f"Dropped{reason}", count)
+            slowest_batch_ms = max(slowest_batch_ms, (time.monotonic() - batch_started) * 1000)
+            logger.info("Committed batch of %d log files (%d/%d)", len(batch), processed, len(new_logs))
+
+        logger.info("Parsed %d valid MP3 download records", totals['parsed'])
+        logger.info("After IAB filtering: %d records", totals['filtered'])
+        logger.info("After deduplication: %d unique downloads", totals['unique'])
+        logger.info("GeoIP cache: %s", geoip_cache_stats())
+        metrics.set('LogFilesProcessed', processed)
+        metrics.set('RecordsParsed', totals['parsed'])
+        metrics.set('Downloads', totals['unique'])
+        metrics.set('GeoIPCacheHits', _geoip_cache_hits)
+        metrics.set('GeoIPCacheMisses', _geoip_cache_misses)
+
+        # Steps 8-9, show by show: compact, render and publish
+        published = 0
+        for show in SHOWS:
+            with show_context(show):
+                published += publish_show(states.get(show.id), changed_months[show.id], metrics,
+                                          verify=verify, force=full_rebuild)
+        metrics.set('DocumentsPublished', published)
+
+        remaining = len(new_logs) - processed
+        metrics.set('LogFilesRemaining', remaining)
+        if remaining:
+            logger.info("Pipeline checkpointed. Processed %d downloads, %d log files left.",
+                        totals['unique'], remaining)
+        else:
+            logger.info("Pipeline completed successfully. Processed %d downloads.", totals['unique'])
+        return {
+            "statusCode": 200,
+            "body": f"Processed {totals['unique']} downloads",
+            "complete": not remaining,
+            "remainingLogs": remaining,
+        }
 
-        # Step 5: Deduplicate
-        deduplicated = deduplicate(filtered)
-        logger.info("After deduplication: %d unique downloads", len(deduplicated))
 
-        # Step 6: Aggregate metrics
-        daily_metrics = aggregate_daily(deduplicated)
+def publish_show(state, changed_months, metrics, verify=False, force=False):
+    """Compact, render and publish the show selected by show_context().
+
+    state is the show's rolling state if this run updated it, and
+    changed_months the months whose days it rewrote. Returns the number of
+    documents uploaded. With force, a state this run did not rebuild (no
+    new logs) is rebuilt from the day files, and every document is uploaded.
+    """
+    # Step 8a: Roll finished months into monthly files, and render
+    with metrics.stage('Compact'):
+        compact_daily_files()
+    with metrics.stage('Render'):
+        if state is None:
+            state = update_analytics_state([], full_rebuild=force)
+        if verify:
+            state = verify_analytics_state(state)
+        analytics = render_analytics(state)
+
+    # Step 8b: Fetch OP3 comparison data
+    with metrics.stage('Op3'):
+        op3_data = fetch_op3_comparison()
+    if op3_data:
+        analytics['op3Comparison'] = op3_data
+        logger.info("OP3 comparison data fetched successfully")
+    else:
+        analytics['op3Comparison'] = None
+        analytics['op3Error'] = "OP3 API unavailable or returned error"
+        logger.warning("OP3 comparison data unavailable")
+
+    # Step 9: Upload analytics.json, summary.json and the shards (the
+    # watermark already follows each batch), including the months the
+    # S3 trigger changed since the last publish
+    with metrics.stage('Upload'):
+        pending = read_pending_months()
+        published = upload_analytics(analytics, state, set(changed_months) | (pending or set()), force=force)
+        if pending is not None:
+            clear_pending_months()
+    return published
+
+
+# --- Per-file processing ---
+#
+# Log delivery notifications (s3:ObjectCreated on LOG_PREFIX) invoke the
+# function with the new files. on_log_created() merges them into each show's
+# days and rolling state exactly as a batch would, and records the changed
+# months; republish(), run on a schedule, renders and publishes them. The
+# function runs with a reserved concurrency of 1, so these invocations and
+# the daily batch never update the same state concurrently.
+
+
+def log_files_from_event(event):
+    """Log files named by an S3 ObjectCreated event, shaped like listing entries."""
+    log_files = []
+    for record in event.get('Records', []):
+        s3_info = record.get('s3') or {}
+        obj = s3_info.get('object') or {}
+        key = unquote_plus(obj.get('key', ''))
+        if s3_info.get('bucket', {}).get('name') != LOG_BUCKET:
+            continue
+        if not key.startswith(LOG_PREFIX) or not key.endswith('.gz'):
+            continue
+        log_files.append({'Key': key, 'ETag': obj.get('eTag', ''), 'Size': obj.get('size', 0)})
+    return log_files
+
+
+def on_log_created(event, context):
+    """Merge newly delivered log files into the day files and the rolling state.
+
+    Files already merged (by the daily run, or by a replayed event) are
+    skipped. Publishing is left to republish().
+    """
+    metrics = _new_metrics('logCreated')
+    with _reported_run(metrics):
+        log_files = log_files_from_event(event)
+        fresh = unmerged_logs(log_files)
+        metrics.set('LogFiles', len(log_files))
+        metrics.set('LogFilesSkipped', len(log_files) - len(fresh))
+        if not fresh:
+            logger.info("No new log files in event (%d already merged)", len(log_files))
+            return {"statusCode": 200, "body": "No new logs"}
 
-        # Step 7: Write daily aggregate
-        write_daily_aggregate(daily_metrics)
+        with metrics.stage('Aggregate'):
+            aggregators = aggregate_by_show(iter_log_records(fresh, metrics))
+        merged = merge_into_shows(aggregators, fresh, metrics)
+        for show in SHOWS:
+            changes, _ = merged[show.id]
+            if changes:
+                with show_context(show):
+                    add_pending_months(current['date'][:7] for _, current in changes)
+
+        unique = sum(aggregator.unique for aggregator in aggregators.values())
+        metrics.set('LogFilesProcessed', len(fresh))
+        metrics.set('RecordsParsed', sum(aggregator.parsed for aggregator in aggregators.values()))
+        metrics.set('Downloads', unique)
+        for aggregator in aggregators.values():
+            for reason, count in aggregator.dropped.items():
+                metrics.add(f"Dropped{reason}", count)
+        logger.info("Merged %d log files: %d new downloads", len(fresh), unique)
+        return {"statusCode": 200, "body": f"Processed {unique} downloads"}
+
+
+def republish(event, context):
+    """Publish the months on_log_created changed since the last publish, per show.
+
+    Scheduled every few minutes; does nothing when no month is pending, so
+    the documents are published at most once per schedule interval. The
+    OP3 comparison is carried over from the published analytics.json and
+    refreshed by the daily run.
+    """
+    metrics = _new_metrics('republish')
+    with _reported_run(metrics):
+        published = 0
+        for show in SHOWS:
+            with show_context(show):
+                pending = read_pending_months()
+                if pending is None:
+                    continue
+                with metrics.stage('Render'):
+                    state = read_analytics_state() or update_analytics_state([])
+                    analytics = render_analytics(state)
+                last = _read_json_object(OUTPUT_KEY) or {}
+                analytics['op3Comparison'] = last.get('op3Comparison')
+                if 'op3Error' in last:
+                    analytics['op3Error'] = last['op3Error']
+
+                with metrics.stage('Upload'):
+                    uploaded = upload_analytics(analytics, state, pending)
+                    clear_pending_months()
+                published += uploaded
+                logger.info("Republished %d documents of %s for %s", uploaded, show.id, ', '.join(sorted(pending)))
+        metrics.set('DocumentsPublished', published)
+        return {"statusCode": 200, "body": f"Published {published} documents"}
 
-        # Step 8: Recompute analytics.json
-        analytics = compute_analytics_json()
 
-        # Step 8b: Fetch OP3 comparison data
-        op3_data = fetch_op3_comparison()
-        if op3_data:
-            analytics['op3Comparison'] = op3_data
-            logger.info("OP3 comparison data fetched successfully")
-        else:
-            analytics['op3Comparison'] = None
-            analytics['op3Error'] = "OP3 API unavailable or returned error"
-            logger.warning("OP3 comparison data unavailable")
+def read_watermark():
+    """Read the last processed timestamp from S3.
+
+    Only a missing watermark starts from scratch; any other error is
+    raised, since listing every log file again would re-read days whose
+    dedup state is gone.
+    """
+    watermark = _read_json_object(WATERMARK_KEY)
+    if watermark is None:
+        return {"last_processed": None, "last_key": None}
+    return watermark
+
+
+def log_batches(logs, size=None):
+    """Split LastModified-ordered logs into batches of about `size` files.
+
+    A batch never ends between files with the same LastModified, since
+    the watermark only moves past a timestamp once all of its files are in.
+    """
+    size = size or LOG_BATCH_SIZE
+    batch = []
+    for i, obj in enumerate(logs):
+        batch.append(obj)
+        following = logs[i + 1] if i + 1 < len(logs) else None
+        if len(batch) >= size and (following is None or following['LastModified'] != obj['LastModified']):
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def has_time_for_batch(context, batch_ms):
+    """Whether another batch as slow as `batch_ms` fits before TIME_RESERVE_MS is left."""
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return True
+    return context.get_remaining_time_in_millis() - TIME_RESERVE_MS > batch_ms
 
-        # Step 9: Upload analytics.json
-        upload_analytics(analytics)
 
-        # Step 10: Update watermark
-        update_watermark(new_logs)
+# CloudFront standard log file names: DISTID.YYYY-MM-DD-HH.unique-id.gz
+LOG_KEY_PATTERN = re.compile(r'([A-Z0-9]+)\.(\d{4}-\d{2}-\d{2}-\d{2})\.[^/]+\.gz$')
 
-        logger.info("Pipeline completed successfully. Processed %d downloads.", len(deduplicated))
-        return {"statusCode": 200, "body": f"Processed {len(deduplicated)} downloads"}
 
-    except Exception as e:
-        logger.error("Pipeline failed: %s", str(e), exc_info=True)
-        notify_failure(str(e))
-        raise
+def log_listing_ranges(watermark, now=None):
+    """Return the (prefix, start_after) listings that cover logs newer than the watermark.
 
+    Log keys sort by distribution and hour, so listing can start at the
+    watermark's log hour minus LOG_LOOKBACK_HOURS instead of at the
+    beginning of the prefix. With LOG_DAY_PREFIX, only the day prefixes
+    from that hour up to today are listed. Without a usable last_key the
+    whole prefix is listed.
+    """
+    match = LOG_KEY_PATTERN.search(watermark.get('last_key') or '')
+    if match is None:
+        return [(LOG_PREFIX, None)]
+    distribution, hour = match.groups()
+    since = datetime.strptime(hour, '%Y-%m-%d-%H') - timedelta(hours=LOG_LOOKBACK_HOURS)
+    start_after = f"{distribution}.{since:%Y-%m-%d-%H}"
+    if not LOG_DAY_PREFIX:
+        return [(LOG_PREFIX, LOG_PREFIX + start_after)]
 
-def read_watermark():
-    """Read the last processed timestamp from S3."""
-    try:
-        response = _get_s3().get_object(
-            Bucket=WEBSITE_BUCKET,
-            Key=f"{STATE_PREFIX}watermark.json"
-        )
-        return json.loads(response['Body'].read())
-    except ClientError as e:
-        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
-            return {"last_processed": None, "last_key": None}
-        return {"last_processed": None, "last_key": None}
-    except Exception:
-        return {"last_processed": None, "last_key": None}
+    today = (now or datetime.now(timezone.utc)).date()
+    ranges = []
+    day = since.date()
+    while day <= today:
+        prefix = LOG_PREFIX + day.strftime(LOG_DAY_PREFIX)
+        ranges.append((prefix, prefix + start_after))
+        day += timedelta(days=1)
+    return ranges
 
 
 def list_new_logs(watermark):
     """List CloudFront log files newer than the watermark."""
-    paginator = _get_s3().get_paginator('list_objects_v2')
-    page_iterator = paginator.paginate(
-        Bucket=LOG_BUCKET,
-        Prefix=LOG_PREFIX
-    )
-
     last_processed = watermark.get('last_processed')
     if last_processed:
         if isinstance(last_processed, str):
@@ -260,8 +825,8 @@ def list_new_logs(watermark):
         watermark_dt = None
 
     new_files = []
-    for page in page_iterator:
-        for obj in page.get('Contents', []):
+    for prefix, start_after in log_listing_ranges(watermark):
+        for obj in _get_storage().list(LOG_BUCKET, prefix, start_after):
             # Skip non-log files (e.g., directories)
             if not obj['Key'].endswith('.gz'):
                 continue
@@ -277,97 +842,199 @@ def list_new_logs(watermark):
     return sorted(new_files, key=lambda x: x['LastModified'])
 
 
-def parse_and_filter_logs(log_files):
-    """Parse CloudFront W3C logs and filter for MP3 downloads."""
-    records = []
+def iter_log_lines(body):
+    """Stream-decompress a gzipped log body, yielding raw lines one at a time.
 
-    for log_file in log_files:
-        try:
-            response = _get_s3().get_object(Bucket=LOG_BUCKET, Key=log_file['Key'])
-            compressed_data = response['Body'].read()
+    Only one decompressed chunk (LOG_READ_CHUNK_SIZE) is held in memory,
+    instead of the compressed object, the decompressed text and its lines.
+    """
+    with gzip.GzipFile(fileobj=body, mode='rb') as gz:
+        reader = io.BufferedReader(gz, buffer_size=LOG_READ_CHUNK_SIZE)
+        for line in reader:
+            yield line
 
-            # Decompress gzip
-            with gzip.GzipFile(fileobj=io.BytesIO(compressed_data)) as gz:
-                content = gz.read().decode('utf-8', errors='replace')
 
-            for line in content.splitlines():
-                # Skip comment lines (headers start with #)
-                if line.startswith('#'):
-                    continue
+def is_candidate_line(line):
+    """Cheap byte-level prefilter for raw log lines.
 
-                fields = line.split('\t')
-                # CloudFront standard logs have 33 fields
-                if len(fields) < 32:
-                    continue
+    Rejects lines that cannot be an MP3 GET with status 200/206 before any
+    UTF-8 decoding or tab splitting. Surviving lines may still be rejected
+    by parse_log_line, which applies the exact field-level checks.
+    """
+    return (MP3_URI_MARKER.search(line) is not None
+            and GET_METHOD_MARKER in line
+            and (STATUS_200_MARKER in line or STATUS_206_MARKER in line))
 
-                date_str = fields[0]       # date
-                time_str = fields[1]       # time
-                sc_bytes_str = fields[3]   # sc-bytes
-                ip = fields[4]            # c-ip
-                method = fields[5]        # cs-method
-                uri = fields[7]           # cs-uri-stem
-                status_str = fields[8]    # sc-status
-                ua_raw = fields[10]       # cs(User-Agent)
-                query = fields[11]        # cs-uri-query
-                sc_range_start = fields[30] if len(fields) > 30 else '-'
-                sc_range_end = fields[31] if len(fields) > 31 else '-'
-
-                # Filter: only GET requests
-                if method != 'GET':
-                    continue
 
-                # Filter: only status 200 or 206
-                try:
-                    status = int(status_str)
-                except ValueError:
-                    continue
-                if status not in (200, 206):
-                    continue
+def parse_log_line(line):
+    """Parse a single W3C log line into an MP3 download record, or None."""
+    # Skip comment lines (headers start with #)
+    if line.startswith('#'):
+        return None
 
-                # Filter: URI must match /awsfr/media/*.mp3
-                match = MP3_URI_PATTERN.match(uri)
-                if not match:
-                    continue
+    fields = line.rstrip('\r\n').split('\t')
+    # CloudFront standard logs have 33 fields
+    if len(fields) < 32:
+        return None
 
-                episode = match.group(1)
-
-                # URL-decode the User-Agent
-                ua = unquote(ua_raw) if ua_raw != '-' else ''
-
-                # Parse sc-bytes
-                try:
-                    sc_bytes = int(sc_bytes_str) if sc_bytes_str != '-' else 0
-                except ValueError:
-                    sc_bytes = 0
-
-                # Detect 2-byte range probe from range fields
-                is_range_probe = False
-                if sc_range_start != '-' and sc_range_end != '-':
-                    try:
-                        r_start = int(sc_range_start)
-                        r_end = int(sc_range_end)
-                        if r_start == 0 and r_end == 1:
-                            is_range_probe = True
-                    except ValueError:
-                        pass
-
-                records.append({
-                    'date': date_str,
-                    'time': time_str,
-                    'ip': ip,
-                    'ua': ua,
-                    'episode': episode,
-                    'sc_bytes': sc_bytes,
-                    'status': status,
-                    'is_range_probe': is_range_probe,
-                    'country': lookup_country(ip),
-                })
+    date_str = fields[0]       # date
+    time_str = fields[1]       # time
+    sc_bytes_str = fields[3]   # sc-bytes
+    ip = fields[4]            # c-ip
+    method = fields[5]        # cs-method
+    uri = fields[7]           # cs-uri-stem
+    status_str = fields[8]    # sc-status
+    ua_raw = fields[10]       # cs(User-Agent)
+    sc_range_start = fields[31] if len(fields) > 31 else '-'
+    sc_range_end = fields[32] if len(fields) > 32 else '-'
+
+    # Filter: only GET requests
+    if method != 'GET':
+        return None
 
-        except Exception as e:
-            logger.warning("Failed to process log file %s: %s", log_file['Key'], str(e))
+    # Filter: only status 200 or 206
+    try:
+        status = int(status_str)
+    except ValueError:
+        return None
+    if status not in (200, 206):
+        return None
+
+    # Filter: URI must be an episode of one of the shows ({prefix}{N}.mp3)
+    match = MP3_URI_PATTERN.match(uri)
+    if not match:
+        return None
+
+    show = SHOW_BY_URI_PREFIX[match.group(1)]
+    episode = sys.intern(match.group(2))
+
+    # URL-decode the User-Agent
+    ua = decode_user_agent(ua_raw)
+
+    # Parse sc-bytes
+    try:
+        sc_bytes = int(sc_bytes_str) if sc_bytes_str != '-' else 0
+    except ValueError:
+        sc_bytes = 0
+
+    # Byte range of a 206 response (inclusive; '-' when absent)
+    range_start = range_end = None
+    try:
+        if sc_range_start != '-':
+            range_start = int(sc_range_start)
+        if sc_range_end != '-':
+            range_end = int(sc_range_end)
+    except ValueError:
+        range_start = range_end = None
+
+    # Detect 2-byte range probe from range fields
+    is_range_probe = range_start == 0 and range_end == 1
+
+    return DownloadRecord(
+        date=sys.intern(date_str),
+        time=sys.intern(time_str),
+        ip=sys.intern(ip),
+        ua=ua,
+        episode=episode,
+        sc_bytes=sc_bytes,
+        status=status,
+        range_start=range_start,
+        range_end=range_end,
+        is_range_probe=is_range_probe,
+        show=show,
+    )
+
+
+def _fetch_object(bucket, key):
+    """Download one object fully (compressed logs are small)."""
+    return _get_storage().get(bucket, key)
+
+
+def fetch_objects(bucket, keys, concurrency=None, queue_size=None, sizes=None, max_bytes=None):
+    """Fetch objects on a bounded thread pool.
+
+    Yields (key, data, error) tuples in input order. At most queue_size
+    objects are downloaded or waiting to be consumed at any time and, given
+    their sizes ({key: bytes}, as listed), at most max_bytes of them
+    (FETCH_QUEUE_BYTES); an object larger than that is fetched on its own.
+    The compressed bytes held at once therefore stay below max_bytes plus
+    the object being consumed, however many keys are requested.
+    """
+    concurrency = concurrency or FETCH_CONCURRENCY
+    queue_size = max(queue_size or FETCH_QUEUE_SIZE, concurrency)
+    max_bytes = max_bytes or FETCH_QUEUE_BYTES
+    sizes = sizes or {}
+    _get_storage()  # create the shared client before worker threads race for it
+
+    pending = collections.deque()
+    queued = 0
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        for key in keys:
+            size = sizes.get(key, 0)
+            while pending and (len(pending) >= queue_size or queued + size > max_bytes):
+                queued -= pending[0][2]
+                yield _pop_fetched(pending)
+            pending.append((key, executor.submit(_fetch_object, bucket, key), size))
+            queued += size
+        while pending:
+            yield _pop_fetched(pending)
+    finally:
+        for _, future, _ in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def _pop_fetched(pending):
+    key, future, _ = pending.popleft()
+    try:
+        return key, future.result(), None
+    except Exception as e:
+        return key, None, e
+
+
+def iter_log_records(log_files, metrics=None):
+    """Stream CloudFront W3C logs from S3, yielding MP3 download records.
+
+    With a PipelineMetrics, also counts bytes fetched, lines scanned and
+    unreadable files.
+    """
+    fetched = fetch_objects(
+        LOG_BUCKET,
+        [log_file['Key'] for log_file in log_files],
+        sizes={log_file['Key']: log_file.get('Size', 0) for log_file in log_files},
+    )
+    for key, data, error in fetched:
+        if error is not None:
+            logger.warning("Failed to process log file %s: %s", key, str(error))
+            if metrics:
+                metrics.add('LogFileErrors', 1)
             continue
+        lines = 0
+        if metrics:
+            metrics.add('BytesFetched', len(data), 'Bytes')
+        try:
+            for raw_line in iter_log_lines(io.BytesIO(data)):
+                lines += 1
+                # Most lines are feed.xml, images and HTML: drop them undecoded
+                if not is_candidate_line(raw_line):
+                    continue
+                record = parse_log_line(raw_line.decode('utf-8', errors='replace'))
+                if record:
+                    yield record
+        except Exception as e:
+            logger.warning("Failed to process log file %s after %d lines: %s",
+                           key, lines, str(e))
+            if metrics:
+                metrics.add('LogFileErrors', 1)
+        finally:
+            if metrics:
+                metrics.add('LinesScanned', lines)
 
-    return records
+
+def parse_and_filter_logs(log_files):
+    """Parse CloudFront W3C logs and filter for MP3 downloads."""
+    return list(iter_log_records(log_files))
 
 
 def apply_iab_filtering(records):
@@ -375,47 +1042,157 @@ def apply_iab_filtering(records):
     # Count requests per IP per day for excessive IP detection
     ip_day_counts = collections.Counter()
     for r in records:
-        ip_day_counts[(r['date'], r['ip'])] += 1
+        ip_day_counts[(r.date, r.ip)] += 1
 
     filtered = []
     for r in records:
         # Remove bots (includes Apple Watch, empty/short UAs)
-        if is_bot(r['ua']):
+        if is_bot(r.ua):
             continue
 
         # Remove 2-byte range probes
-        if r['is_range_probe']:
-            continue
-
-        # Remove below-threshold downloads (< 960KB)
-        if r['sc_bytes'] < 960000:
+        if r.is_range_probe:
             continue
 
         # Remove excessive IPs (> 1000 requests per day)
-        if ip_day_counts[(r['date'], r['ip'])] > 1000:
+        if ip_day_counts[(r.date, r.ip)] > MAX_REQUESTS_PER_IP_DAY:
             continue
 
         filtered.append(r)
 
-    return filtered
+    # Remove below-threshold downloads (< 960KB served per session)
+    return filter_sessions(filtered)
+
+
+# --- Range-request sessions ---
+#
+# Apps that stream an episode fetch it as many 206 range requests, each
+# below the 960KB threshold. The threshold therefore applies to a session,
+# the requests of one (date, IP/64, UA, episode) key: the byte ranges they
+# served are merged, so overlapping or repeated ranges count once. A
+# session's ranges are kept as a sorted tuple of disjoint (start, end)
+# pairs until they cover the threshold, then replaced by None, so only
+# sessions still below it hold any ranges. Tuples of ints are not tracked
+# by the garbage collector, which matters with millions of requests.
+
+
+def served_range(status, sc_bytes, range_start, range_end):
+    """Byte range [start, end) of the episode a request served.
+
+    A 206 serves its range, cut short at sc-bytes when the client stopped
+    early; a 200, or a 206 without range fields, counts from the start.
+    """
+    if status == 206 and range_start is not None:
+        length = sc_bytes
+        if range_end is not None:
+            length = min(length, range_end - range_start + 1)
+        return range_start, range_start + length
+    return 0, sc_bytes
+
+
+def add_byte_range(ranges, start, end):
+    """Merge [start, end) into a session's ranges.
+
+    Returns the new ranges, or None once they cover MIN_DOWNLOAD_BYTES
+    (None stays None).
+    """
+    if ranges is None:
+        return None
+    if end - start >= MIN_DOWNLOAD_BYTES:
+        return None
+    if end <= start:
+        return ranges
+    merged = []
+    for s, e in ranges:
+        if e < start or s > end:
+            merged.append((s, e))
+        else:
+            start, end = min(s, start), max(e, end)
+    merged.append((start, end))
+    if sum(e - s for s, e in merged) >= MIN_DOWNLOAD_BYTES:
+        return None
+    merged.sort()
+    return tuple(merged)
+
+
+def merge_byte_ranges(ranges, other):
+    """Union of two sessions' ranges (None if either covers the threshold)."""
+    if ranges is None or other is None:
+        return None
+    for start, end in other:
+        ranges = add_byte_range(ranges, start, end)
+    return ranges
+
+
+_record_session_fields = operator.attrgetter(
+    'date', 'ip', 'ua', 'episode', 'status', 'sc_bytes', 'range_start', 'range_end')
+
+
+def filter_sessions(records, fields=_record_session_fields):
+    """Keep the requests of sessions that served at least MIN_DOWNLOAD_BYTES.
+
+    fields(record) returns (date, ip, ua, episode, status, sc_bytes,
+    range_start, range_end), so dict records (backfill.py) can be passed
+    with operator.itemgetter.
+    """
+    sessions = {}
+    keys = []
+    for r in records:
+        date, ip, ua, episode, status, sc_bytes, range_start, range_end = fields(r)
+        key = (date, truncate_ipv6(ip), ua, episode)
+        sessions[key] = add_byte_range(sessions.get(key, ()), *served_range(
+            status, sc_bytes, range_start, range_end))
+        keys.append(key)
+    return [r for r, key in zip(records, keys) if sessions[key] is None]
+
+
+_record_dedup_fields = operator.attrgetter('date', 'time', 'ip', 'ua', 'episode')
+
+
+def deduplicate(records, fields=_record_dedup_fields):
+    """Deduplicate per IP+UA+episode per UTC day, keeping the earliest request.
+
+    One pass keeps the earliest time per key, ties going to the first record
+    seen (as a stable sort would); only the survivors are then sorted, to
+    return them in chronological order. fields(record) returns
+    (date, time, ip, ua, episode), so dict records (backfill.py) can be
+    passed with operator.itemgetter.
+    """
+    earliest = {}
+    for seq, r in enumerate(records):
+        date, time_, ip, ua, episode = fields(r)
+        key = (date, truncate_ipv6(ip), ua, episode)
+        best = earliest.get(key)
+        if best is None or time_ < best[1]:
+            earliest[key] = (date, time_, seq, r)
+
+    survivors = sorted(earliest.values(), key=lambda x: x[:3])
+    return [r for _, _, _, r in survivors]
+
 
+def listener_key(ip, ua):
+    """Listener identity used for unique counts: truncated IP + user agent."""
+    return f"{ip}\t{ua}"
 
-def deduplicate(records):
-    """Deduplicate per IP+UA+episode per UTC day."""
-    seen = set()
-    deduplicated = []
 
-    # Sort by date and time to keep earliest request
-    sorted_records = sorted(records, key=lambda x: (x['date'], x['time']))
+def _new_listener_sketches():
+    return {'day': HyperLogLog(), 'episodes': collections.defaultdict(HyperLogLog)}
 
-    for r in sorted_records:
-        ip = truncate_ipv6(r['ip'])
-        key = (r['date'], ip, r['ua'], r['episode'])
-        if key not in seen:
-            seen.add(key)
-            deduplicated.append(r)
 
-    return deduplicated
+def _add_to_listener_sketches(sketches, ip, ua, episode):
+    h = keyed_hash(listener_key(ip, ua))
+    sketches['day'].add_hash(h)
+    sketches['episodes'][episode].add_hash(h)
+
+
+def _serialize_listener_sketches(sketches, episodes):
+    """Sketch fields of a daily aggregate (episode sketches in `episodes` order)."""
+    return {
+        'listenerSketch': sketches['day'].to_string(),
+        'episodeListenerSketches': {
+            ep: sketches['episodes'][ep].to_string() for ep in episodes
+        },
+    }
 
 
 def aggregate_daily(records):
@@ -425,159 +1202,1015 @@ def aggregate_daily(records):
         'listeners': set(),
         'episodes': collections.Counter(),
         'countries': collections.Counter(),
+        'sketches': _new_listener_sketches(),
     })
 
     for r in records:
-        date = r['date']
-        ip = truncate_ipv6(r['ip'])
+        date = r.date
+        ip = truncate_ipv6(r.ip)
         daily[date]['downloads'] += 1
-        daily[date]['listeners'].add((ip, r['ua']))
-        daily[date]['episodes'][r['episode']] += 1
-        daily[date]['countries'][r['country']] += 1
+        daily[date]['listeners'].add((ip, r.ua))
+        daily[date]['episodes'][r.episode] += 1
+        daily[date]['countries'][lookup_country(r.ip)] += 1
+        _add_to_listener_sketches(daily[date]['sketches'], ip, r.ua, r.episode)
 
     # Convert to serializable format
     metrics = {}
     for date, data in daily.items():
+        episodes = dict(data['episodes'])
         metrics[date] = {
             'date': date,
             'downloads': data['downloads'],
             'listeners': len(data['listeners']),
-            'episodes': dict(data['episodes']),
+            'episodes': episodes,
             'countries': dict(data['countries']),
+            **_serialize_listener_sketches(data['sketches'], episodes),
         }
 
     return metrics
 
 
-def write_daily_aggregate(metrics):
-    """Write daily aggregate JSON to S3."""
-    for date, data in metrics.items():
-        year = date[:4]
-        key = f"{STATE_PREFIX}daily/{year}/{date}.json"
-        _get_s3().put_object(
-            Bucket=WEBSITE_BUCKET,
-            Key=key,
-            Body=json.dumps(data, ensure_ascii=False),
-            ContentType='application/json'
+class DailyAggregator:
+    """Single-pass IAB v2.2 filtering, deduplication and daily aggregation.
+
+    Produces the same daily metrics as
+    aggregate_daily(deduplicate(apply_iab_filtering(records))) while
+    consuming the record stream once. Memory is bounded by the number of
+    distinct (date, IP) pairs and download keys rather than by requests,
+    and no global sort is needed.
+
+    The excessive-IP rule depends on the final per-(date, IP) request count,
+    so candidates are kept per raw IP and the rule is applied in aggregate(),
+    before candidates are collapsed on the truncated /64 deduplication key.
+    Each candidate also carries its session's served byte ranges, and the
+    960KB threshold is applied once candidates are collapsed.
+    """
+
+    def __init__(self):
+        self.parsed = 0
+        self.filtered = 0
+        self.unique = 0
+        # Requests dropped per IAB rule: Bot, RangeProbe, BelowThreshold,
+        # ExcessiveIp, Duplicate
+        self.dropped = collections.Counter()
+        self._ip_day_counts = collections.Counter()
+        self._passed_counts = collections.Counter()
+        # (date, ip, ua, episode) -> (time, seq, record) of the earliest request
+        self._candidates = {}
+        # Sessions that started with requests below the threshold:
+        # (date, ip, ua, episode) -> served ranges (None once they cover it),
+        # and their request counts
+        self._partial_ranges = {}
+        self._partial_requests = {}
+        # Requests of IPs within the excessive-IP limit that passed the
+        # per-request rules, set by sessions()
+        self.passed = 0
+
+    def add(self, r):
+        """Feed one parsed MP3 request."""
+        seq = self.parsed
+        self.parsed += 1
+        self._ip_day_counts[(r.date, r.ip)] += 1
+
+        # Per-request rules: bots, 2-byte range probes
+        if is_bot(r.ua):
+            self.dropped['Bot'] += 1
+            return
+        if r.is_range_probe:
+            self.dropped['RangeProbe'] += 1
+            return
+        self._passed_counts[(r.date, r.ip)] += 1
+
+        key = (r.date, r.ip, r.ua, r.episode)
+        best = self._candidates.get(key)
+        if best is None or r.time < best[0]:
+            self._candidates[key] = (r.time, seq, r)
+
+        # Most requests reach the threshold on their own (the served length
+        # is sc-bytes unless a range end caps it); a session only tracks
+        # ranges while all its requests so far are below it
+        if r.range_end is not None or r.sc_bytes < MIN_DOWNLOAD_BYTES:
+            start, end = served_range(r.status, r.sc_bytes, r.range_start, r.range_end)
+            if end - start < MIN_DOWNLOAD_BYTES:
+                if best is None:
+                    self._partial_ranges[key] = ((start, end),) if end > start else ()
+                    self._partial_requests[key] = 1
+                elif self._partial_ranges.get(key) is not None:
+                    self._partial_ranges[key] = add_byte_range(self._partial_ranges[key], start, end)
+                    self._partial_requests[key] += 1
+                return
+        if key in self._partial_ranges:
+            self._partial_ranges[key] = None
+
+    def add_all(self, records):
+        for r in records:
+            self.add(r)
+        return self
+
+    @property
+    def ip_day_counts(self):
+        """Requests seen per (date, raw IP) by this aggregator, before any filtering."""
+        return self._ip_day_counts
+
+    def sessions(self, ip_day_count=None):
+        """Return [(raw key, (time, seq, record), ranges, requests)] per raw-IP session.
+
+        A session is the requests of one (date, raw IP, UA, episode), with
+        its earliest request, the byte ranges it served (None once they
+        cover MIN_DOWNLOAD_BYTES) and, while they do not, its request count
+        (0 otherwise). Sessions of excessive IPs are left out:
+        ip_day_count(date, ip) gives the day's total request count for an
+        IP; it defaults to the requests seen here, and lets requests merged
+        by earlier runs count towards the rule. Sets self.passed, the
+        requests of the remaining IPs that passed the per-request rules.
+        """
+        if ip_day_count is None:
+            ip_day_count = lambda date, ip: self._ip_day_counts[(date, ip)]
+        self.passed = sum(
+            count for ip_day, count in self._passed_counts.items()
+            if ip_day_count(*ip_day) <= MAX_REQUESTS_PER_IP_DAY
         )
-        logger.info("Wrote daily aggregate for %s: %d downloads", date, data['downloads'])
+        self.dropped['ExcessiveIp'] = sum(self._passed_counts.values()) - self.passed
+        return [
+            (raw_key, candidate, self._partial_ranges.get(raw_key), self._partial_requests.get(raw_key, 0))
+            for raw_key, candidate in self._candidates.items()
+            # Remove excessive IPs (> 1000 requests per day)
+            if ip_day_count(raw_key[0], raw_key[1]) <= MAX_REQUESTS_PER_IP_DAY
+        ]
+
+    def downloads(self, ip_day_count=None):
+        """Return {(date, ip/64, ua, episode): (time, seq, record)} of unique downloads.
+
+        ip_day_count is passed to sessions().
+        """
+        winners, ranges, requests = {}, {}, collections.Counter()
+        for (date, ip, ua, episode), candidate, session_ranges, session_requests in self.sessions(ip_day_count):
+            # Keep the earliest request; ties go to the first one seen, as
+            # the stable sort in deduplicate() does
+            key = (date, truncate_ipv6(ip), ua, episode)
+            best = winners.get(key)
+            if best is None or candidate[:2] < best[:2]:
+                winners[key] = candidate
+            # Merge the ranges of the sessions of the key's raw IPs
+            ranges[key] = merge_byte_ranges(ranges.get(key, ()), session_ranges)
+            requests[key] += session_requests
+
+        # Remove below-threshold downloads (< 960KB served per session)
+        below = 0
+        for key, session_ranges in ranges.items():
+            if session_ranges is not None:
+                below += requests[key]
+                del winners[key]
+        self.filtered = self.passed - below
+        self.unique = len(winners)
+        self.dropped['BelowThreshold'] = below
+        self.dropped['Duplicate'] = self.filtered - self.unique
+        return winners
+
+    def aggregate(self):
+        """Return daily metrics in the same shape and key order as aggregate_daily."""
+        daily = {}
+        for (date, ip, ua, episode), (time_, seq, r) in self.downloads().items():
+            day = daily.get(date)
+            if day is None:
+                day = daily[date] = {
+                    'downloads': 0, 'listeners': set(), 'episodes': {}, 'countries': {},
+                    'sketches': _new_listener_sketches(),
+                }
+            order = (time_, seq)
+            day['downloads'] += 1
+            day['listeners'].add((ip, r.ua))
+            _count_in_order(day['episodes'], episode, order)
+            _count_in_order(day['countries'], lookup_country(r.ip), order)
+            _add_to_listener_sketches(day['sketches'], ip, r.ua, episode)
+
+        # aggregate_daily fills dicts in chronological order of the deduplicated
+        # records; replay that order from each value's first occurrence.
+        metrics = {}
+        for date in sorted(daily):
+            data = daily[date]
+            episodes = _ordered_counts(data['episodes'])
+            metrics[date] = {
+                'date': date,
+                'downloads': data['downloads'],
+                'listeners': len(data['listeners']),
+                'episodes': episodes,
+                'countries': _ordered_counts(data['countries']),
+                **_serialize_listener_sketches(data['sketches'], episodes),
+            }
+        return metrics
+
+
+def aggregate_by_show(records):
+    """Route each record to the DailyAggregator of its show, in one pass."""
+    aggregators = {show.id: DailyAggregator() for show in SHOWS}
+    for r in records:
+        aggregators[r.show].add(r)
+    return aggregators
 
 
-def compute_analytics_json():
-    """Recompute the full analytics.json from all daily files."""
-    # Read all daily files from last 24 months
-    cutoff = datetime.now(timezone.utc) - timedelta(days=730)
-    cutoff_str = cutoff.strftime('%Y-%m-%d')
+def _count_in_order(counts, value, order):
+    entry = counts.get(value)
+    if entry is None:
+        counts[value] = [1, order]
+    else:
+        entry[0] += 1
+        if order < entry[1]:
+            entry[1] = order
+
+
+def _ordered_counts(counts):
+    return {value: entry[0] for value, entry in sorted(counts.items(), key=lambda kv: kv[1][1])}
+
+
+# --- Daily aggregate storage ---
+#
+# Days of the current (and just-finished) month live in one file each under
+# daily/YYYY/YYYY-MM-DD.json. Once a month is finished, compact_daily_files()
+# rolls its days into monthly/YYYY-MM.json ({"month": ..., "days": {...}})
+# and deletes the daily files. Reads and writes below go through both layers,
+# so callers only deal in days.
+
+COMPACTION_GRACE_DAYS = int(os.environ.get('COMPACTION_GRACE_DAYS', '3'))
+
+
+def daily_key(date):
+    """S3 key of the daily aggregate file for a YYYY-MM-DD date."""
+    return f"{STATE_PREFIX}daily/{date[:4]}/{date}.json"
+
+
+def monthly_key(month):
+    """S3 key of the compacted aggregate file for a YYYY-MM month."""
+    return f"{STATE_PREFIX}monthly/{month}.json"
+
+
+def is_month_compactable(month, now=None):
+    """A month is finished once its last day is COMPACTION_GRACE_DAYS old."""
+    now = now or datetime.now(timezone.utc)
+    year, mon = int(month[:4]), int(month[5:7])
+    next_month = datetime(year + mon // 12, mon % 12 + 1, 1, tzinfo=timezone.utc)
+    return now >= next_month + timedelta(days=COMPACTION_GRACE_DAYS)
 
+
+def _read_json_object(key, storage=None, bucket=None):
+    """Read a JSON object, or None if it does not exist."""
+    try:
+        return json.loads((storage or _get_storage()).get(bucket or WEBSITE_BUCKET, key))
+    except ObjectNotFound:
+        return None
+
+
+def read_daily_aggregate(date, storage=None, bucket=None):
+    """Read one day's aggregate from its daily or monthly file, or None."""
+    day = _read_json_object(daily_key(date), storage, bucket)
+    if day is None and is_month_compactable(date[:7]):
+        monthly = _read_json_object(monthly_key(date[:7]), storage, bucket)
+        if monthly is not None:
+            day = monthly['days'].get(date)
+    return day
+
+
+def write_daily_aggregate(metrics, storage=None, bucket=None, previous=None):
+    """Write daily aggregate JSON to S3.
+
+    Days of an already compacted month are merged into its monthly file;
+    other days get their own daily file. Returns a list of
+    (previous, current) day aggregates, where previous is the version that
+    was overwritten (None for a new day), so the rolling analytics state
+    can subtract it. Callers that already read the previous versions can
+    pass them as {date: previous} to save the reads.
+    """
+    storage = storage or _get_storage()
+    bucket = bucket or WEBSITE_BUCKET
+    by_month = collections.defaultdict(list)
+    for date in metrics:
+        by_month[date[:7]].append(date)
+
+    changes = []
+    for month, dates in sorted(by_month.items()):
+        monthly = None
+        if is_month_compactable(month):
+            monthly = _read_json_object(monthly_key(month), storage, bucket)
+
+        if monthly is not None:
+            for date in dates:
+                changes.append((monthly['days'].get(date), metrics[date]))
+                monthly['days'][date] = metrics[date]
+            _put_monthly_aggregate(monthly, storage, bucket)
+            logger.info("Merged %d days into monthly aggregate %s", len(dates), month)
+            continue
+
+        for date in dates:
+            data = metrics[date]
+            if previous is not None and date in previous:
+                overwritten = previous[date]
+            else:
+                overwritten = _read_json_object(daily_key(date), storage, bucket)
+            storage.put(bucket, daily_key(date), json.dumps(data, ensure_ascii=False),
+                        content_type='application/json')
+            changes.append((overwritten, data))
+            logger.info("Wrote daily aggregate for %s: %d downloads", date, data['downloads'])
+    return changes
+
+
+def _put_monthly_aggregate(monthly, storage=None, bucket=None):
+    monthly['days'] = dict(sorted(monthly['days'].items()))
+    (storage or _get_storage()).put(
+        bucket or WEBSITE_BUCKET,
+        monthly_key(monthly['month']),
+        json.dumps(monthly, ensure_ascii=False),
+        content_type='application/json',
+    )
+
+
+def _list_keys(prefix):
+    for obj in _get_storage().list(WEBSITE_BUCKET, prefix):
+        yield obj['Key']
+
+
+def list_daily_files(cutoff_str):
+    """List daily aggregate keys dated on or after cutoff_str."""
     # Determine which year prefixes to scan
     current_year = datetime.now(timezone.utc).year
-    cutoff_year = cutoff.year
+    cutoff_year = int(cutoff_str[:4])
     years_to_scan = set()
     for y in range(cutoff_year, current_year + 1):
         years_to_scan.add(str(y))
 
-    paginator = _get_s3().get_paginator('list_objects_v2')
-
     # Scan only relevant year prefixes
     daily_files = []
     for year in sorted(years_to_scan):
-        page_iterator = paginator.paginate(
-            Bucket=WEBSITE_BUCKET,
-            Prefix=f"{STATE_PREFIX}daily/{year}/"
-        )
-        for page in page_iterator:
-            for obj in page.get('Contents', []):
-                key = obj['Key']
-                filename = key.rsplit('/', 1)[-1]
-                if not filename.endswith('.json'):
-                    continue
-                date_str = filename.replace('.json', '')
-                if date_str >= cutoff_str:
-                    daily_files.append(key)
+        for key in _list_keys(f"{STATE_PREFIX}daily/{year}/"):
+            filename = key.rsplit('/', 1)[-1]
+            if not filename.endswith('.json'):
+                continue
+            date_str = filename.replace('.json', '')
+            if date_str >= cutoff_str:
+                daily_files.append(key)
+    return daily_files
+
+
+def list_monthly_files(cutoff_str):
+    """List compacted monthly keys for months overlapping cutoff_str onwards."""
+    monthly_files = []
+    for key in _list_keys(f"{STATE_PREFIX}monthly/"):
+        filename = key.rsplit('/', 1)[-1]
+        if filename.endswith('.json') and filename[:7] >= cutoff_str[:7]:
+            monthly_files.append(key)
+    return monthly_files
+
+
+def read_daily_files(daily_files, cutoff_str=None):
+    """Read daily and monthly aggregate files into a list of days sorted by date.
+
+    Unreadable files are skipped. Monthly files are expanded into their days
+    (dropping those before cutoff_str); a daily file takes precedence over
+    a monthly entry for the same day. Files are fetched
+    DAILY_READ_CONCURRENCY at a time over the pooled S3 client.
+    """
+    days_by_date = {}
+    # Monthly files first, so leftover daily files win
+    ordered = sorted(daily_files, key=lambda k: ('/monthly/' not in k, k))
+    fetched = fetch_objects(WEBSITE_BUCKET, ordered, concurrency=DAILY_READ_CONCURRENCY)
+    for key, body, error in fetched:
+        if error is None:
+            try:
+                data = json.loads(body)
+                days = data['days'].values() if 'days' in data else [data]
+                for day in days:
+                    if cutoff_str is None or day['date'] >= cutoff_str:
+                        days_by_date[day['date']] = day
+                continue
+            except Exception as e:
+                error = e
+        logger.warning("Failed to read daily file %s: %s", key, str(error))
 
-    # Read all daily aggregate files
-    all_daily = []
-    for key in daily_files:
-        try:
-            response = _get_s3().get_object(Bucket=WEBSITE_BUCKET, Key=key)
-            data = json.loads(response['Body'].read())
-            all_daily.append(data)
-        except Exception as e:
-            logger.warning("Failed to read daily file %s: %s", key, str(e))
+    # Sort by date
+    return [days_by_date[d] for d in sorted(days_by_date)]
+
+
+def compact_daily_files(now=None):
+    """Roll the daily files of finished months into monthly files.
+
+    Returns the list of compacted months.
+    """
+    by_month = collections.defaultdict(list)
+    for key in _list_keys(f"{STATE_PREFIX}daily/"):
+        filename = key.rsplit('/', 1)[-1]
+        if filename.endswith('.json') and is_month_compactable(filename[:7], now):
+            by_month[filename[:7]].append(key)
+
+    for month, keys in sorted(by_month.items()):
+        monthly = _read_json_object(monthly_key(month)) or {'month': month, 'days': {}}
+        compacted = []
+        for key, body, error in fetch_objects(WEBSITE_BUCKET, keys, concurrency=DAILY_READ_CONCURRENCY):
+            try:
+                if error is not None:
+                    raise error
+                day = json.loads(body)
+                monthly['days'][day['date']] = day
+                compacted.append(key)
+            except Exception as e:
+                # Left in place, so the next compaction retries it
+                logger.warning("Failed to read daily file %s: %s", key, str(e))
+        if not compacted:
             continue
+        _put_monthly_aggregate(monthly)
+        _get_storage().delete(WEBSITE_BUCKET, compacted)
+        logger.info("Compacted %d daily files into %s", len(compacted), monthly_key(month))
+
+    # Finished days no longer need their dedup state, except for the log
+    # files merged into them: those are folded into one file per month, so
+    # a file listed again (lost watermark, replayed event) is not merged twice
+    expired_states = collections.defaultdict(list)
+    for key in _list_keys(f"{STATE_PREFIX}dedup/"):
+        filename = key.rsplit('/', 1)[-1]
+        if len(filename) == len('YYYY-MM-DD.json') and is_month_compactable(filename[:7], now):
+            expired_states[filename[:7]].append(key)
+    for month, keys in sorted(expired_states.items()):
+        merged = _read_json_object(merged_sources_key(month)) or {'month': month, 'days': {}}
+        folded = []
+        for key, body, error in fetch_objects(WEBSITE_BUCKET, keys, concurrency=DAILY_READ_CONCURRENCY):
+            try:
+                if error is not None:
+                    raise error
+                state = DayState.from_json(json.loads(body))
+                sources = state.sources | unpack_hashes(merged['days'].get(state.date, ''))
+                merged['days'][state.date] = pack_hashes(sources)
+                folded.append(key)
+            except Exception as e:
+                # Left in place, so the next compaction retries it
+                logger.warning("Failed to read day state %s: %s", key, str(e))
+        if not folded:
+            continue
+        merged['days'] = dict(sorted(merged['days'].items()))
+        _get_storage().put(WEBSITE_BUCKET, merged_sources_key(month), json.dumps(merged),
+                           content_type='application/json')
+        _get_storage().delete(WEBSITE_BUCKET, folded)
+        logger.info("Folded %d day states into %s", len(folded), merged_sources_key(month))
+    return sorted(by_month)
+
+
+# --- Per-day deduplication state ---
+#
+# A UTC day's logs arrive over many runs. Each run merges its downloads into
+# the day through the day's DayState (day_state.py) under
+# dedup/YYYY/YYYY-MM-DD.json: downloads already counted by an earlier run
+# are skipped, request counts per IP accumulate across runs for the
+# excessive-IP rule, and the day aggregate is updated in place instead of
+# being overwritten with one run's counts.
+
+
+def day_state_key(date):
+    """S3 key of the deduplication state of a YYYY-MM-DD date."""
+    return f"{STATE_PREFIX}dedup/{date[:4]}/{date}.json"
+
+
+def merged_sources_key(month):
+    """S3 key of the log files merged into the days of a compacted YYYY-MM month."""
+    return f"{STATE_PREFIX}dedup/{month[:4]}/{month}.json"
+
+
+def download_key_hash(ip, ua, episode):
+    """Hash of the deduplication key (truncated IP, user agent, episode)."""
+    return keyed_hash(f"{listener_key(ip, ua)}\t{episode}")
+
+
+def read_day_state(date, storage=None, bucket=None):
+    """Read a day's deduplication state, or None if there is none.
+
+    A day of a compacted month only has the log files merged into it
+    (see compact_daily_files): its state has no downloads.
+    """
+    data = _read_json_object(day_state_key(date), storage, bucket)
+    if data is not None:
+        return DayState.from_json(data)
+    if is_month_compactable(date[:7]):
+        merged = _read_json_object(merged_sources_key(date[:7]), storage, bucket)
+        if merged is not None and date in merged['days']:
+            state = DayState(date)
+            state.sources = unpack_hashes(merged['days'][date])
+            state.complete = False
+            return state
+    return None
+
+
+def write_day_state(state, storage=None, bucket=None):
+    (storage or _get_storage()).put(
+        bucket or WEBSITE_BUCKET,
+        day_state_key(state.date),
+        json.dumps(state.to_json(), separators=(',', ':')),
+        content_type='application/json',
+    )
 
-    # Sort by date
-    all_daily.sort(key=lambda x: x['date'])
 
-    # Compute monthly downloads and listeners
-    monthly_downloads = collections.defaultdict(int)
-    monthly_listeners = collections.defaultdict(int)
-    episode_downloads = collections.Counter()
-    country_downloads = collections.Counter()
+def write_day_states(states, storage=None, bucket=None):
+    """Save the day states of a merge, after its day aggregates."""
+    for state in states.values():
+        write_day_state(state, storage, bucket)
+
+
+def merge_daily_downloads(aggregator, storage=None, bucket=None, log_files=()):
+    """Merge a run's unique downloads into the persisted days.
+
+    Returns (metrics, previous, states): the updated aggregates of the days
+    that changed and the versions they replace, for write_daily_aggregate(),
+    and the updated day states, for write_day_states() once the aggregates
+    are written.
+    Each raw-IP session of the run is merged into its day's state (see
+    day_state.py), and the keys it touched are settled: a key that now
+    counts adds a download to the day aggregate. Work is proportional to
+    this run's records, except for a day where an IP crosses the
+    excessive-IP threshold: its earlier sessions are retracted, the keys
+    they shared with other IPs of their /64 are settled again, and the day
+    aggregate is recomputed from its state. The result is the same as one
+    run over all of the day's logs.
+
+    log_files are the files the aggregator read; they are recorded in the
+    state of their day (see unmerged_logs). Saving the states last means a
+    run that stops in between is merged again rather than lost. Each
+    rewritten aggregate carries the generation of its state: an aggregate
+    ahead of its state was written by such a run, and is recounted from
+    the state instead of being added to.
+
+    A day that has an aggregate but no state (written before states
+    existed), or whose state only lists its merged log files (a compacted
+    month), keeps its aggregate and takes new downloads on top: log files
+    already merged are skipped (unmerged_logs), but downloads already
+    counted there cannot be recognised as duplicates.
+    """
+    ip_hashes = {}
+
+    def ip_hash(ip):
+        h = ip_hashes.get(ip)
+        if h is None:
+            h = ip_hashes[ip] = keyed_hash(ip)
+        return h
+
+    states, previous, recompute = {}, {}, set()
+    for date in sorted({date for date, _ in aggregator.ip_day_counts}):
+        state = read_day_state(date, storage, bucket)
+        previous[date] = read_daily_aggregate(date, storage, bucket)
+        if state is None:
+            state = DayState(date)
+        if previous[date] is None:
+            recompute.add(date)
+        elif previous[date].get('generation', state.generation) != state.generation:
+            if state.complete:
+                logger.warning("Aggregate of %s is ahead of its dedup state; recounting the day", date)
+                recompute.add(date)
+            else:
+                logger.warning("Aggregate of %s is ahead of its dedup state, which cannot recount it", date)
+        states[date] = state
+    for log_file in log_files:
+        date = log_file_date(log_file['Key'])
+        if date is None:
+            continue
+        if date not in states:
+            states[date] = read_day_state(date, storage, bucket) or DayState(date)
+        states[date].add_source(log_source_hash(log_file))
+
+    # Requests per IP accumulate across runs; an IP that becomes excessive
+    # takes its earlier sessions with it
+    for (date, ip), count in aggregator.ip_day_counts.items():
+        state = states[date]
+        before = state.ip_count(ip_hash(ip))
+        after = state.add_requests(ip_hash(ip), count)
+        if before <= MAX_REQUESTS_PER_IP_DAY < after and state.retract_ip(ip_hash(ip), merge_byte_ranges):
+            # A state missing earlier downloads cannot recount its day; the
+            # IP's downloads counted there stay counted
+            if state.complete:
+                recompute.add(date)
+
+    # Merge every session, then settle each key touched, in order of its
+    # earliest request in this run. Arrival orders continue those of
+    # earlier runs, so ties go to the request seen first across runs.
+    touched, requests = {}, collections.Counter()
+    sessions = aggregator.sessions(lambda date, ip: states[date].ip_count(ip_hash(ip)))
+    for (date, ip, ua, episode), (time_, seq, r), ranges, session_requests in sessions:
+        state = states[date]
+        truncated = truncate_ipv6(ip)
+        key = (date, download_key_hash(truncated, ua, episode))
+        listener_hash = keyed_hash(listener_key(truncated, ua))
+        state.add_session(key[1], listener_hash, ip_hash(ip), episode, lookup_country(ip),
+                          seconds_of_day(time_), state.next_order + seq, ranges, merge_byte_ranges)
+        requests[key] += session_requests
+        if key not in touched or (time_, seq) < touched[key][0]:
+            touched[key] = ((time_, seq), listener_hash, episode)
+    for state in states.values():
+        state.next_order += aggregator.parsed
+
+    metrics, sketches, below, unique = {}, {}, 0, 0
+    for (date, key_hash), (_, listener_hash, episode) in sorted(touched.items(), key=lambda kv: kv[1][0]):
+        state = states[date]
+        was, now = state.settle(key_hash, merge_byte_ranges)
+        if now is None:
+            below += requests[date, key_hash]
+            continue
+        if was is None:
+            unique += 1
+        if was == now or date in recompute:
+            continue
+
+        day = metrics.get(date)
+        if day is None:
+            day = metrics[date] = _copy_day_aggregate(previous[date])
+            sketches[date] = _read_listener_sketches(day)
+        country = state.country(now)
+        if was is not None:
+            # An earlier request from another IP of the /64 takes the download over
+            _add_count(day['countries'], state.country(was), -1)
+            day['countries'][country] = day['countries'].get(country, 0) + 1
+            continue
+        day['downloads'] += 1
+        day['listeners'] += state.listener_downloads(listener_hash) == 1
+        day['episodes'][episode] = day['episodes'].get(episode, 0) + 1
+        day['countries'][country] = day['countries'].get(country, 0) + 1
+        if sketches[date] is not None:
+            sketches[date]['day'].add_hash(listener_hash)
+            sketches[date]['episodes'][episode].add_hash(listener_hash)
+
+    for date, day in metrics.items():
+        if sketches[date] is not None:
+            day.update(_serialize_listener_sketches(sketches[date], day['episodes']))
+    for date in recompute:
+        if len(states[date]) or previous[date] is not None:
+            metrics[date] = states[date].aggregate()
+    for date, day in metrics.items():
+        states[date].generation += 1
+        day['generation'] = states[date].generation
+
+    aggregator.filtered = aggregator.passed - below
+    aggregator.unique = unique
+    aggregator.dropped['BelowThreshold'] = below
+    aggregator.dropped['Duplicate'] = aggregator.filtered - unique
+    logger.info("Merged downloads into %d days (%d new)", len(states), unique)
+    return dict(sorted(metrics.items())), previous, states
+
+
+def seconds_of_day(time_str):
+    """Seconds since midnight of a log line's HH:MM:SS time (0 if malformed)."""
+    try:
+        hours, minutes, seconds = time_str.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    except ValueError:
+        return 0
+
+
+def log_file_date(key):
+    """YYYY-MM-DD day of a CloudFront log file, from its name, or None."""
+    match = LOG_KEY_PATTERN.search(key)
+    return match.group(2)[:10] if match else None
 
-    # Last 30 days for summary
-    now = datetime.now(timezone.utc)
-    thirty_days_ago = (now - timedelta(days=30)).strftime('%Y-%m-%d')
 
-    total_30d_downloads = 0
-    listeners_30d = set()
+def log_source_hash(log_file):
+    """Hash identifying one version of a log file: its key and ETag."""
+    etag = log_file.get('ETag', '').strip('"')
+    return hash_key(f"{log_file['Key']}\t{etag}")
 
+
+def unmerged_logs(log_files, storage=None, bucket=None):
+    """Drop the log files already merged into the state of their day.
+
+    The daily run and the per-file S3 trigger (on_log_created) may both
+    see a file, and S3 may deliver its event more than once; a file is
+    identified by key and ETag, so a rewritten file is merged again. A file
+    counts as merged once every show's state records it. Files whose name
+    carries no date cannot be tracked and are always kept.
+    """
+    states = {}
+
+    def merged(show, date, source_hash):
+        if (show.id, date) not in states:
+            with show_context(show):
+                states[show.id, date] = read_day_state(date, storage, bucket)
+        state = states[show.id, date]
+        return state is not None and state.has_source(source_hash)
+
+    fresh = []
+    for log_file in log_files:
+        date = log_file_date(log_file['Key'])
+        if date is not None and all(merged(show, date, log_source_hash(log_file)) for show in SHOWS):
+            continue
+        fresh.append(log_file)
+    return fresh
+
+
+def merge_into_shows(aggregators, log_files=(), metrics=None, full_rebuild=False):
+    """Merge each show's downloads into its day files and rolling state.
+
+    aggregators maps show ids to the DailyAggregator of their records
+    (see aggregate_by_show). Returns {show id: (changes, state)}, where
+    changes are the (previous, current) days rewritten and state is the
+    updated rolling state, or None if no day of the show changed.
+    """
+    metrics = metrics or PipelineMetrics(METRICS_NAMESPACE)
+    merged = {}
+    for show in SHOWS:
+        with show_context(show):
+            with metrics.stage('Merge'):
+                daily_metrics, previous, day_states = merge_daily_downloads(aggregators[show.id], log_files=log_files)
+                changes = write_daily_aggregate(daily_metrics, previous=previous)
+                write_day_states(day_states)
+            state = None
+            if changes or full_rebuild:
+                with metrics.stage('UpdateState'):
+                    state = update_analytics_state(changes, full_rebuild=full_rebuild)
+        merged[show.id] = (changes, state)
+    return merged
+
+
+def _copy_day_aggregate(day):
+    copy = dict(day)
+    copy['episodes'] = dict(day['episodes'])
+    copy['countries'] = dict(day['countries'])
+    return copy
+
+
+def _read_listener_sketches(day):
+    """Sketches of a day aggregate as mutable HyperLogLogs.
+
+    None for a day written before sketches existed: adding only the new
+    listeners would make its sketch look complete.
+    """
+    if not day.get('listenerSketch'):
+        return None
+    sketches = _new_listener_sketches()
+    sketches['day'] = HyperLogLog.from_string(day['listenerSketch'])
+    for episode, data in day.get('episodeListenerSketches', {}).items():
+        sketches['episodes'][episode] = HyperLogLog.from_string(data)
+    return sketches
+
+
+# --- Rolling analytics state ---
+#
+# analytics.json only needs monthly totals, episode and country counters
+# over the 24-month window, plus per-day figures for the last five weeks.
+# That summary is persisted and updated from the day files each run
+# rewrites (subtract the previous version, add the new one) and from the
+# days that fall out of the window, instead of re-reading every day file.
+#
+# Unique listeners come from the days' HyperLogLog sketches: recent days
+# keep their own sketch, and older days are merged ("settled") into one
+# sketch per month. A month whose sketch cannot be exact (a day without a
+# sketch, or a day that left the window) is marked None, and its listener
+# count falls back to the sum of daily unique listeners.
+
+ANALYTICS_STATE_VERSION = 2
+ANALYTICS_WINDOW_DAYS = 730   # 24 months of history
+RECENT_WINDOW_DAYS = 36       # 30-day summary and five weekly buckets
+
+
+def analytics_state_key():
+    return f"{STATE_PREFIX}analytics-summary.json"
+
+
+def window_start(now=None, days=ANALYTICS_WINDOW_DAYS):
+    """First date (YYYY-MM-DD) inside a window of `days` ending now."""
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def new_analytics_state(start):
+    return {
+        'version': ANALYTICS_STATE_VERSION,
+        'windowStart': start,
+        'days': [],
+        'months': {},
+        'episodes': {},
+        'countries': {},
+        'recentDays': {},
+        'monthSketches': {},
+    }
+
+
+def _add_count(counter, key, delta):
+    value = counter.get(key, 0) + delta
+    if value:
+        counter[key] = value
+    else:
+        counter.pop(key, None)
+
+
+def _settle_sketch(state, month, sketch):
+    """Merge a day's listener sketch into its month's settled sketch."""
+    sketches = state['monthSketches']
+    if month in sketches and sketches[month] is None:
+        return
+    if sketch is None:
+        sketches[month] = None
+    elif month in sketches:
+        sketches[month] = HyperLogLog.union([sketches[month], sketch]).to_string()
+    else:
+        sketches[month] = sketch
+
+
+def apply_day_to_state(state, day, sign=1, now=None):
+    """Add (sign=1) or subtract (sign=-1) one daily aggregate from the state."""
+    date_str = day['date']
+    if date_str < state['windowStart']:
+        return
+    days = set(state['days'])
+    if sign > 0:
+        days.add(date_str)
+    else:
+        days.discard(date_str)
+    state['days'] = sorted(days)
+
+    # Monthly totals; a month stays listed while any of its days is included
+    listeners = day.get('listeners', 0) if isinstance(day.get('listeners'), int) else 0
+    month = state['months'].setdefault(date_str[:7], {'downloads': 0, 'listeners': 0, 'days': 0})
+    month['downloads'] += sign * day['downloads']
+    month['listeners'] += sign * listeners
+    month['days'] += sign
+    if month['days'] <= 0:
+        del state['months'][date_str[:7]]
+
+    # Per-episode and per-country totals
+    for ep, count in day.get('episodes', {}).items():
+        _add_count(state['episodes'], ep, sign * count)
+    for country, count in day.get('countries', {}).items():
+        _add_count(state['countries'], country, sign * count)
+
+    # Per-day figures for the recent windows; older days only contribute
+    # their listener sketch to the month (sketches cannot be subtracted, so
+    # a rewritten older day is merged on top of its previous version)
+    if sign < 0:
+        state['recentDays'].pop(date_str, None)
+    elif date_str >= window_start(now, RECENT_WINDOW_DAYS):
+        state['recentDays'][date_str] = {
+            'downloads': day['downloads'],
+            'listeners': listeners,
+            'listenerSketch': day.get('listenerSketch'),
+            'episodeListenerSketches': day.get('episodeListenerSketches', {}),
+        }
+    else:
+        _settle_sketch(state, date_str[:7], day.get('listenerSketch'))
+
+
+def build_analytics_state(all_daily, start):
+    """Build the rolling state from scratch out of daily aggregates."""
+    state = new_analytics_state(start)
     for day in all_daily:
-        date_str = day['date']
-        month = date_str[:7]  # YYYY-MM
-
-        monthly_downloads[month] += day['downloads']
-
-        # For monthly listeners, we'd need IP+UA per month — approximate with daily count
-        # Since we don't store individual records, use the daily listener count
-        monthly_listeners[month] += day.get('listeners', 0) if isinstance(day.get('listeners'), int) else 0
-
-        # Per-episode totals
-        for ep, count in day.get('episodes', {}).items():
-            episode_downloads[ep] += count
-
-        # Country aggregation
-        for country, count in day.get('countries', {}).items():
-            country_downloads[country] += count
-
-        # 30-day summary
-        if date_str >= thirty_days_ago:
-            total_30d_downloads += day['downloads']
-            listeners_30d_count = day.get('listeners', 0)
-            if isinstance(listeners_30d_count, int):
-                # We accumulate daily unique listeners as an approximation
-                total_30d_listeners_approx = True
-
-    # Sum of daily unique listeners (not deduplicated across days)
-    # This over-counts since the same listener on multiple days is counted each day.
-    # True monthly uniques would require storing per-listener hashes across days.
-    unique_listeners_30d = sum(
-        day.get('listeners', 0) for day in all_daily
-        if day['date'] >= thirty_days_ago and isinstance(day.get('listeners'), int)
+        apply_day_to_state(state, day)
+    # The month the window starts in is only partially covered
+    if not start.endswith('-01') and start[:7] in state['months']:
+        state['monthSketches'][start[:7]] = None
+    return state
+
+
+def expire_analytics_state(state, start, now=None):
+    """Move the window start forward, subtracting days that fell out of it."""
+    expired = [d for d in state['days'] if d < start]
+    for date_str in expired:
+        day = read_daily_aggregate(date_str)
+        if day is None:
+            raise ValueError(f"Daily file for expired day {date_str} is missing")
+        apply_day_to_state(state, day, sign=-1)
+        month = date_str[:7]
+        if month in state['months']:
+            state['monthSketches'][month] = None
+        else:
+            state['monthSketches'].pop(month, None)
+    state['windowStart'] = max(state['windowStart'], start)
+
+    recent_start = window_start(now, RECENT_WINDOW_DAYS)
+    for date_str in [d for d in state['recentDays'] if d < recent_start]:
+        day = state['recentDays'].pop(date_str)
+        _settle_sketch(state, date_str[:7], day.get('listenerSketch'))
+
+
+def read_analytics_state():
+    """Read the persisted rolling state, or None if missing or outdated."""
+    try:
+        state = json.loads(_get_storage().get(WEBSITE_BUCKET, analytics_state_key()))
+    except Exception as e:
+        logger.info("No usable analytics state (%s)", str(e))
+        return None
+    if state.get('version') != ANALYTICS_STATE_VERSION:
+        logger.info("Analytics state version %s is outdated", state.get('version'))
+        return None
+    return state
+
+
+def write_analytics_state(state):
+    """Persist the rolling state next to the daily files."""
+    _get_storage().put(
+        WEBSITE_BUCKET,
+        analytics_state_key(),
+        json.dumps(state, ensure_ascii=False, separators=(',', ':')),
+        content_type='application/json',
+    )
+
+
+def rebuild_analytics_state():
+    """Rebuild the rolling state from all daily files in the window."""
+    start = window_start()
+    all_daily = read_daily_files(list_monthly_files(start) + list_daily_files(start), start)
+    logger.info("Rebuilt analytics state from %d daily files", len(all_daily))
+    return build_analytics_state(all_daily, start)
+
+
+def update_analytics_state(changes, full_rebuild=False):
+    """Fold rewritten day files into the persisted state and save it.
+
+    Falls back to a full rebuild when the state is missing, outdated or
+    cannot be expired. Returns the updated state.
+    """
+    state = None if full_rebuild else read_analytics_state()
+    if state is not None:
+        try:
+            for previous, current in changes:
+                if previous is not None:
+                    apply_day_to_state(state, previous, sign=-1)
+                apply_day_to_state(state, current)
+            # Expire after applying changes: the day files now hold exactly
+            # what the state holds, so expired days subtract cleanly
+            expire_analytics_state(state, window_start())
+            logger.info("Updated analytics state incrementally with %d days", len(changes))
+        except Exception as e:
+            logger.warning("Incremental analytics state update failed: %s", str(e))
+            state = None
+    if state is None:
+        state = rebuild_analytics_state()
+    write_analytics_state(state)
+    return state
+
+
+def load_episode_titles():
+    """Load episode titles from S3 (uploaded by CodeBuild)."""
+    try:
+        return json.loads(_get_storage().get(WEBSITE_BUCKET, f"{STATE_PREFIX}episode-titles.json"))
+    except Exception as e:
+        logger.warning("Could not load episode titles: %s", str(e))
+        return {}
+
+
+def _unique_listeners(sketches, fallback):
+    """Count distinct listeners across serialized sketches, or return fallback
+    if any of them is missing."""
+    if any(sketch is None for sketch in sketches):
+        return fallback
+    return HyperLogLog.union(sketches).count()
+
+
+def _monthly_unique_listeners(state, month, recent_days):
+    """Distinct listeners of a month: its settled sketch plus recent days."""
+    fallback = state['months'][month]['listeners']
+    sketches = [day['listenerSketch'] for day in recent_days if day['date'][:7] == month]
+    if month in state['monthSketches']:
+        sketches.append(state['monthSketches'][month])
+    if not sketches:
+        return fallback
+    return _unique_listeners(sketches, fallback)
+
+
+def render_analytics(state, now=None):
+    """Build the analytics.json document from the rolling state."""
+    now = now or datetime.now(timezone.utc)
+    months = state['months']
+    recent_days = [
+        {'date': date_str, **state['recentDays'][date_str]}
+        for date_str in sorted(state['recentDays'])
+    ]
+
+    # Window totals: range sums over the recent days
+    index = DailyIndex(recent_days)
+
+    # Last 30 days for summary
+    thirty_days_ago = (now - timedelta(days=30)).strftime('%Y-%m-%d')
+    total_30d_downloads = index.downloads(thirty_days_ago)
+
+    # Distinct listeners over 30 days from the merged daily sketches; falls
+    # back to the (over-counting) sum of daily uniques for days without one
+    days_30d = [day for day in recent_days if day['date'] >= thirty_days_ago]
+    unique_listeners_30d = _unique_listeners(
+        [day['listenerSketch'] for day in days_30d],
+        sum(day['listeners'] for day in days_30d),
     )
 
     # Last 7 days downloads
     seven_days_ago = (now - timedelta(days=7)).strftime('%Y-%m-%d')
-    total_7d_downloads = sum(
-        day['downloads'] for day in all_daily
-        if day['date'] >= seven_days_ago
-    )
+    total_7d_downloads = index.downloads(seven_days_ago)
 
     # Current month downloads
     current_month_str = now.strftime('%Y-%m')
-    current_month_downloads = monthly_downloads.get(current_month_str, 0)
+    current_month_downloads = months.get(current_month_str, {}).get('downloads', 0)
 
     # Previous month listeners
     if now.month == 1:
         prev_month_str = f"{now.year - 1}-12"
     else:
         prev_month_str = f"{now.year}-{now.month - 1:02d}"
+    monthly_listeners = {
+        m: _monthly_unique_listeners(state, m, recent_days) for m in months
+    }
     previous_month_listeners = monthly_listeners.get(prev_month_str, 0)
 
     # Daily downloads for last 30 days (for sparkline)
     daily_downloads_30d = [
         {'date': day['date'], 'downloads': day['downloads']}
-        for day in all_daily
+        for day in recent_days
         if day['date'] >= thirty_days_ago
     ]
 
@@ -586,19 +2219,15 @@ def compute_analytics_json():
     for i in range(5):
         week_end = now - timedelta(days=i * 7)
         week_start = week_end - timedelta(days=7)
-        week_start_str = week_start.strftime('%Y-%m-%d')
-        week_end_str = week_end.strftime('%Y-%m-%d')
-        week_total = sum(
-            day['downloads'] for day in all_daily
-            if week_start_str <= day['date'] < week_end_str
+        weekly_downloads_list.append(
+            index.downloads(week_start.strftime('%Y-%m-%d'), week_end.strftime('%Y-%m-%d'))
         )
-        weekly_downloads_list.append(week_total)
     weekly_downloads_list.reverse()
 
     # Build monthly arrays (sorted by month)
-    sorted_months = sorted(monthly_downloads.keys())
+    sorted_months = sorted(months.keys())
     monthly_downloads_arr = [
-        {'month': m, 'count': monthly_downloads[m]}
+        {'month': m, 'count': months[m]['downloads']}
         for m in sorted_months
     ]
     monthly_listeners_arr = [
@@ -606,37 +2235,39 @@ def compute_analytics_json():
         for m in sorted_months
     ]
 
-    # Load episode titles from S3 (uploaded by CodeBuild)
-    episode_titles = {}
-    try:
-        titles_response = _get_s3().get_object(
-            Bucket=WEBSITE_BUCKET,
-            Key=f"{STATE_PREFIX}episode-titles.json"
-        )
-        episode_titles = json.loads(titles_response['Body'].read())
-    except Exception as e:
-        logger.warning("Could not load episode titles: %s", str(e))
+    episode_titles = load_episode_titles()
 
-    # Top 50 episodes by downloads (enriched with titles)
-    top_episodes = episode_downloads.most_common(50)
+    # Top 50 episodes by downloads (enriched with titles); ties by episode
+    # number so incremental and rebuilt states render identically
+    top_episodes = sorted(
+        state['episodes'].items(), key=lambda kv: (-kv[1], int(kv[0]))
+    )[:50]
     episode_downloads_arr = [
         {
             'episode': int(ep),
             'title': episode_titles.get(str(ep), episode_titles.get(ep, '')),
             'totalDownloads': count,
+            'uniqueListeners30d': _unique_listeners(
+                [None if day['listenerSketch'] is None else day['episodeListenerSketches'][ep]
+                 for day in days_30d
+                 if day['listenerSketch'] is None or ep in day['episodeListenerSketches']],
+                None,
+            ),
         }
         for ep, count in top_episodes
     ]
 
     # Top 20 countries
-    top_countries = country_downloads.most_common(20)
+    top_countries = sorted(
+        state['countries'].items(), key=lambda kv: (-kv[1], kv[0])
+    )[:20]
     top_countries_arr = [
         {'countryCode': code, 'count': count}
         for code, count in top_countries
     ]
 
     # Total episodes (unique episode numbers seen)
-    total_episodes = len(episode_downloads)
+    total_episodes = len(state['episodes'])
 
     analytics = {
         'generatedAt': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
@@ -661,16 +2292,321 @@ def compute_analytics_json():
     return analytics
 
 
-def upload_analytics(analytics):
-    """Upload analytics.json to the website bucket."""
-    _get_s3().put_object(
-        Bucket=WEBSITE_BUCKET,
-        Key=OUTPUT_KEY,
-        Body=json.dumps(analytics, ensure_ascii=False, indent=2),
-        ContentType='application/json',
-        CacheControl='max-age=3600',
+def compute_analytics_json():
+    """Recompute the full analytics.json from all daily files.
+
+    Kept as the reference path: the incremental state must render the
+    same document (see verify_analytics_state).
+    """
+    return render_analytics(rebuild_analytics_state())
+
+
+def verify_analytics_state(state):
+    """Compare the incremental state with a full rebuild.
+
+    Returns the state to use: the given one if it matches, otherwise the
+    rebuilt state, which replaces the persisted one.
+    """
+    rebuilt = rebuild_analytics_state()
+    for field in ('windowStart', 'days', 'months', 'episodes', 'countries', 'recentDays',
+                  'monthSketches'):
+        if state[field] != rebuilt[field]:
+            logger.warning("Analytics state mismatch on %s; replacing with rebuild", field)
+            write_analytics_state(rebuilt)
+            return rebuilt
+    logger.info("Analytics state matches a full rebuild")
+    return state
+
+
+# --- Publishing ---
+#
+# Published documents are written as compact JSON plus gzip (.gz) and, when
+# the brotli module is available, brotli (.br) encoded copies served with
+# the matching Content-Encoding. A content hash per key, kept in
+# published.json, skips the uploads when a document has not changed.
+
+
+def published_state_key():
+    return f"{STATE_PREFIX}published.json"
+
+
+def content_hash(document):
+    """Hash of a document's content, ignoring generation and fetch timestamps."""
+    stable = {k: v for k, v in document.items() if k != 'generatedAt'}
+    if isinstance(stable.get('op3Comparison'), dict):
+        stable['op3Comparison'] = {k: v for k, v in stable['op3Comparison'].items() if k != 'fetchedAt'}
+    encoded = json.dumps(stable, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def encoded_variants(body):
+    """Yield (key suffix, Content-Encoding, bytes) for a JSON body."""
+    yield '', None, body
+    yield '.gz', 'gzip', gzip.compress(body, compresslevel=9, mtime=0)
+    brotli = _get_brotli()
+    if brotli is not None:
+        yield '.br', 'br', brotli.compress(body, quality=11)
+
+
+# Cache-Control of documents rewritten in place (analytics.json, summary.json,
+# the open month and episode shards). CloudFront's CachingOptimized policy
+# follows it, so it must stay below the 10-minute republish schedule for
+# the dashboard to see updates; S3 ETags make expired copies cheap to
+# revalidate. Only content-named shards get IMMUTABLE_CACHE_CONTROL.
+MUTABLE_CACHE_CONTROL = 'public, max-age=300'
+
+
+def publish_json(key, document, published, cache_control=MUTABLE_CACHE_CONTROL, force=False):
+    """Upload a document and its encoded variants unless its content hash is unchanged.
+
+    published maps keys to the hashes last uploaded and is updated in
+    place. Returns True if the document was uploaded.
+    """
+    digest = content_hash(document)
+    if not force and published.get(key) == digest:
+        logger.info("%s unchanged; upload skipped", key)
+        return False
+    body = json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    for suffix, encoding, data in encoded_variants(body):
+        headers = {'CacheControl': cache_control}
+        if encoding:
+            headers['ContentEncoding'] = encoding
+        _get_storage().put(WEBSITE_BUCKET, key + suffix, data, content_type='application/json', **headers)
+    published[key] = digest
+    logger.info("Uploaded %s to %s/%s (%d bytes)", key.rsplit('/', 1)[-1], WEBSITE_BUCKET, key, len(body))
+    return True
+
+
+# --- Sharded output ---
+#
+# Next to analytics.json (kept for existing consumers), the dashboard loads
+# summary.json: the same document plus an index of shards it fetches on
+# demand, all under the folder of OUTPUT_KEY:
+#
+#   months/YYYY-MM.json            open month, rewritten while days change
+#   months/YYYY-MM.<hash>.json     finished month, immutable and cached for a year
+#   episodes/<episode>.json        daily downloads of one episode
+#
+# Shards cover every month of the rolling window. Episode shards are
+# derived from the month shards and, like every published document, only
+# uploaded when changed. Finished month shards are also kept, by key, in
+# the shard state (shards.json), so a publish neither re-reads nor
+# re-hashes a finished month whose days did not change: one read of the
+# shard state covers them all.
+#
+# A shard replaced by a new name, or gone from the window, is retired rather
+# than deleted: a summary.json still cached by CloudFront or a browser, or
+# held by an open dashboard, may still point to it. The shard state lists
+# retired shards with the time they were superseded, and they are deleted
+# by the first publish SHARD_RETENTION_SECONDS later.
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+SHARD_RETENTION_SECONDS = int(os.environ.get('SHARD_RETENTION_SECONDS', '86400'))
+
+
+def output_prefix():
+    """Folder of OUTPUT_KEY, where summary.json and the shards are published."""
+    return OUTPUT_KEY.rsplit('/', 1)[0] + '/' if '/' in OUTPUT_KEY else ''
+
+
+def summary_key():
+    return f"{output_prefix()}summary.json"
+
+
+def month_shard_key(month, digest=None):
+    """Key of a month shard; finished months carry a content hash in their name."""
+    if digest:
+        return f"{output_prefix()}months/{month}.{digest[:12]}.json"
+    return f"{output_prefix()}months/{month}.json"
+
+
+def episode_shard_key(episode):
+    return f"{output_prefix()}episodes/{episode}.json"
+
+
+def shard_state_key():
+    return f"{STATE_PREFIX}shards.json"
+
+
+def read_month_days(month):
+    """Read the daily aggregates of one month from its monthly and daily files."""
+    keys = list(_list_keys(monthly_key(month)))
+    keys += _list_keys(f"{STATE_PREFIX}daily/{month[:4]}/{month}-")
+    return read_daily_files(keys)
+
+
+def month_shard(month, days):
+    """Month shard document: per-day totals, episodes and countries, without sketches."""
+    return {
+        'month': month,
+        'days': [
+            {
+                'date': day['date'],
+                'downloads': day['downloads'],
+                'listeners': day.get('listeners', 0) if isinstance(day.get('listeners'), int) else 0,
+                'episodes': day.get('episodes', {}),
+                'countries': day.get('countries', {}),
+            }
+            for day in days
+        ],
+    }
+
+
+def episode_shards(month_shards, titles):
+    """Build one document per episode with its daily downloads, oldest first."""
+    daily = collections.defaultdict(list)
+    for shard in month_shards:
+        for day in shard['days']:
+            for ep, count in day['episodes'].items():
+                daily[ep].append([day['date'], count])
+    return {
+        ep: {
+            'episode': int(ep),
+            'title': titles.get(str(ep), ''),
+            'totalDownloads': sum(count for _, count in series),
+            'daily': series,
+        }
+        for ep, series in daily.items()
+    }
+
+
+def publish_shards(state, published, changed_months=(), force=False, finished_shards=None):
+    """Publish the month and episode shards of the rolling window.
+
+    finished_shards maps the keys of published finished month shards to
+    their documents (see shard_state_key); finished months that did not
+    change are taken from it. Returns (index, uploaded, superseded,
+    finished_shards): the shard index for summary.json (paths relative to
+    it), the number of documents uploaded, the published keys no longer
+    referenced, to retire once summary.json points to their replacements,
+    and the finished shards of the window.
+    """
+    prefix = output_prefix()
+    finished_shards = finished_shards or {}
+    uploaded = 0
+    current = set()
+    window_shards = {}
+    index = {'months': {}, 'episodes': [], 'episodePath': episode_shard_key('{episode}')[len(prefix):]}
+    shards = []
+    for month in sorted(state['months']):
+        finished = is_month_compactable(month)
+        key = shard = None
+        if finished and not force and month not in changed_months:
+            existing = [k for k in published if k.startswith(month_shard_key(month)[:-len('json')])]
+            if len(existing) == 1 and existing[0] != month_shard_key(month):
+                # Named after its content: already published as it is
+                key = existing[0]
+                shard = finished_shards.get(key) or _read_json_object(key)
+        if shard is None:
+            shard = month_shard(month, read_month_days(month))
+            if finished:
+                key = month_shard_key(month, content_hash(shard))
+                uploaded += publish_json(key, shard, published, cache_control=IMMUTABLE_CACHE_CONTROL, force=force)
+            else:
+                key = month_shard_key(month)
+                uploaded += publish_json(key, shard, published, force=force)
+        if finished:
+            window_shards[key] = shard
+        shards.append(shard)
+        current.add(key)
+        index['months'][month] = key[len(prefix):]
+
+    for ep, document in sorted(episode_shards(shards, load_episode_titles()).items(), key=lambda kv: int(kv[0])):
+        key = episode_shard_key(ep)
+        uploaded += publish_json(key, document, published, force=force)
+        current.add(key)
+        index['episodes'].append(int(ep))
+
+    superseded = [
+        key for key in published
+        if key.startswith((f"{prefix}months/", f"{prefix}episodes/")) and key not in current
+    ]
+    return index, uploaded, superseded, window_shards
+
+
+def upload_analytics(analytics, state=None, changed_months=(), force=False, now=None):
+    """Publish analytics.json and, given the rolling state, summary.json and its shards.
+
+    changed_months lists the months whose days were rewritten by this run.
+    Returns the number of documents uploaded.
+    """
+    published = _read_json_object(published_state_key()) or {}
+    shard_state = _read_json_object(shard_state_key()) or {'finished': {}, 'retired': {}}
+    uploaded = publish_json(OUTPUT_KEY, analytics, published, force=force)
+    superseded = []
+    finished = shard_state['finished']
+    if state is not None:
+        index, shards_uploaded, superseded, finished = publish_shards(
+            state, published, changed_months, force, shard_state['finished'])
+        uploaded += shards_uploaded
+        uploaded += publish_json(summary_key(), {**analytics, 'shards': index}, published, force=force)
+    for key in superseded:
+        del published[key]
+    retired = retire_shards(superseded, published, shard_state['retired'], now)
+    # Saved before published.json, so a superseded shard is always listed
+    # in one of them and never left behind
+    if finished.keys() != shard_state['finished'].keys() or retired != shard_state['retired']:
+        _get_storage().put(
+            WEBSITE_BUCKET,
+            shard_state_key(),
+            json.dumps({'finished': finished, 'retired': retired}, ensure_ascii=False, separators=(',', ':')),
+            content_type='application/json',
+        )
+    if uploaded or superseded:
+        _get_storage().put(
+            WEBSITE_BUCKET,
+            published_state_key(),
+            json.dumps(published),
+            content_type='application/json',
+        )
+    return uploaded
+
+
+def retire_shards(superseded, published, retired, now=None):
+    """Record superseded shards as retired and delete those retired long enough.
+
+    retired maps retired keys to the time they were superseded; a key
+    published again (in published) is no longer retired. Returns the keys
+    still retired.
+    """
+    now = now or datetime.now(timezone.utc)
+    remaining = {key: at for key, at in retired.items() if key not in published}
+    for key in superseded:
+        remaining.setdefault(key, now.strftime('%Y-%m-%dT%H:%M:%SZ'))
+    cutoff = (now - timedelta(seconds=SHARD_RETENTION_SECONDS)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    expired = sorted(key for key, at in remaining.items() if at <= cutoff)
+    if expired:
+        _get_storage().delete(WEBSITE_BUCKET, [
+            key + suffix for key in expired for suffix in ('', '.gz', '.br')
+        ])
+        for key in expired:
+            del remaining[key]
+        logger.info("Deleted %d retired shards", len(expired))
+    return remaining
+
+
+def pending_publish_key():
+    return f"{STATE_PREFIX}pending-publish.json"
+
+
+def read_pending_months():
+    """Months changed by on_log_created since the last publish, or None if none."""
+    pending = _read_json_object(pending_publish_key())
+    return set(pending['months']) if pending is not None else None
+
+
+def add_pending_months(months):
+    pending = read_pending_months() or set()
+    _get_storage().put(
+        WEBSITE_BUCKET,
+        pending_publish_key(),
+        json.dumps({'months': sorted(pending.union(months))}),
+        content_type='application/json',
     )
-    logger.info("Uploaded analytics.json to s3://%s/%s", WEBSITE_BUCKET, OUTPUT_KEY)
+
+
+def clear_pending_months():
+    _get_storage().delete(WEBSITE_BUCKET, [pending_publish_key()])
 
 
 def update_watermark(processed_logs):
@@ -682,11 +2618,11 @@ def update_watermark(processed_logs):
         "last_processed": latest['LastModified'].isoformat() if hasattr(latest['LastModified'], 'isoformat') else latest['LastModified'],
         "last_key": latest['Key']
     }
-    _get_s3().put_object(
-        Bucket=WEBSITE_BUCKET,
-        Key=f"{STATE_PREFIX}watermark.json",
-        Body=json.dumps(watermark),
-        ContentType='application/json'
+    _get_storage().put(
+        WEBSITE_BUCKET,
+        WATERMARK_KEY,
+        json.dumps(watermark),
+        content_type='application/json',
     )
 
 
@@ -0,0 +1,108 @@
+"""
+HyperLogLog Cardinality Sketch
+
+Fixed-size, mergeable estimate of the number of distinct listeners. Daily
+aggregates store one sketch per day (and per episode); merging the sketches
+of any set of days gives the number of distinct listeners over those days,
+which summing daily unique counts cannot.
+
+Only 64-bit hashes of listener keys reach the registers (keyed with a
+secret by the pipeline, see handler.keyed_hash), and a sketch keeps
+nothing but one small rank per register, so raw IPs and user agents are
+never stored. With the default precision (4096 registers) the standard
+error is about 1.6%.
+"""
+import base64
+import hashlib
+import math
+import struct
+
+DEFAULT_PRECISION = 12
+_HASH_BITS = 64
+
+
+def hash_key(value, key=b''):
+    """Return the 64-bit hash of a listener key (str), keyed with `key` if given."""
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8, key=key).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class HyperLogLog:
+    """A HyperLogLog sketch with 2**precision one-byte registers."""
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError(f"precision must be between 4 and 16, got {precision}")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = registers if registers is not None else bytearray(self.m)
+        if len(self.registers) != self.m:
+            raise ValueError(f"expected {self.m} registers, got {len(self.registers)}")
+
+    def add(self, value):
+        """Add a listener key (str)."""
+        self.add_hash(hash_key(value))
+
+    def add_hash(self, h):
+        """Add a pre-computed 64-bit hash (see hash_key)."""
+        index = h >> (_HASH_BITS - self.precision)
+        remaining_bits = _HASH_BITS - self.precision
+        rest = h & ((1 << remaining_bits) - 1)
+        rank = remaining_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Merge another sketch of the same precision into this one (union)."""
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches with different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """Estimated number of distinct keys added."""
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # Small-range correction (linear counting); 64-bit hashes need no
+        # large-range correction at podcast scale
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_string(self):
+        """Serialize to a compact string: sparse for small sketches, dense otherwise."""
+        nonzero = [(i, r) for i, r in enumerate(self.registers) if r]
+        if len(nonzero) * 3 < self.m:
+            packed = b''.join(struct.pack('>HB', i, r) for i, r in nonzero)
+            kind = 's'
+        else:
+            packed = bytes(self.registers)
+            kind = 'd'
+        return f"{self.precision}{kind}{base64.b64encode(packed).decode('ascii')}"
+
+    @classmethod
+    def from_string(cls, data):
+        """Parse a string produced by to_string()."""
+        for pos, char in enumerate(data):
+            if char in 'sd':
+                break
+        else:
+            raise ValueError("not a serialized HyperLogLog sketch")
+        precision = int(data[:pos])
+        packed = base64.b64decode(data[pos + 1:])
+        if data[pos] == 'd':
+            return cls(precision, bytearray(packed))
+        sketch = cls(precision)
+        for i, r in struct.iter_unpack('>HB', packed):
+            sketch.registers[i] = r
+        return sketch
+
+    @classmethod
+    def union(cls, serialized, precision=DEFAULT_PRECISION):
+        """Merge serialized sketches into a new sketch."""
+        sketch = cls(precision)
+        for data in serialized:
+            sketch.merge(cls.from_string(data))
+        return sketch
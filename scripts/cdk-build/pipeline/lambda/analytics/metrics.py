@@ -0,0 +1,80 @@
+"""
+Pipeline Metrics
+
+Collects one run's measurements (stage durations, bytes fetched, lines
+scanned, drop reasons, peak memory) and prints them as a single CloudWatch
+Embedded Metric Format (EMF) JSON line on stdout. Lambda forwards stdout to
+CloudWatch Logs, which extracts the metrics: no PutMetricData calls, and
+the line can be checked offline by reading stdout.
+"""
+import contextlib
+import json
+import resource
+import sys
+import time
+
+# EMF accepts at most 100 metrics per directive
+_MAX_METRICS = 100
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process (environment lifetime on Lambda)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+class PipelineMetrics:
+    """Metric values of one run, emitted together as an EMF record."""
+
+    def __init__(self, namespace, dimensions=None):
+        self.namespace = namespace
+        self.dimensions = dict(dimensions or {})
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+
+    def add(self, name, value, unit='Count'):
+        """Add to a metric (created at 0)."""
+        self.values[name] = self.values.get(name, 0) + value
+        self.units[name] = unit
+
+    def set(self, name, value, unit='Count'):
+        self.values[name] = value
+        self.units[name] = unit
+
+    def set_property(self, name, value):
+        """Attach a searchable log field that is not a metric."""
+        self.properties[name] = value
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a block; repeated stages (one per batch) add up."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"{name}Duration", round((time.perf_counter() - started) * 1000, 1), 'Milliseconds')
+
+    def to_emf(self, timestamp=None):
+        """Return the EMF record as a dict."""
+        self.set('PeakMemory', peak_memory_mb(), 'Megabytes')
+        names = list(self.values)[:_MAX_METRICS]
+        record = {
+            '_aws': {
+                'Timestamp': int((timestamp if timestamp is not None else time.time()) * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(self.dimensions)],
+                    'Metrics': [{'Name': n, 'Unit': self.units[n]} for n in names],
+                }],
+            },
+            **self.dimensions,
+            **self.properties,
+        }
+        record.update((n, self.values[n]) for n in names)
+        return record
+
+    def emit(self, stream=None):
+        """Print the EMF record as one JSON line."""
+        print(json.dumps(self.to_emf(), separators=(',', ':')), file=stream or sys.stdout, flush=True)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Date-Range Queries over Daily Aggregates
+
+DailyIndex turns a run of daily aggregates into prefix-sum arrays over
+dense day indices (day 0 is the first date, missing days count as zero):
+one for all downloads, one per episode and one per country. Any
+[start, end) range sum is then two array lookups, after one O(days) pass
+per series to build them. render_analytics() uses it for its 7-day,
+30-day and weekly windows.
+
+As a command, it answers ad-hoc questions from the daily and monthly
+files of the pipeline state, in S3 or in a local folder (see run_local.py):
+
+Usage:
+    python3 query.py --from 2026-01-01 --to 2026-02-01
+    python3 query.py --from 2026-01-01 --to 2026-02-01 --episode 300
+    python3 query.py --from 2026-06-01 --by country --limit 10
+    python3 query.py --local /tmp/analytics-local --by episode --show awsfr
+"""
+import array
+import itertools
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+
+def _ordinal(date_str):
+    return date.fromisoformat(date_str).toordinal()
+
+
+def _prefix_sums(values):
+    return array.array('q', itertools.accumulate(values, initial=0))
+
+
+class DailyIndex:
+    """Range sums of downloads, per episode and per country, over a run of days.
+
+    Built from day aggregates ({'date', 'downloads', 'episodes',
+    'countries'}); days without episode or country counts only add to the
+    totals. Dates are YYYY-MM-DD strings and ranges are [start, end):
+    start None means the first indexed day, end None the day after the last.
+    """
+
+    def __init__(self, days):
+        days = list(days)
+        self.first = min((day['date'] for day in days), default=None)
+        self.last = max((day['date'] for day in days), default=None)
+        self._origin = _ordinal(self.first) if days else 0
+        size = _ordinal(self.last) - self._origin + 1 if days else 0
+
+        totals = [0] * size
+        series = {'episodes': {}, 'countries': {}}
+        for day in days:
+            i = _ordinal(day['date']) - self._origin
+            totals[i] += day['downloads']
+            for dimension, counts in series.items():
+                for key, count in day.get(dimension, {}).items():
+                    values = counts.get(key)
+                    if values is None:
+                        values = counts[key] = [0] * size
+                    values[i] += count
+
+        self._totals = _prefix_sums(totals)
+        self._series = {
+            dimension: {key: _prefix_sums(values) for key, values in counts.items()}
+            for dimension, counts in series.items()
+        }
+
+    def __len__(self):
+        """Number of indexed days, including missing days inside the run."""
+        return len(self._totals) - 1
+
+    def _bounds(self, start, end):
+        """Prefix-array positions of [start, end), clamped to the indexed days."""
+        lo = 0 if start is None else _ordinal(start) - self._origin
+        hi = len(self) if end is None else _ordinal(end) - self._origin
+        lo = min(max(lo, 0), len(self))
+        hi = min(max(hi, lo), len(self))
+        return lo, hi
+
+    def downloads(self, start=None, end=None, episode=None, country=None):
+        """Downloads in [start, end), of one episode or one country if given."""
+        if episode is not None and country is not None:
+            raise ValueError("days are indexed per episode or per country, not both")
+        if episode is not None:
+            prefix = self._series['episodes'].get(str(episode))
+        elif country is not None:
+            prefix = self._series['countries'].get(country)
+        else:
+            prefix = self._totals
+        if prefix is None:
+            return 0
+        lo, hi = self._bounds(start, end)
+        return prefix[hi] - prefix[lo]
+
+    def breakdown(self, dimension, start=None, end=None, limit=None):
+        """[(key, downloads)] per 'episodes' or 'countries' in [start, end), largest first."""
+        lo, hi = self._bounds(start, end)
+        counts = [(key, prefix[hi] - prefix[lo]) for key, prefix in self._series[dimension].items()]
+        counts = sorted((kv for kv in counts if kv[1]), key=lambda kv: (-kv[1], kv[0]))
+        return counts[:limit] if limit else counts
+
+    def daily(self, start=None, end=None):
+        """[(date, downloads)] for every day of [start, end), missing days as 0."""
+        lo, hi = self._bounds(start, end)
+        return [
+            (date.fromordinal(self._origin + i).isoformat(), self._totals[i + 1] - self._totals[i])
+            for i in range(lo, hi)
+        ]
+
+
+def parse_args():
+    # Imported here: handler imports this module on every cold start
+    import argparse
+    parser = argparse.ArgumentParser(description='Query downloads over a date range')
+    parser.add_argument('--from', dest='start', help='First date, YYYY-MM-DD (default: start of the state window)')
+    parser.add_argument('--to', dest='end', help='Day after the last date, YYYY-MM-DD (default: through the last day)')
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument('--episode', help='Downloads of one episode')
+    selection.add_argument('--country', help='Downloads from one country code')
+    selection.add_argument('--by', choices=('episode', 'country', 'day'), help='Break the range down')
+    parser.add_argument('--limit', type=int, help='Rows to show with --by episode/country')
+    parser.add_argument('--show', help='Show id from SHOW_ROUTES (default: the first show)')
+    parser.add_argument('--local', metavar='ROOT', help='Read a run_local.py folder instead of S3')
+    parser.add_argument('--website-bucket', default=None,
+                        help='Bucket (or folder under ROOT) holding the state (default: WEBSITE_BUCKET, or website)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # handler reads its configuration at import time
+    if args.local:
+        os.environ['STORAGE_BACKEND'] = 'local'
+        os.environ['LOCAL_STORAGE_ROOT'] = os.path.abspath(args.local)
+        os.environ.setdefault('WEBSITE_BUCKET', 'website')
+    if args.website_bucket:
+        os.environ['WEBSITE_BUCKET'] = args.website_bucket
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import handler
+
+    shows = {show.id: show for show in handler.SHOWS}
+    show = shows[args.show] if args.show else handler.SHOWS[0]
+    cutoff = min(args.start or handler.window_start(), handler.window_start())
+    with handler.show_context(show):
+        days = handler.read_daily_files(handler.list_monthly_files(cutoff) + handler.list_daily_files(cutoff), cutoff)
+    index = DailyIndex(days)
+
+    result = {
+        'show': show.id,
+        'from': args.start or index.first,
+        'to': args.end or (index.last and (date.fromisoformat(index.last) + timedelta(days=1)).isoformat()),
+        'downloads': index.downloads(args.start, args.end, episode=args.episode, country=args.country),
+    }
+    if args.episode:
+        result['episode'] = args.episode
+    if args.country:
+        result['country'] = args.country
+    if args.by == 'day':
+        result['days'] = [{'date': d, 'downloads': n} for d, n in index.daily(args.start, args.end)]
+    elif args.by:
+        dimension = 'episodes' if args.by == 'episode' else 'countries'
+        result[dimension] = [
+            {args.by: key, 'downloads': n}
+            for key, n in index.breakdown(dimension, args.start, args.end, args.limit)
+        ]
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Run the Analytics Pipeline Locally
+
+Runs handler.main() end-to-end against local folders instead of S3. Each
+bucket is a directory under --root mirroring the bucket's key layout:
+
+    ROOT/logs/cloudfront-logs/E2ABC.2026-07-30-10.abcd1234.gz    (input)
+    ROOT/website/analytics-state/...                             (state)
+    ROOT/website/awsfr/site/data/analytics.json                  (output)
+    ROOT/website/awsfr/site/data/summary.json, months/, episodes/ (output)
+
+The OP3 comparison is skipped unless --op3 is given, so no network access
+is needed. Run it again to process logs added since the last run, exactly
+as the scheduled Lambda does.
+
+Usage:
+    python3 run_local.py --root /tmp/analytics-local
+    python3 run_local.py --root /tmp/analytics-local --full-rebuild
+    python3 run_local.py --root /tmp/analytics-local --time-budget 60
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+
+class LocalContext:
+    """Stand-in for the Lambda context, with an optional time budget."""
+
+    def __init__(self, budget_seconds):
+        self.deadline = time.monotonic() + budget_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run the analytics pipeline against local folders')
+    parser.add_argument('--root', required=True, help='Folder holding one sub-folder per bucket')
+    parser.add_argument('--log-bucket', default='logs', help='Log bucket folder name (default: logs)')
+    parser.add_argument('--website-bucket', default='website', help='Website bucket folder name (default: website)')
+    parser.add_argument('--full-rebuild', action='store_true', help='Rebuild the rolling state from all daily files')
+    parser.add_argument('--verify-state', action='store_true', help='Check the rolling state against a rebuild')
+    parser.add_argument('--op3', action='store_true', help='Fetch the OP3 comparison (needs network and SSM)')
+    parser.add_argument('--time-budget', type=float, help='Simulated Lambda time limit in seconds')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    # handler reads its configuration at import time
+    os.environ['STORAGE_BACKEND'] = 'local'
+    os.environ['LOCAL_STORAGE_ROOT'] = os.path.abspath(args.root)
+    os.environ['LOG_BUCKET'] = args.log_bucket
+    os.environ['WEBSITE_BUCKET'] = args.website_bucket
+    os.environ['OP3_ENABLED'] = 'true' if args.op3 else 'false'
+    os.environ['SNS_TOPIC_ARN'] = ''
+    # Hashes of local runs are keyed with a fixed secret unless one is given
+    os.environ.setdefault('HASH_SECRET', 'local')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import handler
+
+    event = {'fullRebuild': args.full_rebuild, 'verifyState': args.verify_state}
+    context = LocalContext(args.time_budget) if args.time_budget else None
+    result = handler.main(event, context)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Storage Backends
+
+The pipeline addresses everything it reads and writes (CloudFront logs,
+watermark, daily aggregates, state, analytics.json) by bucket and key.
+S3Storage keeps them in S3. LocalStorage maps each bucket to a directory
+under a root folder (ROOT/<bucket>/<key>), so the pipeline runs offline
+against local copies of the log and website buckets with the same layout.
+"""
+import hashlib
+import os
+import tempfile
+from datetime import datetime, timezone
+
+
+class ObjectNotFound(Exception):
+    """The requested key does not exist."""
+
+
+class S3Storage:
+    """Objects in S3, through a boto3 S3 client."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, bucket, key):
+        """Return an object's bytes, or raise ObjectNotFound."""
+        try:
+            return self.client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except Exception as e:
+            code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+            if code in ('NoSuchKey', '404'):
+                raise ObjectNotFound(f"s3://{bucket}/{key}") from e
+            raise
+
+    def put(self, bucket, key, body, content_type=None, **headers):
+        """Write an object. headers are S3 PutObject parameters (CacheControl, ...)."""
+        params = {'Bucket': bucket, 'Key': key, 'Body': body, **headers}
+        if content_type:
+            params['ContentType'] = content_type
+        self.client.put_object(**params)
+
+    def list(self, bucket, prefix='', start_after=None):
+        """Yield {'Key', 'LastModified', 'Size', 'ETag'} for keys under prefix, in key order."""
+        params = {'Bucket': bucket, 'Prefix': prefix}
+        if start_after:
+            params['StartAfter'] = start_after
+        for page in self.client.get_paginator('list_objects_v2').paginate(**params):
+            yield from page.get('Contents', [])
+
+    def delete(self, bucket, keys):
+        """Delete keys; missing keys are ignored."""
+        keys = list(keys)
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=bucket,
+                Delete={'Objects': [{'Key': k} for k in keys[i:i + 1000]], 'Quiet': True},
+            )
+
+
+class LocalStorage:
+    """Objects as files under root/<bucket>/<key>.
+
+    Listings report the file's modification time as LastModified and a
+    size/mtime fingerprint as ETag. Content headers are not kept.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def get(self, bucket, key):
+        try:
+            with open(self._path(bucket, key), 'rb') as f:
+                return f.read()
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError) as e:
+            raise ObjectNotFound(os.path.join(bucket, key)) from e
+
+    def put(self, bucket, key, body, content_type=None, **headers):
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        # Write-then-rename, so readers never see a partial object
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def list(self, bucket, prefix='', start_after=None):
+        bucket_dir = os.path.join(self.root, bucket)
+        # Only walk the directory the prefix points into
+        base = prefix.rsplit('/', 1)[0] if '/' in prefix else ''
+        top = os.path.join(bucket_dir, *base.split('/')) if base else bucket_dir
+        keys = []
+        for dirpath, _, filenames in os.walk(top):
+            rel = os.path.relpath(dirpath, bucket_dir).replace(os.sep, '/')
+            for name in filenames:
+                if name.startswith('.tmp-'):
+                    continue
+                key = name if rel == '.' else f"{rel}/{name}"
+                if key.startswith(prefix) and (not start_after or key > start_after):
+                    keys.append(key)
+        for key in sorted(keys):
+            stat = os.stat(self._path(bucket, key))
+            fingerprint = hashlib.md5(f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+            yield {
+                'Key': key,
+                'LastModified': datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+                'Size': stat.st_size,
+                'ETag': f'"{fingerprint}"',
+            }
+
+    def delete(self, bucket, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(bucket, key))
+            except FileNotFoundError:
+                pass
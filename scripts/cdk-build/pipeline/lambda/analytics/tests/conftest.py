@@ -1,2 +1,53 @@
 import sys, os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('HASH_SECRET', 'test')
+
+import gzip
+
+import pytest
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+@pytest.fixture
+def local_pipeline(tmp_path, monkeypatch):
+    """handler wired to local folders under tmp_path, as run_local.py does.
+
+    Returns the storage root: logs go to ROOT/logs/cloudfront-logs/ (see
+    write_log) and the state and output to ROOT/website/.
+    """
+    import handler
+    monkeypatch.setattr(handler, 'STORAGE_BACKEND', 'local')
+    monkeypatch.setattr(handler, 'LOCAL_STORAGE_ROOT', str(tmp_path))
+    monkeypatch.setattr(handler, 'LOG_BUCKET', 'logs')
+    monkeypatch.setattr(handler, 'WEBSITE_BUCKET', 'website')
+    monkeypatch.setattr(handler, 'OP3_ENABLED', False)
+    monkeypatch.setattr(handler, 'SNS_TOPIC_ARN', '')
+    monkeypatch.setattr(handler, '_storage', None)
+    return tmp_path
+
+
+@pytest.fixture
+def write_log(local_pipeline):
+    """write_log(name, lines): gzip log lines (with the W3C header) into the log bucket."""
+    with open(os.path.join(FIXTURES, 'sample-cloudfront-log.txt'), encoding='utf-8') as f:
+        header = ''.join(line for line in f if line.startswith('#'))
+
+    def write(name, lines):
+        folder = local_pipeline / 'logs' / 'cloudfront-logs'
+        folder.mkdir(parents=True, exist_ok=True)
+        body = header + ''.join(line if line.endswith('\n') else line + '\n' for line in lines)
+        (folder / name).write_bytes(gzip.compress(body.encode('utf-8')))
+        return f"cloudfront-logs/{name}"
+
+    return write
+
+
+@pytest.fixture
+def fixture_lines():
+    """fixture_lines(name): the log lines of a fixture file, without its header."""
+    def read(name):
+        with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+            return [line for line in f if not line.startswith('#')]
+
+    return read
@@ -0,0 +1,46 @@
+"""
+Cold-start import budget for the Lambda module.
+
+Imports handler in a fresh interpreter with -X importtime and checks the
+cumulative import time, and that the heavy modules (boto3, maxminddb,
+brotli, urllib.request) are left to first use. COLD_IMPORT_BUDGET_MS
+overrides the budget on slow machines.
+"""
+import os
+import subprocess
+import sys
+
+ANALYTICS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLD_IMPORT_BUDGET_MS = float(os.environ.get('COLD_IMPORT_BUDGET_MS', '150'))
+LAZY_MODULES = ('boto3', 'botocore', 'maxminddb', 'brotli', 'urllib.request')
+ATTEMPTS = 3
+
+
+def import_times(module='handler'):
+    """Run `import module` in a fresh interpreter: {module: cumulative microseconds}."""
+    env = {key: value for key, value in os.environ.items() if key != 'SHOW_ROUTES'}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ANALYTICS_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_heavy_modules_are_imported_lazily():
+    times = import_times()
+    eager = [name for name in times if name.split('.')[0] in LAZY_MODULES or name in LAZY_MODULES]
+    assert eager == []
+
+
+def test_cold_import_within_budget():
+    # Best of a few runs: the budget is about the code, not machine noise
+    best_ms = min(import_times()['handler'] for _ in range(ATTEMPTS)) / 1000
+    assert best_ms <= COLD_IMPORT_BUDGET_MS, (
+        f"importing handler took {best_ms:.0f} ms (budget {COLD_IMPORT_BUDGET_MS:.0f} ms)"
+    )
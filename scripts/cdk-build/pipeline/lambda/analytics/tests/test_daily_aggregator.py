@@ -0,0 +1,59 @@
+"""
+DailyAggregator: one pass must give the same daily metrics, in the same key
+order, as aggregate_daily(deduplicate(apply_iab_filtering(records))).
+"""
+import random
+
+import pytest
+
+import handler
+
+IPS = ('203.0.113.7', '203.0.113.8', '198.51.100.1', '2001:db8:1:1::1', '2001:db8:1:1::2', '2001:db8:1:2::1')
+UAS = ('Overcast/3.0', 'AppleCoreMedia/1.0.0 (iPhone)', 'Spotify/8.8.0 iOS/17.5.1', 'curl/8.7.1', 'Bot', '')
+
+
+def reference(records):
+    return handler.aggregate_daily(handler.deduplicate(handler.apply_iab_filtering(records)))
+
+
+def assert_same_metrics(actual, expected):
+    assert actual == expected
+    assert list(actual) == list(expected)
+    for date, day in expected.items():
+        assert list(actual[date]['episodes']) == list(day['episodes'])
+        assert list(actual[date]['countries']) == list(day['countries'])
+
+
+def test_fixture_logs(fixture_lines):
+    lines = fixture_lines('sample-cloudfront-log.txt') + fixture_lines('test-entries.txt')
+    records = [r for r in map(handler.parse_log_line, lines) if r]
+    assert_same_metrics(handler.DailyAggregator().add_all(records).aggregate(), reference(records))
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_random_records(monkeypatch, seed):
+    monkeypatch.setattr(handler, 'MIN_DOWNLOAD_BYTES', 1000)
+    monkeypatch.setattr(handler, 'MAX_REQUESTS_PER_IP_DAY', 8)
+    monkeypatch.setattr(handler, 'lookup_country', lambda ip: f"C{ip[-1]}")
+    rng = random.Random(seed)
+    records = []
+    for _ in range(rng.randrange(1, 80)):
+        status = rng.choice((200, 206))
+        range_start = rng.choice((None, 0, rng.randrange(0, 1500))) if status == 206 else None
+        range_end = range_start + rng.choice((1, rng.randrange(1, 1200))) if range_start is not None else None
+        records.append(handler.DownloadRecord(
+            date=rng.choice(('2026-07-30', '2026-07-31')),
+            time=f"10:{rng.randrange(4):02d}:{rng.randrange(4):02d}",
+            ip=rng.choice(IPS),
+            ua=rng.choice(UAS),
+            episode=rng.choice(('300', '301', '302')),
+            sc_bytes=rng.randrange(0, 1500),
+            status=status,
+            range_start=range_start,
+            range_end=range_end,
+            is_range_probe=range_start == 0 and range_end == 1,
+        ))
+    aggregator = handler.DailyAggregator().add_all(records)
+    assert_same_metrics(aggregator.aggregate(), reference(records))
+    assert aggregator.filtered == len(handler.apply_iab_filtering(records))
+    assert aggregator.unique == sum(day['downloads'] for day in reference(records).values())
@@ -0,0 +1,134 @@
+"""
+DayState serialization: round trips of the current format, and states
+written by earlier versions (1: rows and IP counts, 2: + partial sessions,
+3: + merged log files, 4: rows per raw IP), whose hashes were not keyed.
+"""
+import array
+
+import pytest
+
+import handler
+from day_state import DAY_STATE_VERSION, DayState, _pack
+from hll import hash_key
+
+
+@pytest.fixture(autouse=True)
+def small_threshold(monkeypatch):
+    monkeypatch.setattr(handler, 'MIN_DOWNLOAD_BYTES', 1000)
+
+
+def legacy_json(version):
+    data = {
+        'version': version,
+        'date': '2026-07-30',
+        'keys': _pack(array.array('Q', [11, 12])),
+        'listeners': _pack(array.array('Q', [21, 21])),
+        'ips': _pack(array.array('Q', [31, 32])),
+        'episodeIds': _pack(array.array('H', [0, 1])),
+        'countryIds': _pack(array.array('H', [0, 0])),
+        'episodes': ['300', '301'],
+        'countries': ['FR'],
+        'ipHashes': _pack(array.array('Q', [31, 32])),
+        'ipCounts': _pack(array.array('I', [3, 4])),
+    }
+    if version >= 2:
+        data['partialKeys'] = _pack(array.array('Q', [13]))
+        data['partialLengths'] = _pack(array.array('H', [2]))
+        data['partialBounds'] = _pack(array.array('Q', [0, 100, 200, 300]))
+    if version >= 3:
+        data['sources'] = _pack(array.array('Q', [41, 42]))
+    if version >= 4:
+        data['generation'] = 3
+    return data
+
+
+def current_state():
+    state = DayState('2026-07-30')
+    sessions = [
+        # key, listener, ip, episode, country, time, order, ranges
+        (1, 10, 100, '300', 'FR', 36000, 0, None),
+        (2, 10, 100, '301', 'FR', 36010, 1, ((0, 500),)),
+        (2, 10, 101, '301', 'BE', 36005, 2, ((400, 2000),)),
+        (3, 11, 102, '300', 'US', 36020, 3, ((0, 10), (20, 30))),
+    ]
+    for session in sessions:
+        state.add_session(*session, handler.merge_byte_ranges)
+    for key in (1, 2, 3):
+        state.settle(key, handler.merge_byte_ranges)
+    state.add_requests(100, 2)
+    state.add_requests(101, 1)
+    state.add_source(hash_key('E1.2026-07-30-10.a.gz\tetag'))
+    state.next_order = 4
+    return state
+
+
+def test_round_trip():
+    state = current_state()
+    assert len(state) == 2
+    loaded = DayState.from_json(state.to_json())
+    assert loaded.to_json() == state.to_json()
+    assert loaded.aggregate() == state.aggregate()
+    assert loaded.partial == {(2, 100): ((0, 500),), (2, 101): ((400, 2000),), (3, 102): ((0, 10), (20, 30))}
+    assert loaded.next_order == 4
+
+
+def test_session_is_attributed_to_its_earliest_row():
+    state = current_state()
+    # Key 2 only counts with both rows, and goes to the earlier one (BE)
+    assert state.has_download(2)
+    assert state.aggregate()['countries'] == {'FR': 1, 'BE': 1}
+
+
+@pytest.mark.parametrize('version', [1, 2, 3, 4])
+def test_earlier_versions_keep_only_their_log_files(version):
+    state = DayState.from_json(legacy_json(version))
+    # Unkeyed IP hashes are dropped: the state is incomplete, as a compacted day
+    assert len(state) == 0 and not state.complete
+    assert state.ip_counts == {} and state.partial == {}
+    assert state.sources == ({41, 42} if version >= 3 else set())
+    assert state.generation == (3 if version >= 4 else 0)
+
+    data = state.to_json()
+    assert data['version'] == DAY_STATE_VERSION
+    assert DayState.from_json(data).to_json() == data
+
+
+def test_keyed_hash_depends_on_the_secret(monkeypatch):
+    monkeypatch.setattr(handler, '_hash_secret', None)
+    monkeypatch.setenv('HASH_SECRET', 'one')
+    first = handler.keyed_hash('203.0.113.7')
+    assert first != hash_key('203.0.113.7')
+    assert handler.keyed_hash('203.0.113.7') == first
+
+    monkeypatch.setattr(handler, '_hash_secret', None)
+    monkeypatch.setenv('HASH_SECRET', 'two')
+    assert handler.keyed_hash('203.0.113.7') != first
+
+
+def test_hash_secret_from_ssm(monkeypatch):
+    class SSM:
+        def get_parameter(self, Name, WithDecryption):
+            assert (Name, WithDecryption) == (handler.HASH_SECRET_PARAM, True)
+            return {'Parameter': {'Value': 'one'}}
+
+    monkeypatch.setattr(handler, '_hash_secret', None)
+    monkeypatch.setenv('HASH_SECRET', 'one')
+    expected = handler.keyed_hash('203.0.113.7')
+    monkeypatch.setattr(handler, '_hash_secret', None)
+    monkeypatch.delenv('HASH_SECRET')
+    handler.load_hash_secret(SSM())
+    assert handler.keyed_hash('203.0.113.7') == expected
+
+
+def test_retracting_an_ip_settles_shared_keys():
+    state = current_state()
+    assert state.retract_ip(101, handler.merge_byte_ranges) == {2}
+    # Key 2 no longer reaches the threshold without the BE row
+    assert not state.has_download(2)
+    assert state.aggregate()['downloads'] == 1
+    assert state.partial[2, 100] == ((0, 500),)
+
+
+def test_unsupported_version():
+    with pytest.raises(ValueError):
+        DayState.from_json({**current_state().to_json(), 'version': DAY_STATE_VERSION + 1})
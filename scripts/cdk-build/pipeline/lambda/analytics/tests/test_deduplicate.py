@@ -0,0 +1,66 @@
+"""
+deduplicate: one pass over the records must keep the same requests, in the
+same order, as the sort-based version it replaced.
+"""
+import operator
+import random
+
+import pytest
+
+import handler
+
+
+def sorted_deduplicate(records):
+    """The previous implementation: stable sort by time, keep the first per key."""
+    seen = set()
+    result = []
+    for r in sorted(records, key=lambda r: (r.date, r.time)):
+        key = (r.date, handler.truncate_ipv6(r.ip), r.ua, r.episode)
+        if key not in seen:
+            seen.add(key)
+            result.append(r)
+    return result
+
+
+def random_records(seed, count):
+    rng = random.Random(seed)
+    return [
+        handler.DownloadRecord(
+            date=rng.choice(('2026-07-30', '2026-07-31')),
+            # few distinct times, so ties between duplicates are common
+            time=f"10:0{rng.randrange(3)}:0{rng.randrange(3)}",
+            ip=rng.choice(('203.0.113.7', '198.51.100.1', '2001:db8:1:1::1', '2001:db8:1:1::2', '2001:db8:1:2::1')),
+            ua=rng.choice(('Overcast/3.0', 'Spotify/8.8.0 iOS/17.5.1')),
+            episode=rng.choice(('300', '301')),
+            sc_bytes=rng.randrange(2_000_000),
+            status=200,
+            is_range_probe=False,
+        )
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_matches_sorted_deduplicate(seed):
+    records = random_records(seed, random.Random(seed).randrange(0, 120))
+    assert [id(r) for r in handler.deduplicate(records)] == [id(r) for r in sorted_deduplicate(records)]
+
+
+def as_dict(record):
+    return {field: getattr(record, field) for field in handler.DownloadRecord.__slots__}
+
+
+def test_dict_records():
+    # backfill.apply_filters passes dicts
+    records = random_records(7, 200)
+    deduplicated = handler.deduplicate(
+        [as_dict(r) for r in records], fields=operator.itemgetter('date', 'time', 'ip', 'ua', 'episode'))
+    assert deduplicated == [as_dict(r) for r in sorted_deduplicate(records)]
+
+
+def test_ipv6_addresses_of_one_64_share_a_key():
+    first = handler.DownloadRecord(
+        '2026-07-30', '10:00:00', '2001:db8:1:1::2', 'Overcast/3.0', '300', 2_000_000, 200, False)
+    later = handler.DownloadRecord(
+        '2026-07-30', '10:00:01', '2001:db8:1:1::1', 'Overcast/3.0', '300', 2_000_000, 200, False)
+    assert handler.deduplicate([later, first]) == [first]
@@ -0,0 +1,42 @@
+"""
+fetch_objects() bounds: input order, and compressed bytes fetched ahead.
+"""
+import threading
+
+import handler
+
+
+def test_fetch_ahead_stays_within_max_bytes(local_pipeline, monkeypatch):
+    sizes = {f"k{i:02d}": size for i, size in enumerate([5, 1, 8, 3, 12, 2, 2, 2, 7, 4, 1, 9])}
+    started = []
+    lock = threading.Lock()
+
+    def fetch(bucket, key):
+        with lock:
+            started.append(key)
+        return key.encode()
+
+    monkeypatch.setattr(handler, '_fetch_object', fetch)
+    keys = sorted(sizes)
+    consumed = []
+    for key, data, error in handler.fetch_objects('logs', keys, concurrency=4, queue_size=8,
+                                                  sizes=sizes, max_bytes=10):
+        assert error is None and data == key.encode()
+        consumed.append(key)
+        with lock:
+            ahead = [k for k in started if k not in consumed]
+        # The object larger than max_bytes (12) is only fetched on its own
+        assert sum(sizes[k] for k in ahead) <= 10
+    assert consumed == keys
+
+
+def test_errors_are_yielded_in_order(local_pipeline, monkeypatch):
+    def fetch(bucket, key):
+        if key == 'bad':
+            raise OSError('boom')
+        return b'ok'
+
+    monkeypatch.setattr(handler, '_fetch_object', fetch)
+    results = list(handler.fetch_objects('logs', ['a', 'bad', 'c'], concurrency=2))
+    assert [key for key, _, _ in results] == ['a', 'bad', 'c']
+    assert isinstance(results[1][2], OSError) and results[1][1] is None
@@ -0,0 +1,79 @@
+"""
+HyperLogLog: estimates within a few standard errors, merges equal to one
+sketch over all keys, and serialization round trips.
+"""
+import pytest
+
+from hll import HyperLogLog, hash_key
+
+STANDARD_ERROR = 1.04 / (1 << 12) ** 0.5  # ~1.6% at the default precision
+
+
+def sketch_of(keys, precision=12):
+    sketch = HyperLogLog(precision)
+    for key in keys:
+        sketch.add(key)
+    return sketch
+
+
+def listeners(start, stop):
+    return (f"203.0.113.{i % 256}|{i}|Overcast/3.0" for i in range(start, stop))
+
+
+@pytest.mark.parametrize('n', [10, 100, 1000, 10_000, 100_000])
+def test_estimate_within_three_standard_errors(n):
+    estimate = sketch_of(listeners(0, n)).count()
+    assert abs(estimate - n) <= 3 * STANDARD_ERROR * n + 1
+
+
+def test_repeated_keys_count_once():
+    keys = list(listeners(0, 500))
+    assert sketch_of(keys * 5).registers == sketch_of(keys).registers
+
+
+def test_add_hash_matches_add():
+    keys = list(listeners(0, 1000))
+    sketch = HyperLogLog()
+    for key in keys:
+        sketch.add_hash(hash_key(key))
+    assert sketch.registers == sketch_of(keys).registers
+
+
+def test_merge_is_the_union():
+    a = sketch_of(listeners(0, 30_000))
+    b = sketch_of(listeners(20_000, 50_000))
+    union = sketch_of(listeners(0, 50_000))
+    assert a.merge(b).registers == union.registers
+    assert abs(a.count() - 50_000) <= 3 * STANDARD_ERROR * 50_000
+
+
+def test_union_of_serialized_sketches():
+    days = [sketch_of(listeners(i * 1000, i * 1000 + 1500)).to_string() for i in range(7)]
+    assert HyperLogLog.union(days).registers == sketch_of(listeners(0, 7500)).registers
+    assert HyperLogLog.union([]).count() == 0
+
+
+@pytest.mark.parametrize('n, kind', [(0, 's'), (50, 's'), (5000, 'd')])
+def test_serialization_round_trip(n, kind):
+    sketch = sketch_of(listeners(0, n))
+    data = sketch.to_string()
+    assert data.startswith(f"12{kind}")
+    restored = HyperLogLog.from_string(data)
+    assert restored.precision == 12
+    assert restored.registers == sketch.registers
+
+
+def test_other_precisions_round_trip():
+    sketch = sketch_of(listeners(0, 2000), precision=14)
+    assert HyperLogLog.from_string(sketch.to_string()).registers == sketch.registers
+
+
+def test_invalid_sketches_are_rejected():
+    with pytest.raises(ValueError):
+        HyperLogLog(3)
+    with pytest.raises(ValueError):
+        HyperLogLog(12, bytearray(10))
+    with pytest.raises(ValueError):
+        HyperLogLog.from_string('not a sketch')
+    with pytest.raises(ValueError):
+        HyperLogLog(12).merge(HyperLogLog(10))
@@ -0,0 +1,151 @@
+"""
+handler.main() end to end over local storage (see conftest.local_pipeline).
+"""
+import json
+import re
+
+import pytest
+
+import handler
+import storage
+
+OUTPUT = ('website', 'awsfr', 'site', 'data', 'analytics.json')
+ROLLING_STATE = ('website', 'analytics-state', 'analytics-summary.json')
+SHARD_STATE = ('website', 'analytics-state', 'shards.json')
+
+
+def read_output(root, parts=OUTPUT):
+    document = json.loads(root.joinpath(*parts).read_text())
+    document.pop('generatedAt', None)
+    return document
+
+
+def run(event=None):
+    return handler.main(event or {}, None)
+
+
+def test_new_logs_are_published(local_pipeline, write_log, fixture_lines):
+    write_log('E2ABC.2026-07-31-09.abcd1234.gz', fixture_lines('sample-cloudfront-log.txt'))
+    result = run()
+    assert result['complete']
+    assert sum(month['count'] for month in read_output(local_pipeline)['monthlyDownloads']) > 0
+    assert run() == {"statusCode": 200, "body": "No new logs"}
+
+
+def test_full_rebuild_without_new_logs(local_pipeline, write_log, fixture_lines):
+    write_log('E2ABC.2026-07-31-09.abcd1234.gz', fixture_lines('sample-cloudfront-log.txt'))
+    run()
+    expected = read_output(local_pipeline)
+
+    # Lose the published document and the rolling state: only the day files remain
+    local_pipeline.joinpath(*OUTPUT).write_text('{}')
+    local_pipeline.joinpath(*ROLLING_STATE).unlink()
+
+    result = run({'fullRebuild': True})
+    assert result['body'] != "No new logs"
+    assert read_output(local_pipeline) == expected
+    assert local_pipeline.joinpath(*ROLLING_STATE).exists()
+
+
+def test_verify_state_without_new_logs(local_pipeline, write_log, fixture_lines):
+    write_log('E2ABC.2026-07-31-09.abcd1234.gz', fixture_lines('sample-cloudfront-log.txt'))
+    run()
+    expected = read_output(local_pipeline)
+
+    state_path = local_pipeline.joinpath(*ROLLING_STATE)
+    state = json.loads(state_path.read_text())
+    for month in state['months'].values():
+        month['downloads'] += 1000
+    state_path.write_text(json.dumps(state))
+
+    result = run({'verifyState': True})
+    assert result['body'] != "No new logs"
+    assert read_output(local_pipeline) == expected
+    assert json.loads(state_path.read_text())['months'] != state['months']
+
+
+def test_only_content_named_shards_are_immutable(local_pipeline, write_log, fixture_lines, monkeypatch):
+    cache_control = {}
+    put = storage.LocalStorage.put
+
+    def recording_put(self, bucket, key, body, content_type=None, **headers):
+        if 'CacheControl' in headers:
+            cache_control[key] = headers['CacheControl']
+        return put(self, bucket, key, body, content_type, **headers)
+
+    monkeypatch.setattr(storage.LocalStorage, 'put', recording_put)
+    write_log('E2ABC.2026-07-31-09.abcd1234.gz', fixture_lines('sample-cloudfront-log.txt'))
+    run()
+
+    immutable = {key for key, value in cache_control.items() if value == handler.IMMUTABLE_CACHE_CONTROL}
+    assert immutable
+    assert all(re.search(r'/months/\d{4}-\d{2}\.[0-9a-f]{12}\.json', key) for key in immutable)
+    assert cache_control['awsfr/site/data/summary.json'] == handler.MUTABLE_CACHE_CONTROL
+    assert cache_control['awsfr/site/data/analytics.json.gz'] == handler.MUTABLE_CACHE_CONTROL
+    assert set(cache_control.values()) == {handler.IMMUTABLE_CACHE_CONTROL, handler.MUTABLE_CACHE_CONTROL}
+
+
+def test_replaced_month_shards_are_retired_before_deletion(local_pipeline, write_log, fixture_lines, monkeypatch):
+    data = local_pipeline / 'website' / 'awsfr' / 'site' / 'data'
+    write_log('E2ABC.2026-07-31-09.abcd1234.gz', fixture_lines('sample-cloudfront-log.txt'))
+    run()
+    [first] = data.glob('months/2026-07.*.json')
+
+    # A late log changes the finished month: its shard gets a new name
+    write_log('E2ABC.2026-07-31-10.abcd1234.gz', fixture_lines('test-entries.txt'))
+    run()
+    assert len(list(data.glob('months/2026-07.*.json'))) == 2
+    retired = json.loads(local_pipeline.joinpath(*SHARD_STATE).read_text())['retired']
+    assert list(retired) == [f"awsfr/site/data/months/{first.name}"]
+
+    monkeypatch.setattr(handler, 'SHARD_RETENTION_SECONDS', 0)
+    assert handler.retire_shards([], {}, retired) == {}
+    assert first.name not in [path.name for path in data.glob('months/*')]
+    assert not list(data.glob(f"months/{first.name}.*"))
+
+
+def test_unchanged_finished_months_are_not_read_again(local_pipeline, write_log, fixture_lines, monkeypatch):
+    write_log('E2ABC.2026-07-31-09.abcd1234.gz', fixture_lines('sample-cloudfront-log.txt'))
+    run()
+    finished = json.loads(local_pipeline.joinpath(*SHARD_STATE).read_text())['finished']
+    assert [key.split('/')[-1][:8] for key in finished] == ['2026-07.']
+
+    reads = []
+    get = storage.LocalStorage.get
+
+    def recording_get(self, bucket, key):
+        reads.append(key)
+        return get(self, bucket, key)
+
+    monkeypatch.setattr(storage.LocalStorage, 'get', recording_get)
+    # A log of the open month: July is published from the shard state
+    october = [line.replace('2026-07-31', '2026-10-17', 1) for line in fixture_lines('sample-cloudfront-log.txt')]
+    write_log('E2ABC.2026-10-17-09.abcd1234.gz', october)
+    run()
+    assert not [key for key in reads if '2026-07' in key]
+    assert json.loads(local_pipeline.joinpath(*SHARD_STATE).read_text())['finished'] == finished
+
+
+def test_lost_watermark_does_not_count_compacted_days_twice(local_pipeline, write_log, fixture_lines):
+    # July is finished: the first run compacts it and folds its day states
+    write_log('E2ABC.2026-07-31-09.abcd1234.gz', fixture_lines('sample-cloudfront-log.txt'))
+    run()
+    expected = read_output(local_pipeline)
+    state = local_pipeline / 'website' / 'analytics-state'
+    assert not list(state.glob('dedup/2026/2026-07-*.json'))
+    assert state.joinpath('dedup', '2026', '2026-07.json').exists()
+
+    state.joinpath('watermark.json').unlink()
+    run()
+    assert read_output(local_pipeline) == expected
+
+
+def test_watermark_read_errors_are_raised(local_pipeline, monkeypatch):
+    assert handler.read_watermark() == {"last_processed": None, "last_key": None}
+
+    def failing_get(self, bucket, key):
+        raise OSError('SlowDown')
+
+    monkeypatch.setattr(storage.LocalStorage, 'get', failing_get)
+    with pytest.raises(OSError):
+        handler.read_watermark()
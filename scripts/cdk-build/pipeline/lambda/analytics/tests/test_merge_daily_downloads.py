@@ -0,0 +1,160 @@
+"""
+Cross-run merging: N incremental runs over a day's logs must give the same
+day aggregates as one run over all of them.
+"""
+import random
+
+import pytest
+
+import handler
+from hll import HyperLogLog
+from storage import ObjectNotFound
+
+DATES = ('2026-07-30', '2026-07-31')
+IPS = (
+    '203.0.113.7', '203.0.113.8', '198.51.100.1',
+    # Siblings of one /64, deduplicated together
+    '2001:db8:1:1::1', '2001:db8:1:1::2', '2001:db8:1:1::3', '2001:db8:1:2::1',
+)
+UAS = ('Overcast/3.0', 'AppleCoreMedia/1.0.0 (iPhone)')
+EPISODES = ('300', '301')
+
+
+class MemoryStorage:
+    """Storage backend over a dict, enough for the merge path."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def get(self, bucket, key):
+        try:
+            return self.objects[bucket, key]
+        except KeyError:
+            raise ObjectNotFound(key) from None
+
+    def put(self, bucket, key, body, content_type=None, **headers):
+        self.objects[bucket, key] = body
+
+    def list(self, bucket, prefix='', start_after=None):
+        for b, key in sorted(self.objects):
+            if b == bucket and key.startswith(prefix) and (not start_after or key > start_after):
+                yield {'Key': key}
+
+    def delete(self, bucket, keys):
+        for key in keys:
+            self.objects.pop((bucket, key), None)
+
+
+@pytest.fixture
+def small_thresholds(monkeypatch):
+    # Thresholds a few random requests can cross
+    monkeypatch.setattr(handler, 'MIN_DOWNLOAD_BYTES', 1000)
+    monkeypatch.setattr(handler, 'MAX_REQUESTS_PER_IP_DAY', 6)
+    # Countries that differ between siblings of a /64, so the request a
+    # download is attributed to shows in the aggregate
+    monkeypatch.setattr(handler, 'lookup_country', lambda ip: f"C{ip[-1]}")
+
+
+def random_record(rng):
+    status = rng.choice((200, 206, 206))
+    range_start = range_end = None
+    if status == 206:
+        range_start = rng.choice((0, 0, rng.randrange(0, 1500)))
+        range_end = range_start + rng.choice((1, rng.randrange(1, 900)))
+    return handler.DownloadRecord(
+        date=rng.choice(DATES),
+        time=f"10:{rng.randrange(3):02d}:{rng.randrange(3):02d}",
+        ip=rng.choice(IPS),
+        ua=rng.choice(UAS),
+        episode=rng.choice(EPISODES),
+        sc_bytes=rng.randrange(0, 1300),
+        status=status,
+        range_start=range_start,
+        range_end=range_end,
+        is_range_probe=range_start == 0 and range_end == 1,
+        show='awsfr',
+    )
+
+
+def merge_runs(runs):
+    """Merge each run into day files and states, as main() does; return the day aggregates."""
+    storage = MemoryStorage()
+    for records in runs:
+        aggregator = handler.DailyAggregator().add_all(records)
+        metrics, previous, states = handler.merge_daily_downloads(aggregator, storage, 'website')
+        handler.write_daily_aggregate(metrics, storage, 'website', previous)
+        handler.write_day_states(states, storage, 'website')
+    return {date: handler.read_daily_aggregate(date, storage, 'website') for date in DATES}
+
+
+def comparable(day):
+    if day is None or not day['downloads']:
+        return None
+    return {
+        'downloads': day['downloads'],
+        'listeners': day['listeners'],
+        'episodes': day['episodes'],
+        'countries': day['countries'],
+        'listenerSketch': HyperLogLog.from_string(day['listenerSketch']).registers,
+    }
+
+
+def split(rng, records, runs):
+    cuts = sorted(rng.sample(range(1, len(records)), runs - 1))
+    return [records[i:j] for i, j in zip([0] + cuts, cuts + [len(records)])]
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_incremental_runs_equal_one_run(small_thresholds, seed):
+    rng = random.Random(seed)
+    records = [random_record(rng) for _ in range(rng.randrange(20, 60))]
+    expected = handler.DailyAggregator().add_all(records).aggregate()
+
+    runs = split(rng, records, rng.randrange(2, 6))
+    merged = merge_runs(runs)
+    for date in DATES:
+        assert comparable(merged[date]) == comparable(expected.get(date)), date
+
+
+def test_excessive_sibling_gives_the_download_back(small_thresholds):
+    # Run 1: the session of the /64 reaches the threshold with the bytes of
+    # two addresses, the first of which later becomes excessive
+    first = dict(date=DATES[0], ua=UAS[0], episode='300', status=206, show='awsfr', is_range_probe=False)
+    run1 = [
+        handler.DownloadRecord(time='10:00:00', ip=IPS[3], sc_bytes=600, range_start=0, range_end=599, **first),
+        handler.DownloadRecord(time='10:00:05', ip=IPS[4], sc_bytes=600, range_start=600, range_end=1199, **first),
+    ]
+    run2 = [
+        handler.DownloadRecord(time='11:00:00', ip=IPS[3], sc_bytes=600, range_start=0, range_end=599, **first)
+        for _ in range(6)
+    ]
+    assert merge_runs([run1])[DATES[0]]['downloads'] == 1
+    # Without IPS[3], IPS[4] alone served 600 bytes: below the threshold
+    assert comparable(merge_runs([run1, run2])[DATES[0]]) is None
+    assert handler.DailyAggregator().add_all(run1 + run2).aggregate() == {}
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_run_stopped_before_saving_states_is_merged_again(small_thresholds, seed):
+    rng = random.Random(seed)
+    records = [random_record(rng) for _ in range(rng.randrange(20, 60))]
+    expected = handler.DailyAggregator().add_all(records).aggregate()
+    first, second = split(rng, records, 2)
+
+    storage = MemoryStorage()
+    metrics, previous, states = handler.merge_daily_downloads(
+        handler.DailyAggregator().add_all(first), storage, 'website')
+    handler.write_daily_aggregate(metrics, storage, 'website', previous)
+    handler.write_day_states(states, storage, 'website')
+    # The second run writes its aggregates, then stops before its states
+    metrics, previous, _ = handler.merge_daily_downloads(handler.DailyAggregator().add_all(second), storage, 'website')
+    handler.write_daily_aggregate(metrics, storage, 'website', previous)
+    # and is retried
+    metrics, previous, states = handler.merge_daily_downloads(
+        handler.DailyAggregator().add_all(second), storage, 'website')
+    handler.write_daily_aggregate(metrics, storage, 'website', previous)
+    handler.write_day_states(states, storage, 'website')
+
+    for date in DATES:
+        merged = handler.read_daily_aggregate(date, storage, 'website')
+        assert comparable(merged) == comparable(expected.get(date)), date
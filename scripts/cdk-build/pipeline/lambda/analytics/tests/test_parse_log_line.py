@@ -0,0 +1,54 @@
+"""
+Field positions of CloudFront standard log lines.
+
+The fixtures are real 33-field lines (see their #Fields header):
+sc-content-len is field 30, sc-range-start and sc-range-end are 31 and 32.
+"""
+import os
+
+import backfill
+import handler
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def fixture_line(name, time, ip):
+    """The log line of a fixture with the given time and client IP."""
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        for line in f:
+            fields = line.split('\t')
+            if not line.startswith('#') and fields[1] == time and fields[4] == ip:
+                assert len(fields) == 33
+                return line
+    raise LookupError(f"no line at {time} from {ip} in {name}")
+
+
+def test_range_fields_of_a_206():
+    line = fixture_line('test-entries.txt', '09:05:22', '192.168.1.50')
+    record = handler.parse_log_line(line)
+    assert (record.status, record.sc_bytes) == (206, 15000000)
+    assert (record.range_start, record.range_end) == (0, 15000000)
+    assert not record.is_range_probe
+
+
+def test_two_byte_probe_is_flagged():
+    # sc-content-len (20000000) must not be read as the range start
+    line = fixture_line('test-entries.txt', '09:06:00', '10.1.1.1')
+    record = handler.parse_log_line(line)
+    assert (record.range_start, record.range_end) == (0, 1)
+    assert record.is_range_probe
+
+
+def test_no_range_on_a_200():
+    line = fixture_line('sample-cloudfront-log.txt', '09:00:01', '88.170.34.85')
+    record = handler.parse_log_line(line)
+    assert record.status == 200
+    assert (record.range_start, record.range_end) == (None, None)
+    assert not record.is_range_probe
+
+
+def test_backfill_reads_the_same_fields():
+    line = fixture_line('test-entries.txt', '09:06:00', '10.1.1.1').replace('/awsfr/media/', '/media/')
+    record = backfill.parse_line(line)
+    assert (record['range_start'], record['range_end']) == (0, 1)
+    assert record['is_range_probe']
@@ -0,0 +1,86 @@
+"""
+DailyIndex: range sums from prefix arrays must equal a naive sum over the
+day aggregates, for any range, episode or country.
+"""
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from query import DailyIndex
+
+FIRST = date(2026, 6, 28)
+
+
+def iso(offset):
+    return (FIRST + timedelta(days=offset)).isoformat()
+
+
+def random_days(seed):
+    rng = random.Random(seed)
+    days = []
+    # about one day in four missing
+    for offset in (i for i in range(40) if rng.random() > 0.25):
+        episodes = {str(ep): rng.randrange(1, 50) for ep in rng.sample(range(295, 302), rng.randrange(0, 4))}
+        countries = {c: rng.randrange(1, 50) for c in rng.sample(('FR', 'BE', 'CA', 'CH'), rng.randrange(0, 3))}
+        days.append({
+            'date': iso(offset),
+            'downloads': sum(episodes.values()) + rng.randrange(5),
+            'episodes': episodes,
+            'countries': countries,
+        })
+    rng.shuffle(days)
+    return days
+
+
+def naive(days, start, end, dimension=None, key=None):
+    total = 0
+    for day in days:
+        if (start is None or day['date'] >= start) and (end is None or day['date'] < end):
+            total += day[dimension].get(key, 0) if dimension else day['downloads']
+    return total
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_ranges_match_naive_sums(seed):
+    rng = random.Random(seed)
+    days = random_days(seed)
+    index = DailyIndex(days)
+    for _ in range(50):
+        # includes empty, reversed and out-of-window ranges
+        start = rng.choice((None, iso(rng.randrange(-5, 45))))
+        end = rng.choice((None, iso(rng.randrange(-5, 45))))
+        assert index.downloads(start, end) == naive(days, start, end)
+        for episode in range(295, 302):
+            assert index.downloads(start, end, episode=episode) == naive(days, start, end, 'episodes', str(episode))
+        for country in ('FR', 'BE', 'CA', 'CH', 'US'):
+            assert index.downloads(start, end, country=country) == naive(days, start, end, 'countries', country)
+
+        expected = sorted(
+            ((c, naive(days, start, end, 'countries', c)) for c in ('FR', 'BE', 'CA', 'CH')),
+            key=lambda kv: (-kv[1], kv[0]))
+        assert index.breakdown('countries', start, end) == [kv for kv in expected if kv[1]]
+        assert index.breakdown('countries', start, end, limit=2) == [kv for kv in expected if kv[1]][:2]
+
+
+def test_daily_fills_missing_days():
+    days = [{'date': iso(0), 'downloads': 3}, {'date': iso(3), 'downloads': 5}]
+    index = DailyIndex(days)
+    assert len(index) == 4
+    assert index.daily() == [(iso(0), 3), (iso(1), 0), (iso(2), 0), (iso(3), 5)]
+    assert index.daily(iso(-10), iso(2)) == [(iso(0), 3), (iso(1), 0)]
+    assert index.daily(iso(3), iso(1)) == []
+
+
+def test_empty_index():
+    index = DailyIndex([])
+    assert len(index) == 0
+    assert index.first is None and index.last is None
+    assert index.downloads('2026-01-01', '2027-01-01') == 0
+    assert index.breakdown('episodes') == []
+    assert index.daily() == []
+
+
+def test_episode_and_country_together_are_rejected():
+    with pytest.raises(ValueError):
+        DailyIndex(random_days(0)).downloads(episode='300', country='FR')
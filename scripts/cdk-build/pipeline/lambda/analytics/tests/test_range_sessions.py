@@ -0,0 +1,112 @@
+"""
+Range-request sessions: the 960 KB threshold applies to the union of the
+byte ranges served to one (date, IP/64, UA, episode), overlaps counted once.
+"""
+import random
+
+import pytest
+
+import handler
+
+THRESHOLD = 960_000
+CHUNK = 100_000
+
+
+def request(range_start=None, range_end=None, sc_bytes=None, status=206, ip='203.0.113.7',
+            ua='AppleCoreMedia/1.0.0 (iPhone)', time='10:00:00'):
+    if sc_bytes is None:
+        sc_bytes = range_end - range_start + 1 if range_start is not None else 2_000_000
+    return handler.DownloadRecord(
+        '2026-07-30', time, ip, ua, '300', sc_bytes, status,
+        range_start == 0 and range_end == 1, range_start, range_end)
+
+
+def chunks(count, size=CHUNK, **kwargs):
+    return [request(i * size, (i + 1) * size - 1, **kwargs) for i in range(count)]
+
+
+def covered(ranges):
+    """Reference: bytes covered by [start, end) ranges."""
+    total = 0
+    reach = 0
+    for start, end in sorted(ranges):
+        start = max(start, reach)
+        if end > start:
+            total += end - start
+            reach = end
+    return total
+
+
+def test_served_range():
+    assert handler.served_range(200, 5_000_000, None, None) == (0, 5_000_000)
+    assert handler.served_range(206, 1000, 500, 1499) == (500, 1500)
+    # a 206 the client stopped early serves only sc-bytes
+    assert handler.served_range(206, 400, 500, 1499) == (500, 900)
+    # a 206 without range fields counts from the start
+    assert handler.served_range(206, 700, None, None) == (0, 700)
+
+
+@pytest.mark.parametrize('end, expected', [
+    (THRESHOLD - 1, ((0, THRESHOLD - 1),)),
+    (THRESHOLD, None),
+])
+def test_threshold_is_inclusive(end, expected):
+    assert handler.add_byte_range((), 0, end) == expected
+
+
+def test_overlapping_ranges_count_once():
+    ranges = handler.add_byte_range((), 0, 500_000)
+    ranges = handler.add_byte_range(ranges, 400_000, 900_000)
+    assert ranges == ((0, 900_000),)
+    ranges = handler.add_byte_range(ranges, 0, 900_000)
+    ranges = handler.add_byte_range(ranges, 900_000, THRESHOLD - 1)
+    assert ranges == ((0, THRESHOLD - 1),)
+    assert handler.add_byte_range(ranges, THRESHOLD - 1, THRESHOLD) is None
+
+
+def test_disjoint_ranges_add_up():
+    ranges = handler.add_byte_range((), 2_000_000, 2_500_000)
+    ranges = handler.add_byte_range(ranges, 0, 459_999)
+    assert ranges == ((0, 459_999), (2_000_000, 2_500_000))
+    assert handler.add_byte_range(ranges, 459_999, 460_000) is None
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_merge_byte_ranges_matches_covered_bytes(seed):
+    rng = random.Random(seed)
+    pieces = [sorted(rng.sample(range(0, 1_200_000, 10_000), 2)) for _ in range(rng.randrange(1, 12))]
+    ranges = ()
+    for start, end in pieces:
+        ranges = handler.merge_byte_ranges(ranges, ((start, end),))
+    if covered(pieces) >= THRESHOLD:
+        assert ranges is None
+    else:
+        assert covered(ranges) == sum(end - start for start, end in ranges) == covered(pieces)
+
+
+def test_streamed_episode_is_one_download():
+    records = chunks(10)
+    assert handler.filter_sessions(records) == records
+    aggregator = handler.DailyAggregator().add_all(records)
+    assert aggregator.aggregate()['2026-07-30']['downloads'] == 1
+
+
+def test_session_below_threshold_is_dropped():
+    # 900 KB, the first chunk fetched twice
+    records = chunks(9) + chunks(1)
+    assert handler.filter_sessions(records) == []
+    assert handler.DailyAggregator().add_all(records).aggregate() == {}
+
+
+def test_range_capped_at_sc_bytes():
+    records = [request(0, 1_999_999, sc_bytes=THRESHOLD - 1)]
+    assert handler.filter_sessions(records) == []
+    records.append(request(THRESHOLD - 1, THRESHOLD + 10))
+    assert handler.filter_sessions(records) == records
+
+
+def test_sessions_are_per_ip64_and_user_agent():
+    records = chunks(5, ip='2001:db8:1:1::1') + [request(5 * CHUNK, 10 * CHUNK - 1, ip='2001:db8:1:1::2')]
+    assert handler.filter_sessions(records) == records
+    other_ua = chunks(5) + [request(5 * CHUNK, 10 * CHUNK - 1, ua='Overcast/3.0')]
+    assert handler.filter_sessions(other_ua) == []
@@ -0,0 +1,60 @@
+"""
+Show routing: SHOW_ROUTES validation, and show_context() putting the
+module globals back however its block ends.
+"""
+import json
+
+import pytest
+
+import handler
+
+OTHER = handler.Show('other', '/other/media/', 'analytics-state/other/', 'other/site/data/analytics.json', '')
+
+
+def selected():
+    return handler.STATE_PREFIX, handler.OUTPUT_KEY, handler.OP3_SHOW_UUID
+
+
+def test_globals_restored_after_an_exception():
+    before = selected()
+    with pytest.raises(RuntimeError):
+        with handler.show_context(OTHER):
+            assert selected() == (OTHER.state_prefix, OTHER.output_key, '')
+            raise RuntimeError('publish failed')
+    assert selected() == before
+
+
+def test_nested_contexts_restore_in_order():
+    before = selected()
+    first = OTHER._replace(id='first', state_prefix='analytics-state/first/', output_key='first/analytics.json')
+    with handler.show_context(first):
+        with handler.show_context(OTHER):
+            assert handler.STATE_PREFIX == OTHER.state_prefix
+        assert handler.STATE_PREFIX == first.state_prefix
+    assert selected() == before
+
+
+def test_globals_restored_when_a_show_fails_in_main(local_pipeline, write_log, fixture_lines, monkeypatch):
+    awsfr = handler.SHOWS[0]
+    monkeypatch.setattr(handler, 'SHOWS', [awsfr, OTHER])
+    before = selected()
+
+    def publish_show(state, *args, **kwargs):
+        if handler.STATE_PREFIX == OTHER.state_prefix:
+            raise RuntimeError('publish failed')
+        return 0
+
+    monkeypatch.setattr(handler, 'publish_show', publish_show)
+    write_log('E2ABC.2026-07-31-09.abcd1234.gz', fixture_lines('sample-cloudfront-log.txt'))
+    with pytest.raises(RuntimeError):
+        handler.main({}, None)
+    assert selected() == before
+
+
+@pytest.mark.parametrize('field', handler.SHOW_ROUTE_FIELDS)
+def test_incomplete_routes_are_rejected(field):
+    route = {'show': 'other', 'uriPrefix': '/other/media/', 'statePrefix': 'analytics-state/other/',
+             'outputKey': 'other/site/data/analytics.json'}
+    del route[field]
+    with pytest.raises(ValueError, match=field):
+        handler.load_show_routes(json.dumps([route]))
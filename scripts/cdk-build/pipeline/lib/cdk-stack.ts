@@ -3,6 +3,7 @@ import * as codebuild from 'aws-cdk-lib/aws-codebuild';
 import * as codepipeline from 'aws-cdk-lib/aws-codepipeline';
 import * as codepipeline_actions from 'aws-cdk-lib/aws-codepipeline-actions';
 import * as s3 from 'aws-cdk-lib/aws-s3';
+import * as s3n from 'aws-cdk-lib/aws-s3-notifications';
 import { Platform } from 'aws-cdk-lib/aws-ecr-assets';
 import * as scheduler from 'aws-cdk-lib/aws-scheduler';
 import * as cloudfront from 'aws-cdk-lib/aws-cloudfront';
@@ -357,12 +358,18 @@ function handler(event) {
           image: lambda.Runtime.PYTHON_3_12.bundlingImage,
           command: [
             'bash', '-c',
-            'pip install -r requirements.txt -t /asset-output && cp -au . /asset-output',
+            // Precompiled bytecode: the code directory is read-only, so
+            // without it every cold start compiles handler.py again
+            'pip install -r requirements.txt -t /asset-output && cp -au . /asset-output'
+            + ' && python -m compileall -q -f --invalidation-mode unchecked-hash /asset-output',
           ],
         },
       }),
       memorySize: 512,
       timeout: cdk.Duration.minutes(5),
+      // One invocation at a time: the daily run, per-file merges and
+      // republishing all update the same state objects
+      reservedConcurrentExecutions: 1,
       logRetention: logs.RetentionDays.ONE_MONTH,
       environment: {
         LOG_BUCKET: logBucket.bucketName,
@@ -388,6 +395,13 @@ function handler(event) {
     analyticsLambda.addEnvironment('OP3_TOKEN_PARAM', '/podcast/op3-api-token');
     analyticsLambda.addEnvironment('OP3_SHOW_UUID', '82002a7f8d7e4ac29715b95b110c9339');
 
+    // SSM parameter access for the key of the IP-derived hashes (SecureString)
+    analyticsLambda.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['ssm:GetParameter'],
+      resources: [`arn:aws:ssm:${this.region}:${this.account}:parameter/podcast/analytics-hash-secret`],
+    }));
+    analyticsLambda.addEnvironment('HASH_SECRET_PARAM', '/podcast/analytics-hash-secret');
+
     // Daily trigger at 04:00 UTC
     new events.Rule(this, 'DailyAnalyticsRule', {
       ruleName: 'podcast-analytics-daily',
@@ -395,6 +409,22 @@ function handler(event) {
       targets: [new targets.LambdaFunction(analyticsLambda)],
     });
 
+    // Each delivered log file is merged as soon as it lands...
+    logBucket.addEventNotification(
+      s3.EventType.OBJECT_CREATED,
+      new s3n.LambdaDestination(analyticsLambda),
+      { prefix: 'cloudfront-logs/', suffix: '.gz' },
+    );
+
+    // ...and the merged changes are published at most every 10 minutes
+    new events.Rule(this, 'AnalyticsRepublishRule', {
+      ruleName: 'podcast-analytics-republish',
+      schedule: events.Schedule.rate(cdk.Duration.minutes(10)),
+      targets: [new targets.LambdaFunction(analyticsLambda, {
+        event: events.RuleTargetInput.fromObject({ republish: true }),
+      })],
+    });
+
     // CloudWatch alarm for Lambda errors
     const errorAlarm = analyticsLambda.metricErrors({
       period: cdk.Duration.hours(24),
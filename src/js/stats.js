@@ -1,6 +1,7 @@
 /**
  * Podcast Analytics Dashboard
- * Fetches analytics.json and renders Chart.js visualizations.
+ * Fetches summary.json and renders Chart.js visualizations; month and
+ * episode shards are fetched on demand.
  */
 
 // Country flag emoji lookup
@@ -29,20 +30,40 @@ function formatNumber(n) {
   return new Intl.NumberFormat('fr-FR').format(n);
 }
 
+async function fetchJson(url) {
+  const response = await fetch(url);
+  if (!response.ok) throw new Error(`HTTP ${response.status}`);
+  return await response.json();
+}
+
+function dataBaseUrl() {
+  // Relative URL in production, where page and data share the same origin;
+  // on localhost, fetch from production CloudFront
+  if (window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1') {
+    return 'https://podcast.stormacq.net/awsfr/data/';
+  }
+  return '../data/';
+}
+
+async function fetchData(url) {
+  // Brotli-encoded copy first (served with Content-Encoding: br, decoded by
+  // the browser); plain JSON if it is missing or cannot be decoded
+  try {
+    return await fetchJson(`${url}.br`);
+  } catch (err) {
+    return await fetchJson(url);
+  }
+}
+
 async function loadAnalytics() {
   try {
-    // Try relative URL first (works in production where page and data share same origin)
-    // Falls back to absolute URL for local development
-    let url = '../data/analytics.json';
-    
-    // If on localhost, fetch from production CloudFront
-    if (window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1') {
-      url = 'https://podcast.stormacq.net/awsfr/data/analytics.json';
+    // summary.json carries the shard index; analytics.json is the same
+    // document without it
+    try {
+      return await fetchData(dataBaseUrl() + 'summary.json');
+    } catch (err) {
+      return await fetchData(dataBaseUrl() + 'analytics.json');
     }
-
-    const response = await fetch(url);
-    if (!response.ok) throw new Error(`HTTP ${response.status}`);
-    return await response.json();
   } catch (err) {
     console.error('Failed to load analytics:', err);
     document.getElementById('kpi-7d').textContent = 'Erreur';
@@ -190,6 +211,78 @@ function renderMonthlyDownloads(data) {
         borderWidth: 1,
       }]
     },
+    options: {
+      responsive: true,
+      maintainAspectRatio: false,
+      plugins: { legend: { display: false } },
+      scales: {
+        x: { ticks: { color: colors.text }, grid: { color: colors.grid } },
+        y: { ticks: { color: colors.text }, grid: { color: colors.grid }, beginAtZero: true }
+      },
+      onClick: (event, elements) => {
+        if (elements.length > 0) {
+          showMonthDays(data, data.monthlyDownloads[elements[0].index].month);
+        }
+      }
+    }
+  });
+}
+
+// Month shards, fetched once when a month is first shown
+const monthShards = new Map();
+let monthDaysChart = null;
+
+function loadMonthShard(data, month) {
+  if (!monthShards.has(month)) {
+    monthShards.set(month, fetchData(dataBaseUrl() + data.shards.months[month]).catch(err => {
+      monthShards.delete(month);
+      throw err;
+    }));
+  }
+  return monthShards.get(month);
+}
+
+function renderMonthDays(data) {
+  const select = document.getElementById('select-month');
+  if (!select || !data.shards) return;
+
+  const months = Object.keys(data.shards.months).sort().reverse();
+  select.innerHTML = months.map(month => {
+    const name = new Date(month + '-15').toLocaleDateString('fr-FR', { month: 'long', year: 'numeric' });
+    return `<option value="${month}">${name}</option>`;
+  }).join('');
+  select.addEventListener('change', () => showMonthDays(data, select.value));
+
+  if (months.length) showMonthDays(data, months[0]);
+}
+
+async function showMonthDays(data, month) {
+  const ctx = document.getElementById('chart-month-days');
+  if (!ctx || !data.shards || !data.shards.months[month]) return;
+  document.getElementById('select-month').value = month;
+
+  let shard;
+  try {
+    shard = await loadMonthShard(data, month);
+  } catch (err) {
+    console.error(`Failed to load month ${month}:`, err);
+    return;
+  }
+
+  const colors = getChartColors();
+  if (monthDaysChart) monthDaysChart.destroy();
+  monthDaysChart = new Chart(ctx, {
+    type: 'bar',
+    data: {
+      labels: shard.days.map(d => d.date.slice(8)),
+      datasets: [{
+        label: 'Downloads',
+        data: shard.days.map(d => d.downloads),
+        backgroundColor: colors.secondary,
+        borderColor: colors.primary,
+        borderWidth: 1,
+      }]
+    },
     options: {
       responsive: true,
       maintainAspectRatio: false,
@@ -259,6 +352,82 @@ function renderTopEpisodes(data) {
       scales: {
         x: { ticks: { color: colors.text }, grid: { color: colors.grid }, beginAtZero: true },
         y: { ticks: { color: colors.text, font: { size: 11 } }, grid: { display: false } }
+      },
+      onClick: (event, elements) => {
+        if (elements.length > 0) {
+          showEpisodeHistory(data, episodes[elements[0].index].episode);
+        }
+      }
+    }
+  });
+}
+
+// Per-episode shards, fetched once when an episode is first shown
+const episodeShards = new Map();
+let episodeHistoryChart = null;
+
+function loadEpisodeShard(data, episode) {
+  if (!episodeShards.has(episode)) {
+    const path = data.shards.episodePath.replace('{episode}', episode);
+    episodeShards.set(episode, fetchData(dataBaseUrl() + path).catch(err => {
+      episodeShards.delete(episode);
+      throw err;
+    }));
+  }
+  return episodeShards.get(episode);
+}
+
+function renderEpisodeHistory(data) {
+  const select = document.getElementById('select-episode');
+  if (!select || !data.shards) return;
+
+  const titles = new Map((data.episodeDownloads || []).map(e => [e.episode, e.title]));
+  select.innerHTML = data.shards.episodes.slice().reverse().map(ep => {
+    const title = titles.get(ep);
+    return `<option value="${ep}">Ep ${ep}${title ? ' - ' + title.substring(0, 60) : ''}</option>`;
+  }).join('');
+  select.addEventListener('change', () => showEpisodeHistory(data, Number(select.value)));
+
+  const top = (data.episodeDownloads || [])[0];
+  if (top) showEpisodeHistory(data, top.episode);
+}
+
+async function showEpisodeHistory(data, episode) {
+  const ctx = document.getElementById('chart-episode-history');
+  if (!ctx || !data.shards || !data.shards.episodes.includes(episode)) return;
+  document.getElementById('select-episode').value = String(episode);
+
+  let shard;
+  try {
+    shard = await loadEpisodeShard(data, episode);
+  } catch (err) {
+    console.error(`Failed to load episode ${episode}:`, err);
+    return;
+  }
+
+  const colors = getChartColors();
+  if (episodeHistoryChart) episodeHistoryChart.destroy();
+  episodeHistoryChart = new Chart(ctx, {
+    type: 'line',
+    data: {
+      labels: shard.daily.map(d => d[0]),
+      datasets: [{
+        label: 'Downloads',
+        data: shard.daily.map(d => d[1]),
+        borderColor: colors.primary,
+        backgroundColor: colors.secondary,
+        fill: true,
+        pointRadius: 0,
+        tension: 0.2,
+      }]
+    },
+    options: {
+      responsive: true,
+      maintainAspectRatio: false,
+      plugins: { legend: { display: false } },
+      scales: {
+        x: { ticks: { color: colors.text, maxTicksLimit: 12 }, grid: { color: colors.grid } },
+        y: { ticks: { color: colors.text }, grid: { color: colors.grid }, beginAtZero: true }
       }
     }
   });
@@ -328,8 +497,10 @@ document.addEventListener('DOMContentLoaded', async () => {
 
   renderKPIs(data);
   renderMonthlyDownloads(data);
+  renderMonthDays(data);
   renderMonthlyListeners(data);
   renderTopEpisodes(data);
+  renderEpisodeHistory(data);
   renderCountries(data);
   renderOP3Comparison(data);
 });